@@ -28,11 +28,11 @@ setup(
         'Topic :: Scientific/Engineering :: Visualization',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
     keywords='neuroscience analysis sleep EEG ECoG',
     packages=find_packages(exclude=('tests', )),
+    python_requires='>=3.7',
     install_requires=[
         'numpy',
         'scipy',
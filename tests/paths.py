@@ -65,6 +65,18 @@ BIDS_IEEG_CHANNELS = BIDS_IEEG_PATH / 'sub-som682/ses-somecog01/ieeg/sub-som682_
 EXPORTED_PATH = test_path / 'exported'
 EXPORTED_PATH.mkdir(exist_ok=True)
 annot_file = EXPORTED_PATH / 'annot_scores.xml'
+annot_db_file = EXPORTED_PATH / 'annot_scores.db'
+filter_dataset_file = EXPORTED_PATH / 'filter_dataset.won'
+filter_memmap_file = EXPORTED_PATH / 'filter_dataset_out.dat'
+resample_dataset_file = EXPORTED_PATH / 'resample_dataset.won'
+segments_dataset_file = EXPORTED_PATH / 'segments_dataset.won'
+bids_layout_path = EXPORTED_PATH / 'bids_layout'
+open_dataset_file = EXPORTED_PATH / 'open_dataset.won'
+open_dataset_vhdr_file = EXPORTED_PATH / 'open_dataset.vhdr'
+header_cache_path = EXPORTED_PATH / 'header_cache'
+event_params_file = EXPORTED_PATH / 'event_params.csv'
+export_freq_file = EXPORTED_PATH / 'export_freq.csv'
+table_path = EXPORTED_PATH / 'table'
 annot_export_file = EXPORTED_PATH / 'annot_scores.csv'
 annot_fasst_export_file = EXPORTED_PATH / 'annot_fasst.xml'
 annot_sleepstats_path = EXPORTED_PATH / 'annot_sleepstats.csv'
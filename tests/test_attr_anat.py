@@ -1,4 +1,5 @@
 from os import environ
+from shutil import copyfile
 from numpy import array
 from numpy.testing import assert_array_equal
 from pytest import approx, raises
@@ -10,6 +11,7 @@ from .paths import (FREESURFER_HOME,
                     LUT_path,
                     fs_path,
                     surf_path,
+                    EXPORTED_PATH,
                     )
 
 environ['FREESURFER_HOME'] = str(FREESURFER_HOME)
@@ -49,6 +51,20 @@ def test_Surf_02():
     Surf(str(surf_path))
 
 
+def test_Surf_03():
+    cached_surf_path = EXPORTED_PATH / surf_path.name
+    copyfile(surf_path, cached_surf_path)
+
+    surf = Surf(cached_surf_path)
+    surf_cached0 = Surf(cached_surf_path, cache=True)
+    surf_cached1 = Surf(cached_surf_path, cache=True)
+
+    assert (EXPORTED_PATH / (surf_path.name + '.vert.npy')).exists()
+    assert_array_equal(surf.vert, surf_cached0.vert)
+    assert_array_equal(surf.vert, surf_cached1.vert)
+    assert_array_equal(surf.tri, surf_cached1.tri)
+
+
 def test_Freesurfer_01():
     with raises(OSError):
         Freesurfer('does_not_exist')
@@ -91,3 +107,11 @@ def test_Freesurfer_05():
 
 def test_Freesurfer_shift():
     approx(fs.surface_ras_shift) == array([5.39971924, 18., 0.])
+
+
+def test_Freesurfer_06():
+    regions, approx = fs.find_brain_regions([[37, 48, 16], [10, 0, 0]],
+                                            max_approx=2)
+    assert regions == ['ctx-rh-rostralmiddlefrontal',
+                       'Right-Cerebral-White-Matter']
+    assert approx == [0, 0]
@@ -5,11 +5,15 @@ from wonambi import Dataset
 from wonambi.attr import (Annotations,
                           create_empty_annotations,
                           )
-from wonambi.attr.annotations import create_annotation
+from wonambi.attr.annotations import (create_annotation,
+                                      convert_annotations,
+                                      query_events,
+                                      )
 from wonambi.utils.exceptions import UnrecognizedFormat
 
 
 from .paths import (annot_file,
+                    annot_db_file,
                     annot_export_file,
                     annot_alice_path,
                     annot_compumedics_path,
@@ -104,6 +108,11 @@ def test_events():
     assert len(annot.event_types) == 2
     assert len(annot.get_events()) == 2
 
+    # empty channel, as in get_events and in the table of the GUI
+    annot.add_event('slowwave', (5, 6))
+    annot.remove_event('slowwave', chan='')
+    assert len(annot.get_events()) == 2
+
     annot.remove_event_type('spindle')
     assert len(annot.event_types) == 1
     assert len(annot.get_events()) == 1
@@ -113,6 +122,85 @@ def test_events():
     assert len(annot.get_events()) == 0
 
 
+def test_events_save_delay():
+    d = Dataset(ns2_file)
+    create_empty_annotations(annot_file, d)
+
+    annot = Annotations(annot_file, save_delay=60)
+    annot.add_rater('test')
+    annot.add_event('spindle', (3, 4), chan=('FP1', ))
+    assert annot.journal_file.exists()
+
+    # edits not yet in the xml file are replayed from the journal
+    recovered = Annotations(annot_file)
+    assert recovered.current_rater == 'test'
+    assert len(recovered.get_events()) == 1
+    assert not annot.journal_file.exists()
+
+    annot.add_event('spindle', (5, 6), chan=('FP1', ))
+    annot.flush()
+    assert not annot.journal_file.exists()
+    assert len(Annotations(annot_file).get_events()) == 2
+
+    # bulk edits (save=False) are not journaled
+    annot.set_stage_for_epoch(30, 'NREM2', save=False)
+    assert not annot.journal_file.exists()
+    annot.save()
+    annot.flush()
+    assert Annotations(annot_file).get_stage_for_epoch(30) == 'NREM2'
+
+
+def test_events_sqlite():
+    d = Dataset(ns2_file)
+    create_empty_annotations(annot_file, d)
+
+    annot = Annotations(annot_file)
+    annot.add_rater('test')
+    annot.set_stage_for_epoch(30, 'NREM2')
+    annot.add_event('slowwave', (1, 2), chan=('FP1', ))
+    annot.add_event('spindle', (31, 32), chan=('FP1', ))
+    annot.add_event('spindle', (35, 36), chan=('FP2', ))
+
+    annot_db = convert_annotations(annot_file, annot_db_file)
+    assert annot_db.get_events() == annot.get_events()
+    assert list(annot_db.epochs) == list(annot.epochs)
+
+    evts = query_events(annot_db_file, name='spindle', chan='FP1',
+                        stage=('NREM2', ))
+    assert evts == annot.get_events(name='spindle', chan='FP1',
+                                    stage=('NREM2', ))
+
+    annot_db.add_event('spindle', (60, 61))
+    assert len(query_events(annot_db_file, time=(50, 70))) == 1
+
+
+def test_query_events():
+    d = Dataset(ns2_file)
+    create_empty_annotations(annot_file, d)
+
+    annot = Annotations(annot_file)
+    annot.add_rater('test')
+    stages = annot.rater.find('stages')
+    stages.remove(stages[0])  # event before the first epoch
+    annot.set_stage_for_epoch(30, 'NREM2')
+    annot.set_stage_for_epoch(60, 'NREM3')
+    annot.set_stage_for_epoch(60, 'Poor', attr='quality')
+    annot.set_cycle_mrkr(30)
+    annot.set_cycle_mrkr(90, end=True)
+    annot.add_event('slowwave', (1, 2), chan=('FP1', ))
+    annot.add_event('spindle', (31, 32), chan=('FP1', ))
+    annot.add_event('spindle', (65, 66), chan=('FP1', 'FP2'))
+    annot.add_event('spindle', (95, 96))
+    convert_annotations(annot_file, annot_db_file)
+
+    for params in ({}, {'chan': (None, )}, {'chan': ('FP1', 'FP2')},
+                   {'stage': ('NREM2', 'NREM3')}, {'stage': ('Unknown', )},
+                   {'qual': 'Poor'}, {'cycle': [1, ]},
+                   {'name': 'spindle', 'time': (0, 70), 'chan': ('FP1', )}):
+        assert query_events(annot_db_file, **params) == annot.get_events(
+            **params)
+
+
 def test_epochs():
     d = Dataset(ns2_file)
     create_empty_annotations(annot_file, d)
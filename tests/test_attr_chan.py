@@ -2,6 +2,7 @@ from nibabel import load as nload
 from wonambi.attr import Channels, Freesurfer
 from wonambi.attr.chan import (find_channel_groups,
                                create_sphere_around_elec,
+                               create_sphere_around_chan,
                                )
 
 from .paths import (chan_path,
@@ -50,3 +51,16 @@ def test_channel_sphere():
     xyz_volume = xyz + fs.surface_ras_shift
     mask = create_sphere_around_elec(xyz, template_mri, distance=16)
     assert mask.sum() == 35
+
+
+def test_channel_sphere_batch():
+    fs = Freesurfer(fs_path)
+    some_chan = chan(lambda x: x.label in chan.return_label()[:3])
+    labels = create_sphere_around_chan(some_chan, template_mri_path,
+                                       distance=8, freesurfer=fs)
+    masks = create_sphere_around_chan(some_chan, template_mri_path,
+                                      distance=8, freesurfer=fs,
+                                      labelled=False)
+    assert masks.shape[0] == 3
+    assert (labels == 1).sum() <= masks[0].sum() == 4
+    assert ((labels > 0) == masks.any(axis=0)).all()
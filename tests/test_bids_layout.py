@@ -0,0 +1,113 @@
+from json import dump
+from os import utime
+from shutil import rmtree
+
+from wonambi.bids import layout
+from wonambi.bids.layout import BIDSLayout, get_layout, parse_name
+from wonambi.bids.utils import get_json
+
+from .paths import bids_layout_path, EXPORTED_PATH
+
+VALUES = {'sub': '01', 'ses': 'day1', 'task': 'rest', 'run': '1'}
+IEEG_PATH = bids_layout_path / 'sub-01' / 'ses-day1' / 'ieeg'
+
+
+def _create_dataset():
+    rmtree(bids_layout_path, ignore_errors=True)
+    IEEG_PATH.mkdir(parents=True)
+    _write(bids_layout_path / 'dataset_description.json', {})
+    _write(bids_layout_path / 'task-rest_ieeg.json', {'a': 0, 'b': 0})
+    _write(IEEG_PATH / 'sub-01_ses-day1_ieeg.json', {'b': 1, 'c': 1})
+    _write(IEEG_PATH / 'sub-01_ses-day1_task-rest_run-1_ieeg.json', {'c': 2})
+    _write(IEEG_PATH / 'sub-01_ses-day1_task-rest_run-2_ieeg.json', {'c': 3})
+    _write(IEEG_PATH / 'ses-day1_sub-01_ieeg.json', {'d': 4})  # wrong order
+    for run in (1, 2):
+        (IEEG_PATH / f'sub-01_ses-day1_task-rest_run-{run}_ieeg.edf').touch()
+
+
+def _write(filename, d):
+    with filename.open('w') as f:
+        dump(d, f)
+
+
+def test_bids_layout_walk():
+    _create_dataset()
+    filenames = get_layout(IEEG_PATH, refresh=True).walk(IEEG_PATH, VALUES,
+                                                          'ieeg.json')
+    assert [x.name for x in filenames] == [
+        'sub-01_ses-day1_task-rest_run-1_ieeg.json',
+        'sub-01_ses-day1_ieeg.json',
+        'task-rest_ieeg.json',
+        ]
+
+    # inheritance: lower directories and more entities take precedence
+    assert get_json(IEEG_PATH, VALUES, 'ieeg.json') == {'a': 0, 'b': 1,
+                                                        'c': 2}
+
+    # files written after the first lookup are found
+    _write(IEEG_PATH / 'sub-01_ses-day1_task-rest_run-1_channels.tsv', {})
+    assert len(get_layout(IEEG_PATH).walk(IEEG_PATH, VALUES,
+                                          'channels.tsv')) == 1
+    (IEEG_PATH / 'sub-01_ses-day1_task-rest_run-1_ieeg.json').unlink()
+    assert get_json(IEEG_PATH, VALUES, 'ieeg.json') == {'a': 0, 'b': 1,
+                                                        'c': 1}
+
+    new_path = bids_layout_path / 'sub-02' / 'ieeg'
+    new_path.mkdir(parents=True)
+    (new_path / 'sub-02_task-rest_ieeg.edf').touch()
+    assert len(get_layout(IEEG_PATH).get(sub='02')) == 1
+    assert len(get_layout(IEEG_PATH).walk(new_path, {'sub': '02',
+                                                     'task': 'rest'},
+                                          'ieeg.json')) == 1
+
+
+def test_bids_layout_get():
+    _create_dataset()
+    bids_layout = BIDSLayout(bids_layout_path)
+    runs = bids_layout.get(sub='01', suffix='ieeg', extension='.edf')
+    assert [x.name for x in runs] == ['sub-01_ses-day1_task-rest_run-1_ieeg.edf',
+                                      'sub-01_ses-day1_task-rest_run-2_ieeg.edf']
+    assert len(bids_layout.get(run='2')) == 2
+
+
+def test_bids_layout_cache():
+    _create_dataset()
+    cache_file = EXPORTED_PATH / 'bids_layout.json'
+    if cache_file.exists():
+        cache_file.unlink()
+
+    BIDSLayout(bids_layout_path, cache_file=cache_file)
+    assert cache_file.exists()
+    (IEEG_PATH / 'sub-01_ses-day1_task-rest_run-3_ieeg.edf').touch()
+    bids_layout = BIDSLayout(bids_layout_path, cache_file=cache_file)
+    assert len(bids_layout.get(suffix='ieeg', extension='.edf')) == 3
+
+    layout.CACHE_DIR = EXPORTED_PATH
+    try:
+        get_layout(IEEG_PATH, refresh=True)
+    finally:
+        layout.CACHE_DIR = None
+    assert list(EXPORTED_PATH.glob('bids_layout_*.json'))
+
+
+def test_bids_layout_mtime_resolution():
+    _create_dataset()
+    bids_layout = BIDSLayout(bids_layout_path)
+    mtime = IEEG_PATH.stat().st_mtime_ns
+
+    # a file created in the same tick as the listing does not change the mtime
+    (IEEG_PATH / 'sub-01_ses-day1_task-rest_run-3_ieeg.edf').touch()
+    utime(IEEG_PATH, ns=(mtime, mtime))
+    assert len(bids_layout.get(run='3')) == 1
+
+    # directories modified long before the listing are not scanned again
+    old = mtime - 10 * 10 ** 9
+    utime(IEEG_PATH, ns=(old, old))
+    bids_layout.update()
+    assert bids_layout._dirs[IEEG_PATH][0] == old / 10 ** 9
+
+
+def test_bids_parse_name():
+    assert parse_name('sub-01_T1w.nii.gz') == ({'sub': '01'}, 'T1w',
+                                               '.nii.gz')
+    assert parse_name('dataset_description.json') is None
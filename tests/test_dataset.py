@@ -1,6 +1,17 @@
-from wonambi import Dataset
+from os import utime
 
-from .paths import micromed_file
+from pytest import raises
+
+from wonambi import Dataset, open_dataset
+from wonambi.dataset import _header_cache_file
+from wonambi.ioeeg import BlackRock, Wonambi
+from wonambi.utils import create_data
+
+from .paths import (micromed_file,
+                    open_dataset_file,
+                    open_dataset_vhdr_file,
+                    header_cache_path,
+                    )
 
 
 def test_dataset_events():
@@ -12,3 +23,86 @@ def test_dataset_events():
     assert data.time[0].shape[0] == 512
     assert data.time[0].shape[0] == data.data[0].shape[1]
     assert (data.number_of('time') == 512).all()
+
+
+def test_open_dataset():
+    data = create_data(n_chan=2, time=(0, 2))
+    data.export(open_dataset_file, export_format='wonambi')
+
+    d1 = open_dataset(open_dataset_file)
+    d2 = open_dataset(str(open_dataset_file))
+    assert d1 is d2
+    assert d1.header['n_samples'] == 512
+
+    # the file was modified, the dataset is opened again
+    stat = open_dataset_file.stat()
+    utime(open_dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    d3 = open_dataset(open_dataset_file)
+    assert d3 is not d1
+
+
+def test_dataset_header_cache(monkeypatch):
+    data = create_data(n_chan=2, time=(0, 2))
+    data.export(open_dataset_file, export_format='wonambi')
+    for cache_file in header_cache_path.glob('*.pkl'):
+        cache_file.unlink()
+
+    d1 = Dataset(open_dataset_file, header_cache=header_cache_path)
+    assert len(list(header_cache_path.glob('*.pkl'))) == 1
+
+    def _fail(self):
+        raise AssertionError('the header should be read from the cache')
+
+    with monkeypatch.context() as m:
+        m.setattr(Wonambi, 'return_hdr', _fail)
+        d2 = Dataset(open_dataset_file, header_cache=header_cache_path)
+        assert d2.header['chan_name'] == d1.header['chan_name']
+        assert d2.header['start_time'] == d1.header['start_time']
+        assert (d2.read_data().data[0] == d1.read_data().data[0]).all()
+
+    # the file was modified, so the header is read again
+    stat = open_dataset_file.stat()
+    utime(open_dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with monkeypatch.context() as m:
+        m.setattr(Wonambi, 'return_hdr', _fail)
+        with raises(AssertionError):
+            Dataset(open_dataset_file, header_cache=header_cache_path)
+
+
+def test_dataset_header_cache_companion_files():
+    data = create_data(n_chan=2, time=(0, 2))
+    data.export(open_dataset_vhdr_file, export_format='brainvision')
+    for cache_file in header_cache_path.glob('*.pkl'):
+        cache_file.unlink()
+
+    d1 = open_dataset(open_dataset_vhdr_file)
+    h1 = Dataset(open_dataset_vhdr_file, header_cache=header_cache_path).header
+    assert d1.header['n_samples'] == h1['n_samples'] == 512
+
+    # only the .eeg file changes, the .vhdr file is the same
+    eeg_file = open_dataset_vhdr_file.with_suffix('.eeg')
+    with eeg_file.open('ab') as f:
+        f.write(bytes(eeg_file.stat().st_size))
+    stat = eeg_file.stat()
+    utime(eeg_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    d2 = open_dataset(open_dataset_vhdr_file)
+    h2 = Dataset(open_dataset_vhdr_file, header_cache=header_cache_path).header
+    assert d2 is not d1
+    assert d2.header['n_samples'] == h2['n_samples'] == 1024
+
+
+def test_dataset_header_cache_key(monkeypatch):
+    data = create_data(n_chan=2, time=(0, 2))
+    data.export(open_dataset_file, export_format='wonambi')
+
+    cache_file, _ = _header_cache_file(open_dataset_file, Wonambi, None,
+                                       header_cache_path)
+    monkeypatch.setattr('wonambi.dataset.__version__', '0.0.0')
+    old_cache_file, _ = _header_cache_file(open_dataset_file, Wonambi, None,
+                                           header_cache_path)
+    assert cache_file != old_cache_file
+
+    # the header of the .nev file is read with the .nsX file
+    assert (BlackRock.companion_files(open_dataset_file.with_suffix('.ns4'))
+            == [open_dataset_file.with_suffix('.nev'), ])
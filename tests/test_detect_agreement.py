@@ -1,3 +1,8 @@
+from time import perf_counter
+
+from numpy.random import RandomState
+from scipy.sparse import issparse
+
 from wonambi.detect import consensus, match_events
 
 rater1 = [
@@ -32,4 +37,58 @@ def test_agreement_match_events():
     
     assert match.precision == 0.5
     assert match.recall == 0.5714285714285714
-    assert match.f1score == 0.5333333333333333
\ No newline at end of file
+    assert match.f1score == 0.5333333333333333
+
+
+def _random_events(rng, n_events, duration):
+    starts = sorted(rng.uniform(0, duration, n_events))
+    return [{'start': start,
+             'end': start + rng.uniform(0.3, 3),
+             'chan': ('Cz', 'Fz')[rng.randint(2)]} for start in starts]
+
+
+def test_agreement_sweep_vs_dense():
+    """The sweep-line and the dense implementation give the same results."""
+    rng = RandomState(0)
+    raters = [_random_events(rng, 2000, 3600) for i in range(3)]
+
+    dense = consensus(raters, 0.5, 256, min_duration=0.2, method='dense')
+    sweep = consensus(raters, 0.5, 256, min_duration=0.2, method='sweep')
+    assert dense.events == sweep.events
+
+    cons_dense = consensus(raters, 1, 256, by_chan=True, method='dense')
+    cons_sweep = consensus(raters, 1, 256, by_chan=True, method='sweep')
+    assert cons_dense.events == cons_sweep.events
+
+    for by_chan in (False, True):
+        dense = match_events(raters[0], raters[1], 0.2, by_chan=by_chan,
+                             method='dense')
+        sweep = match_events(raters[0], raters[1], 0.2, by_chan=by_chan,
+                             method='sweep')
+        assert dense.f1score == sweep.f1score
+        assert issparse(sweep._tp)  # boolean array only when tp is used
+        assert (dense.tp == sweep.tp).all()
+        assert (dense.fp == sweep.fp).all()
+        assert (dense.fn == sweep.fn).all()
+        assert dense.f1score == sweep.f1score
+
+        sparse = match_events(raters[0], raters[1], 0.2, by_chan=by_chan,
+                              sparse=True)
+        assert (sparse.tp.toarray() == dense.tp).all()
+        assert sparse.f1score == dense.f1score
+
+
+def test_agreement_benchmark():
+    """Benchmark of the sweep-line and the dense implementation (the time is
+    only printed, run with pytest -s)."""
+    rng = RandomState(0)
+    raters = [_random_events(rng, 5000, 8 * 3600) for i in range(3)]
+
+    for method in ('dense', 'sweep'):
+        t0 = perf_counter()
+        consensus(raters, 0.5, 256, min_duration=0.2, method=method)
+        t1 = perf_counter()
+        match_events(raters[0], raters[1], 0.2, method=method).f1score
+        t2 = perf_counter()
+        print(f'{method}: consensus {t1 - t0:.3f} s, '
+              f'match_events {t2 - t1:.3f} s')
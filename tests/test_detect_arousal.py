@@ -0,0 +1,77 @@
+from numpy import abs, argmin, zeros
+from numpy.random import RandomState
+from numpy.testing import assert_array_equal
+
+from wonambi.detect.arousal import find_start_end, first_below, splitpoint
+
+
+def _splitpoint_loop(a, sf):
+    split = zeros(a.shape[1])
+    for i in range(a.shape[1]):
+        c1 = a[:, i].cumsum()
+        c2 = a[::-1, i].cumsum()[::-1]
+        split[i] = sf[argmin(abs(c1 - c2))]
+    return split
+
+
+def _first_below_loop(x, first, thresh):
+    idx = []
+    for one_first, one_thresh in zip(first, thresh):
+        i = one_first
+        while i < len(x) and x[i] >= one_thresh:
+            i += 1
+        idx.append(min(i, len(x)))
+    return idx
+
+
+def _find_start_end_loop(starts, dat_eq2, det_thresh_end, min_interval):
+    """Loop used before find_start_end was vectorized."""
+    new_starts = zeros(len(starts), dtype=bool)
+    ends = zeros(len(starts) - 1, dtype=bool)
+    iter_len = len(starts) - 2
+    i = 0
+    while i <= iter_len:
+        if starts[i]:
+            for j, k in enumerate(dat_eq2[i + 2:-1]):
+                if k < dat_eq2[i] * det_thresh_end:
+                    new_starts[i] = True
+                    ends[i + j + 1] = True
+                    break
+            i += j + min_interval
+        else:
+            i += 1
+    return new_starts, ends
+
+
+def test_detect_arousal_splitpoint():
+    rng = RandomState(0)
+    a = rng.uniform(size=(30, 200))
+    sf = rng.uniform(size=30).cumsum()
+    assert_array_equal(splitpoint(a, sf), _splitpoint_loop(a, sf))
+    assert splitpoint(a[:, 5], sf) == _splitpoint_loop(a[:, 5:6], sf)[0]
+
+
+def test_detect_arousal_first_below():
+    rng = RandomState(0)
+    x = rng.uniform(size=1000)
+    first = rng.randint(0, 1100, size=300)
+    thresh = rng.uniform(0, 0.1, size=300)
+    assert_array_equal(first_below(x, first, thresh),
+                       _first_below_loop(x, first, thresh))
+
+
+def test_detect_arousal_find_start_end():
+    rng = RandomState(0)
+    for min_interval in (1, 3, 10):
+        # with 0.34, few arousals have an end
+        for thresh_end, p_start in ((0.6, 0.01), (0.6, 0.1), (0.6, 0.5),
+                                    (0.34, 0.1)):
+            starts = rng.uniform(size=2000) < p_start
+            starts[-1] = False
+            dat_eq2 = rng.uniform(5, 15, size=2000)
+            new_starts, ends = find_start_end(starts, dat_eq2, thresh_end,
+                                              min_interval)
+            loop_starts, loop_ends = _find_start_end_loop(
+                starts, dat_eq2, thresh_end, min_interval)
+            assert_array_equal(new_starts, loop_starts)
+            assert_array_equal(ends, loop_ends)
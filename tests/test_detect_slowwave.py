@@ -2,6 +2,7 @@ from pytest import approx
 
 from wonambi import Dataset
 from wonambi.detect.slowwave import DetectSlowWave
+from wonambi.utils import create_data
 
 from .paths import psg_file
 
@@ -44,3 +45,21 @@ def test_detect_slowwave_to_data():
 
     sw_ptp = sw.to_data('ptp')
     assert approx(sw_ptp(0)[1]) == 63.0
+
+
+def test_detect_slowwave_chunks():
+    detsw = DetectSlowWave(method='AASM/Massimini2004')
+    detsw.invert = True
+    sw = detsw(data)
+
+    sw_chunks = detsw(data, n_jobs=2, chunk_duration=10, columnar=True)
+    assert sw_chunks.events == []
+    assert len(sw_chunks.columns['start']) == len(sw.events)
+    assert approx(sw_chunks.columns['start']) == [x['start'] for x in sw]
+    assert list(sw_chunks.columns['chan']) == [x['chan'] for x in sw]
+
+
+def test_detect_slowwave_no_chan():
+    detsw = DetectSlowWave()
+    sw = detsw(create_data(n_chan=0, time=(0, 10)), n_jobs=2, columnar=True)
+    assert len(sw.columns['start']) == 0
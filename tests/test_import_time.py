@@ -0,0 +1,44 @@
+from subprocess import run
+from sys import executable
+
+# these modules are slow to import and should be loaded only when used
+HEAVY_MODULES = ('scipy', 'h5py', 'mne', 'PyQt5', 'nibabel')
+MAX_IMPORT_TIME = 2  # s, very generous: it's ~0.1s on a normal computer
+
+
+def _import_in_new_process(code):
+    script = ('import sys, time\n'
+              't = time.perf_counter()\n'
+              f'{code}\n'
+              'print(time.perf_counter() - t)\n'
+              'print(" ".join(sys.modules))\n')
+    p = run([executable, '-c', script], capture_output=True, text=True,
+            check=True)
+    duration, modules = p.stdout.splitlines()
+    return float(duration), modules.split()
+
+
+def test_import_time():
+    duration, modules = _import_in_new_process('import wonambi')
+    assert duration < MAX_IMPORT_TIME
+    for heavy in HEAVY_MODULES:
+        assert heavy not in modules
+
+
+def test_import_lazy():
+    duration, modules = _import_in_new_process(
+        'from wonambi import Dataset\n'
+        'from wonambi.ioeeg import Edf\n'
+        'from wonambi.detect import DetectSpindle')
+    assert 'wonambi.ioeeg.edf' in modules
+    assert 'wonambi.ioeeg.eeglab' not in modules
+    assert 'wonambi.detect.spindle' in modules
+    assert 'wonambi.detect.slowwave' not in modules
+
+
+def test_import_without_pandas():
+    duration, modules = _import_in_new_process(
+        'import wonambi.attr.annotations\n'
+        'import wonambi.trans.analyze')
+    assert 'wonambi.utils.table' in modules
+    assert 'pandas' not in modules
@@ -3,6 +3,7 @@ from wonambi.source import Linear
 
 from .paths import (surf_path,
                     chan_path,
+                    EXPORTED_PATH,
                     )
 
 def test_source_linear():
@@ -10,3 +11,15 @@ def test_source_linear():
     channels = Channels(chan_path)
 
     Linear(surf, channels)
+
+
+def test_source_linear_cache():
+    surf = Surf(surf_path)
+    channels = Channels(chan_path)
+
+    cache_dir = EXPORTED_PATH / 'xyz2surf'
+    l0 = Linear(surf, channels, cache_dir=cache_dir)
+    l1 = Linear(surf, channels, cache_dir=cache_dir)
+
+    assert len(list(cache_dir.glob('xyz2surf_*.npz'))) >= 1
+    assert (l0.inv != l1.inv).nnz == 0
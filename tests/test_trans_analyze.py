@@ -0,0 +1,118 @@
+from csv import reader
+
+from numpy import load, sqrt
+from numpy.random import seed
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from wonambi.trans.analyze import (event_params, event_params_table,
+                                   export_event_params, export_freq,
+                                   export_freq_band, _chunks)
+from wonambi.trans.frequency import band_power, frequency
+from wonambi.utils import create_data
+
+from .paths import event_params_file, export_freq_file
+
+
+def _create_segments():
+    seed(0)
+    segments = []
+    for i, dur in enumerate((0.5, 1, 0.5, 0.75)):
+        segments.append({'data': create_data(n_chan=2, time=(i, i + dur)),
+                         'trans_data': create_data(n_chan=2,
+                                                   time=(i, i + dur)),
+                         'n_stitch': 0,
+                         'stage': 'NREM2',
+                         'cycle': None,
+                         'name': 'spindle',
+                         })
+    return segments
+
+
+def test_event_params_table():
+    segments = _create_segments()
+    evt_table = event_params_table(segments, 'all', band=(10, 16),
+                                   prep={'rms': True})
+    assert len(evt_table['chan']) == 8
+
+    for i, seg in enumerate(segments):
+        rows = evt_table['segment'] == i
+        dat = seg['data'].data[0]
+        assert_array_almost_equal(evt_table['minamp'][rows], dat.min(axis=1))
+        assert_array_almost_equal(evt_table['ptp'][rows],
+                                  dat.max(axis=1) - dat.min(axis=1))
+        rms = sqrt((seg['trans_data'].data[0] ** 2).mean(axis=1))
+        assert_array_almost_equal(evt_table['rms'][rows], rms)
+
+        power, peakf = band_power(seg['data'], (10, 16), array_out=True)
+        assert_array_almost_equal(evt_table['power'][rows], power[:, 0])
+        assert_array_almost_equal(evt_table['peakpf'][rows], peakf[:, 0])
+
+
+def test_event_params_export():
+    segments = _create_segments()
+    slopes = {'avg_slope': True, 'max_slope': False, 'prep': False,
+              'invert': False}
+    params = event_params(segments, 'all', slopes=slopes)
+    assert params[1]['maxamp'].list_of_axes == ('chan', )
+    assert_array_almost_equal(params[1]['maxamp'](chan=['chan01'])[0],
+                              segments[1]['data'](chan=['chan01'])[0].max())
+    assert params[1]['power']['chan01'] > 0
+
+    export_event_params(event_params_file, params, count=4)
+    with event_params_file.open() as f:
+        from_list = f.read()
+
+    evt_table = event_params(segments, 'all', slopes=slopes, table=True)
+    export_event_params(event_params_file, evt_table, count=4)
+    with event_params_file.open() as f:
+        assert f.read() == from_list
+
+
+def test_event_params_iterator(monkeypatch):
+    segments = _create_segments()
+    evt_table = event_params(segments, 'all', table=True)
+
+    # segments are consumed in chunks
+    monkeypatch.setattr('wonambi.trans.analyze.EVT_CHUNK', 3)
+    from_iter = event_params(iter(segments), 'all', table=True)
+    assert_array_equal(from_iter['segment'], evt_table['segment'])
+    assert_array_almost_equal(from_iter['rms'], evt_table['rms'])
+    assert_array_almost_equal(from_iter['power'], evt_table['power'])
+
+    # lists are split too, when the progress is shown
+    assert len(list(_chunks(segments, 2 ** 22))) == 1
+    assert [len(x) for x in _chunks(segments, 2 ** 22, 3)] == [3, 1]
+
+
+def test_export_freq():
+    segments = _create_segments()
+    xfreq = []
+    for seg in segments:
+        xfreq.append({'data': frequency(seg['data'], duration=0.25),
+                      'start': seg['data'].axis['time'][0][0],
+                      'end': seg['data'].axis['time'][0][-1],
+                      'duration': seg['data'].number_of('time')[0] / 256,
+                      'n_stitch': seg['n_stitch'],
+                      'stage': seg['stage'],
+                      'cycle': (0, 100, 1),
+                      'name': seg['name'],
+                      })
+
+    export_freq(xfreq, export_freq_file)
+    with export_freq_file.open() as f:
+        rows = list(reader(f))
+    assert len(rows) == 2 + 8
+    assert rows[1][:9] == ['Segment index', 'Start time', 'End time',
+                           'Duration', 'Stitches', 'Stage', 'Cycle',
+                           'Event type', 'Channel']
+    assert rows[3][0] == '2'
+    assert rows[3][6:9] == ['1', 'spindle', 'chan01']
+    assert float(rows[3][-1]) == xfreq[0]['data'].data[0][1, -1]
+
+    npz_file = export_freq_file.with_suffix('.npz')
+    export_freq_band(xfreq, [(10, 16), (16, None)], npz_file)
+    table = load(npz_file)
+    assert_array_equal(table['chan'], ['chan00', 'chan01'] * 4)
+    power, _ = band_power(xfreq[0]['data'], (10, 16), array_out=True)
+    assert_array_almost_equal(table['10-16'][:2], power[:, 0])
+    assert 'band' not in xfreq[0]
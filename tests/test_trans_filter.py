@@ -1,8 +1,14 @@
 from numpy.random import seed
+from numpy.testing import assert_array_almost_equal
 from pytest import raises
+from scipy.signal import butter, filtfilt
 
+from wonambi import Dataset
 from wonambi.utils import create_data
-from wonambi.trans import filter_, frequency, convolve
+from wonambi.trans import filter_, filter_dataset, frequency, convolve
+from wonambi.trans.filter import design_filter, design_notch
+
+from .paths import filter_dataset_file, filter_memmap_file
 
 
 seed(0)
@@ -37,8 +43,43 @@ def test_filter_notch():
 
     assert (freq_data(trial=0, freq=50) > freq_filt(trial=0, freq=50)).all()
 
+    # many harmonics, but the padding is the same as for one harmonic
+    short = create_data(n_trial=1, s_freq=5000, time=(0, 0.05))
+    filter_(short, ftype='notch', notchfreq=50)
+
+
+def test_filter_batch():
+    data3 = create_data(n_trial=3)
+    filt = filter_(data3, high_cut=100)
+
+    b, a = butter(4, 100 / (data3.s_freq / 2), btype='lowpass')
+    for i in range(3):
+        x = filtfilt(b, a, data3.data[i], axis=data3.index_of('time'))
+        assert_array_almost_equal(filt.data[i][:, 100:-100], x[:, 100:-100])
+
+
+def test_filter_design_cache():
+    design_filter.cache_clear()
+    filter_(data, low_cut=10, high_cut=100)
+    filter_(data, low_cut=10, high_cut=100)
+    assert design_filter.cache_info().hits == 1
+    assert not design_filter('butter', 4, 0.1, 'lowpass', 40).flags.writeable
+    assert not design_notch(50, 25, 256).flags.writeable
+
 
 # =============================================================================
 # def test_convolve():
 #     convolve(data, 'hann')
 # =============================================================================
+
+
+def test_filter_dataset():
+    long_data = create_data(n_trial=1, n_chan=3, time=(0, 60), s_freq=256)
+    long_data.export(filter_dataset_file, export_format='wonambi')
+    d = Dataset(filter_dataset_file)
+
+    whole = filter_(d.read_data(), low_cut=1, high_cut=30)
+    blocks = filter_dataset(d, low_cut=1, high_cut=30, block_duration=10,
+                            out=filter_memmap_file)
+    assert_array_almost_equal(whole.data[0], blocks.data[0])
+    assert_array_almost_equal(whole.axis['time'][0], blocks.axis['time'][0])
@@ -1,11 +1,16 @@
+from importlib import import_module
+
 from wonambi.utils import create_data
 from numpy import arange, pi, sqrt, cos, sum
+from pytest import raises
+from scipy.signal import coherence, fftconvolve
 from scipy.signal.spectral import _spectral_helper
 from numpy.random import seed
 from numpy.testing import assert_array_equal, assert_array_almost_equal, assert_almost_equal
 
-from wonambi.trans.frequency import _fft
-from wonambi.trans import frequency, math, timefrequency
+from wonambi.trans.frequency import (_fft, _create_morlet, _get_executor,
+                                     _get_tapers)
+from wonambi.trans import connectivity, frequency, math, select, timefrequency
 
 
 CORRECTION_FACTOR = 2 / 3
@@ -55,6 +60,76 @@ def test_trans_frequency_complex():
     assert freq.data[0].shape == (data.number_of('chan')[0], dur * s_freq, NW * 2 - 1)
 
 
+def test_trans_frequency_batch(monkeypatch):
+    seed(0)
+    data = create_data(n_trial=5, n_chan=2, s_freq=s_freq, time=(0, dur))
+    _get_tapers.cache_clear()
+    freq = frequency(data, taper='dpss', duration=1)
+    assert _get_tapers.cache_info().misses == 1
+
+    for i in range(data.number_of('trial')):
+        one_trial = frequency(select(data, trial=[i]), taper='dpss', duration=1)
+        assert_array_almost_equal(freq.data[i], one_trial.data[0])
+
+    freq_32 = frequency(data, taper='dpss', duration=1, dtype='float32',
+                        workers=2)
+    assert freq_32.data[0].dtype == 'float32'
+    assert_array_almost_equal(freq_32.data[3] / freq.data[3], 1, decimal=4)
+
+    # trials in blocks of 2 trials
+    # the module is shadowed by the function "frequency" in wonambi.trans
+    monkeypatch.setattr(import_module('wonambi.trans.frequency'),
+                        'FREQUENCY_BLOCK', 2 * data.data[0].size)
+    freq_blocks = frequency(data, taper='dpss', duration=1)
+    for i in range(data.number_of('trial')):
+        assert_array_equal(freq_blocks.data[i], freq.data[i])
+
+
+def test_trans_connectivity():
+    seed(0)
+    data = create_data(n_trial=3, n_chan=4, s_freq=s_freq, time=(0, dur))
+    csd = connectivity(data, method='csd', duration=1)
+    assert csd.list_of_axes == ('chan', 'chan2', 'freq')
+    assert csd.data[0].shape == (4, 4, s_freq // 2 + 1)
+
+    one_pair = [frequency(select(data, trial=[i], chan=['chan01', 'chan02']),
+                          output='csd', taper='hann', duration=1).data[0][0]
+                for i in range(data.number_of('trial'))]
+    assert_array_almost_equal(csd.data[0][1, 2], sum(one_pair, axis=0) / 3)
+    assert_array_almost_equal(csd.data[0][2, 1], csd.data[0][1, 2].conj())
+
+    coh = connectivity(data, duration=1)
+    assert_array_almost_equal(coh.data[0][0, 0], 1)
+    one_trial = connectivity(select(data, trial=[0]), duration=1)
+    f, Cxy = coherence(data.data[0][0], data.data[0][3], fs=s_freq,
+                       nperseg=s_freq, detrend='linear')
+    assert_array_almost_equal(one_trial.data[0][0, 3], Cxy)
+    assert (coh.data[0] <= 1 + 1e-10).all()
+
+    t = data.axis['time'][0]
+    data.data[0][1] = cos(2 * pi * 10 * t)
+    data.data[0][2] = cos(2 * pi * 10 * t + pi / 2)
+    plv = connectivity(select(data, trial=[0]), method='plv', duration=1)
+    assert_almost_equal(plv(chan=['chan01'], chan2=['chan02'], freq=[10])[0], 1)
+    imcoh = connectivity(select(data, trial=[0]), method='imcoh', duration=1)
+    assert_almost_equal(abs(imcoh(chan=['chan01'], chan2=['chan02'], freq=[10])[0]), 1)
+    assert_array_almost_equal(imcoh.data[0][0, 0], 0)
+
+    different_length = [data, create_data(n_chan=4, s_freq=s_freq, time=(0, 3))]
+    with raises(ValueError):
+        connectivity(different_length)
+    assert connectivity(different_length, duration=1).data[0].shape == (4, 4, s_freq // 2 + 1)
+
+
+def test_trans_frequency_executor():
+    executor, n_workers = _get_executor(2)
+    assert n_workers == 2
+    # another number of threads does not shut down the pool in use
+    assert _get_executor(3)[0] is not executor
+    assert _get_executor(2)[0] is executor
+    assert executor.submit(sum, [1, 2]).result() == 3
+
+
 def test_trans_timefrequency_spectrogram():
     seed(0)
     data = create_data(n_trial=1, n_chan=2, s_freq=s_freq, time=(0, dur))
@@ -80,6 +155,28 @@ def test_trans_timefrequency_stft():
     assert timefreq.data[0].shape == (data.number_of('chan')[0], 3, s_freq, NW * 2 - 1)
 
 
+def test_trans_timefrequency_morlet():
+    seed(0)
+    data = create_data(n_trial=2, n_chan=3, s_freq=s_freq, time=(0, dur))
+    foi = arange(2, 30, 4)
+    timefreq = timefrequency(data, method='morlet', foi=foi)
+    assert timefreq.list_of_axes == ('chan', 'time', 'freq')
+    assert timefreq.data[1].shape == (3, dur * s_freq, len(foi))
+
+    wavelets = _create_morlet({'foi': foi, 'ratio': 5, 'sigma_f': None,
+                               'dur_in_sd': 4, 'dur_in_s': None,
+                               'normalization': 'area', 'zero_mean': False},
+                              s_freq)
+    for i_w, wavelet in enumerate(wavelets):
+        tf = fftconvolve(data.data[1][2], wavelet, 'same')
+        assert_array_almost_equal(timefreq.data[1][2, :, i_w], tf)
+
+    timefreq_32 = timefrequency(data, method='morlet', foi=foi, n_jobs=1,
+                                dtype='complex64')
+    assert timefreq_32.data[0].dtype == 'complex64'
+    assert_array_almost_equal(timefreq_32.data[0], timefreq.data[0], decimal=5)
+
+
 seed(0)
 data = create_data(n_trial=1, n_chan=2, s_freq=s_freq, time=(0, dur), amplitude=10)
 x = data(trial=0, chan='chan00')
@@ -1,12 +1,12 @@
 from collections import OrderedDict
-from numpy import sum, zeros
+from numpy import stack, sum, zeros
 from numpy.random import seed
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 from pytest import raises
 
 from wonambi.utils import create_data
 from wonambi.trans import montage
-from wonambi.trans.montage import compute_average_regress
+from wonambi.trans.montage import compile_montage, compute_average_regress
 
 
 seed(0)
@@ -101,3 +101,24 @@ def test_montage_bipolar_03():
 
     with raises(ValueError):
         montage(data_wrongorder, bipolar=100)
+
+
+def test_montage_virtual():
+    virtual = {'virt': ['chan00', 'chan01']}
+    mdata = montage(data, ref_chan=['chan02'], virtual=virtual)
+
+    assert mdata.chan[0][-1] == 'virt'
+    assert_array_almost_equal(
+        mdata(trial=0, chan='virt'),
+        (data(trial=0, chan='chan00') + data(trial=0, chan='chan01')) / 2 -
+        data(trial=0, chan='chan02'))
+
+
+def test_montage_operator_cache():
+    op0 = compile_montage(data.chan[0], ref_to_avg=True)
+    op1 = compile_montage(list(data.chan[0]), ref_to_avg=True)
+    assert op0 is op1
+
+    # same operator on trial x chan x time
+    x = stack((data.data[0], data.data[0]))
+    assert_array_almost_equal(op0(x, axis=1)[1], op0(data.data[0]))
@@ -1,4 +1,4 @@
-from numpy import arange
+from numpy import arange, hstack
 from numpy.random import seed
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 from pytest import approx, raises
@@ -6,11 +6,14 @@ from pytest import approx, raises
 from wonambi import Dataset
 from wonambi.attr import Annotations
 from wonambi.utils import create_data
-from wonambi.trans import select, resample, frequency, get_times, fetch
-from wonambi.trans.select import _create_subepochs
+from wonambi.trans import (select, resample, resample_dataset, frequency,
+                           get_times, fetch)
+from wonambi.trans.select import Segments, _create_subepochs, _plan_reads
 
 from .paths import (annot_psg_path,
                     gui_file,
+                    resample_dataset_file,
+                    segments_dataset_file,
                     )
 
 seed(0)
@@ -161,6 +164,34 @@ def test_resample():
     assert_array_almost_equal(sum(freq.data[0][0, :]),
                               sum(freq1.data[0][0, :]),
                               4)
+
+
+def test_resample_polyphase():
+    seed(0)
+    data = create_data(n_trial=1, s_freq=1024, signal='sine', sine_freq=20)
+
+    NEW_FREQ = 256
+    data1 = resample(data, s_freq=NEW_FREQ, method='polyphase')
+
+    assert data1.s_freq == NEW_FREQ
+    assert data1.data[0].shape[1] == data1.number_of('time')[0]
+    assert data1.axis['time'][0][1] == 1 / NEW_FREQ
+
+    data2 = resample(data, s_freq=NEW_FREQ, method='polyphase',
+                     chunk_duration=0.1)
+    assert_array_almost_equal(data1.data[0], data2.data[0])
+
+
+def test_resample_dataset():
+    seed(0)
+    data = create_data(n_trial=1, n_chan=3, time=(0, 30), s_freq=500)
+    data.export(resample_dataset_file, export_format='wonambi')
+    d = Dataset(resample_dataset_file)
+
+    data1 = resample(d.read_data(), s_freq=256, method='polyphase')
+    data2 = resample_dataset(d, 256, block_duration=7)
+    assert_array_almost_equal(data1.data[0], data2.data[0])
+    assert_array_almost_equal(data1.time[0], data2.time[0])
     
 def test_get_times():
     annot = Annotations(str(annot_psg_path))
@@ -187,3 +218,75 @@ def test_fetch():
     seg.read_data(['EEG Fpz-Cz'], ref_chan=['EEG Pz-Oz'])
     assert seg[0]['data']()[0][0].shape == (297000,)
     assert approx(seg[0]['data']()[0][0][100]) == -4.3201466  
+
+
+def test_plan_reads():
+    reads = _plan_reads([(1000, 1100), (0, 100), (50, 300), (100000, 100010)],
+                        n_chan=2)
+    assert reads == [(0, 300, [1, 2]), (1000, 1100, [0, ]),
+                     (100000, 100010, [3, ])]
+
+
+def test_segments_read_data():
+    data = create_data(n_chan=3, time=(0, 20))
+    data.export(segments_dataset_file, export_format='wonambi')
+    dset = Dataset(segments_dataset_file)
+
+    seg = Segments(dset)
+    seg.segments = [{'times': [(t, t + 1), (t + 1.5, t + 2)],
+                     'stage': 'NREM2',
+                     'cycle': None,
+                     'name': 'spindle',
+                     'chan': '',
+                     } for t in (10, 2, 2.5, 17)]
+    seg.read_data(['chan00', 'chan01'], ref_chan=['chan02'], grp_name='eeg',
+                  workers=2)
+
+    assert seg[1]['n_stitch'] == 1
+    assert_array_equal(seg[1]['data'].axis['chan'][0],
+                       ['chan00 (eeg)', 'chan01 (eeg)'])
+
+    one_seg = seg[2]['data']
+    raw = dset.read_data(chan=['chan01', 'chan02'], begtime=[2.5, 4],
+                         endtime=[3.5, 4.5])
+    expected = hstack([x[0] - x[1] for x in raw.data])
+    assert_array_almost_equal(one_seg(chan='chan01 (eeg)')[0], expected)
+    assert_array_equal(one_seg.axis['time'][0], hstack(raw.axis['time']))
+
+
+def test_segments_lazy():
+    data = create_data(n_chan=3, time=(0, 20))
+    data.export(segments_dataset_file, export_format='wonambi')
+    dset = Dataset(segments_dataset_file)
+
+    times = [[(t, t + 1)] for t in arange(0, 18, 1.5)]
+    seg = Segments(dset)
+    seg.segments = [{'times': one_times, 'stage': 'NREM2', 'cycle': None,
+                     'name': 'epoch', 'chan': 'chan01 (eeg)'}
+                    for one_times in times]
+    assert seg.signal_size() == 12 * 256
+
+    seg.read_data(lazy=True, prefetch=1)
+    assert seg.lazy
+    assert 'data' not in seg.segments[0]
+
+    seg.transform = lambda x: dict(x, trans_data=x['data'])
+    loaded = list(seg)
+    assert len(loaded) == len(seg) == 12
+    assert 'trans_data' in loaded[3]
+    assert seg.n_samples() == [x['data'].number_of('time')[0]
+                               for x in loaded]
+    assert seg.n_samples(max_s_freq=100) == [128] * 12
+
+    # the times are kept after reading the data in memory
+    eager = Segments(dset)
+    eager.segments = [{'times': [(1, 2), (3.5, 4)], 'stage': 'NREM2',
+                       'cycle': None, 'name': 'epoch',
+                       'chan': 'chan01 (eeg)'}]
+    eager.read_data()
+    assert (eager.n_samples() == [eager[0]['data'].number_of('time')[0]]
+            == [384])
+    expected = dset.read_data(chan=['chan01'], begtime=4.5, endtime=5.5)
+    assert_array_almost_equal(loaded[3]['data'].data[0][0],
+                              expected.data[0][0])
+    assert_array_equal(seg[3]['data'].data[0], loaded[3]['data'].data[0])
@@ -0,0 +1,66 @@
+from csv import writer
+
+from numpy import arange, array, load
+from numpy.testing import assert_array_equal
+
+from wonambi.utils import write_table
+
+from .paths import table_path
+
+table_path.mkdir(exist_ok=True)
+
+COLUMNS = [('idx', 'Index', arange(1, 4)),
+           ('name', 'Event type', ['spindle', 'slow, wave', None]),
+           ('value', 'Value (uV)', array([0.1, 2.5, -3.])),
+           ('value32', 'Value (float32)', array([0.1, 2.5, -3.],
+                                               dtype='float32')),
+           ]
+
+
+def test_table_csv():
+    csv_file = table_path / 'table.csv'
+    write_table(csv_file, COLUMNS, preamble=[['Wonambi'], ],
+                summary=[['Mean', '', 0.5, 0.5]])
+
+    # same as writing one row at a time
+    expected_file = table_path / 'expected.csv'
+    with expected_file.open('w', newline='') as f:
+        csv_file_ = writer(f)
+        csv_file_.writerow(['Wonambi'])
+        csv_file_.writerow([x[1] for x in COLUMNS])
+        csv_file_.writerow(['Mean', '', 0.5, 0.5])
+        for row in zip(*[x[2] for x in COLUMNS]):
+            csv_file_.writerow(row)
+
+    assert csv_file.read_text() == expected_file.read_text()
+
+
+def test_table_tsv():
+    tsv_file = table_path / 'table.tsv'
+    write_table(tsv_file, COLUMNS)
+    lines = tsv_file.read_text().splitlines()
+    assert lines[0] == 'Index\tEvent type\tValue (uV)\tValue (float32)'
+    assert lines[2] == '2\tslow, wave\t2.5\t2.5'
+
+
+def test_table_npz():
+    npz_file = table_path / 'table.npz'
+    write_table(npz_file, COLUMNS)
+    table = load(npz_file)
+    assert_array_equal(table['idx'], COLUMNS[0][2])
+    assert_array_equal(table['name'], ['spindle', 'slow, wave', ''])
+    assert_array_equal(table['value'], COLUMNS[2][2])
+    assert 'preamble' not in table
+
+
+def test_table_npz_preamble():
+    npz_file = table_path / 'table_preamble.npz'
+    write_table(npz_file, COLUMNS,
+                preamble=[['Wonambi'], ['Count', 3], ['Density', 0.5]],
+                summary=[['Mean', '', 0.5, None]])
+    table = load(npz_file)
+    assert_array_equal(table['preamble'], [['Wonambi', ''],
+                                           ['Count', '3'],
+                                           ['Density', '0.5']])
+    assert_array_equal(table['summary'], [['Mean', '', '0.5', '']])
+    assert table['preamble'].dtype.kind == 'U'  # no pickle needed
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from PyQt5.QtWidgets import (QAction,
                              QComboBox,
                              QToolBar,
@@ -269,3 +271,37 @@ def test_widget_notes_remove_artf_evts(qtbot):
 
     w.notes.delete_eventtype(test_type_str='Artefact')
     w.close()
+
+
+def test_widget_notes_annotations_model(qtbot):
+
+    w = Wonambi()
+    qtbot.addWidget(w)
+
+    model = w.notes.annot_model
+    model.set_annotations([{'name': 'bm', 'start': 5, 'end': 5,
+                            'chan': ['']}],
+                          [{'name': 'spindle', 'start': 10, 'end': 11.5,
+                            'chan': ['Fz']},
+                           {'name': 'spindle', 'start': 1, 'end': 2,
+                            'chan': ['Cz']}],
+                          datetime(2000, 1, 1, 23))
+    assert model.rowCount() == 3
+    assert [mrk['start'] for mrk in model.annots] == [1, 5, 10]
+    assert model.data(model.index(2, 0)) == '23:00:10'
+    assert model.data(model.index(2, 1)) == '01.500'
+    assert model.data(model.index(1, 3)) == 'bookmark'
+
+    row = model.insert_annotation({'name': 'spindle', 'start': 7, 'end': 8,
+                                   'chan': ['Fz']}, 'event')
+    assert row == 2
+    assert model.find_row(7, 8) == 2
+
+    model.remove_annotations('event', name='spindle', chan=['Fz'])
+    assert [mrk['start'] for mrk in model.annots] == [1, 5]
+    model.remove_annotations('bookmark', time=(0, 6))
+    assert [mrk['type'] for mrk in model.annots] == ['event']
+    model.remove_annotations('event', chan='')  # Cz event is kept
+    assert model.rowCount() == 1
+    model.remove_annotations('event', time=(1, 2))
+    assert model.rowCount() == 0
@@ -7,10 +7,23 @@ here = path.abspath(path.dirname(__file__))
 with open(path.join(here, 'VERSION')) as f:
     __version__ = f.read().strip()
 
-from .dataset import Dataset
 from .datatype import Data, ChanTime, ChanFreq, ChanTimeFreq
 from .graphoelement import Graphoelement
-try:
-    from .bin.scroll_data import MainWindow as Wonambi
-except ImportError:  # PyQt is not installed
-    Wonambi = None
+from .utils.lazy import lazy_attributes
+
+
+def _import_gui():
+    try:
+        from .bin.scroll_data import MainWindow
+    except ImportError:  # PyQt is not installed
+        return None
+    return MainWindow
+
+
+# imported only when used (PEP 562), so that "import wonambi" is fast
+_LAZY = {'Dataset': '.dataset',
+         'open_dataset': '.dataset',
+         'Wonambi': _import_gui,
+         }
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY, globals())
@@ -2,15 +2,16 @@
     - surfaces, with class Surf
     - brains, with class BrainSurf (both hemispheres)
 """
-from collections import Counter
+from functools import lru_cache
 from logging import getLogger
 from os import environ
 from pathlib import Path
 from re import compile
-from struct import unpack
 
-from numpy import (array, empty, vstack, around, dot, append, reshape,
-                   meshgrid, asarray)
+from numpy import (add, arange, array, asanyarray, empty, full, vstack,
+                   around, dot, reshape, meshgrid, asarray, atleast_2d, c_,
+                   minimum, ones, unique, where, zeros, fromfile, float64,
+                   int64, load as load_npy, save as save_npy)
 from ..utils import MissingDependency
 
 
@@ -30,13 +31,17 @@ FS_AFFINE = array([[-1, 0, 0, 128],
 HEMISPHERES = 'lh', 'rh'
 
 
-def _read_geometry(surf_file):
+def _read_geometry(surf_file, cache=False):
     """Read a triangular format Freesurfer surface mesh.
 
     Parameters
     ----------
     surf_file : str
         path to surface file
+    cache : bool
+        store the decoded surface in .npy files next to the surface file and
+        read them (memory-mapped) next time, if they are more recent than the
+        surface file
 
     Returns
     -------
@@ -47,51 +52,144 @@ def _read_geometry(surf_file):
 
     Notes
     -----
-    This function comes from nibabel, but it doesn't use numpy because numpy
-    doesn't return the correct values in Python 3.
+    This function comes from nibabel, but values are read directly from the
+    file as big-endian arrays with numpy.
     """
-    with open(surf_file, 'rb') as f:
-        filebytes = f.read()
-
-    assert filebytes[:3] == b'\xff\xff\xfe'
-    i0 = filebytes.index(b'\x0A\x0A') + 2
-    i1 = i0 + 4
-    vnum = unpack('>i', filebytes[i0:i1])[0]
-    i0 = i1
-    i1 += 4
-    fnum = unpack('>i', filebytes[i0:i1])[0]
-    i0 = i1
-    i1 += 4 * vnum * 3
-    verts = unpack('>' + 'f' * vnum * 3, filebytes[i0:i1])
-    i0 = i1
-    i1 += 4 * fnum * 3
-    faces = unpack('>' + 'i' * fnum * 3, filebytes[i0:i1])
-
-    verts = asarray(verts).reshape(vnum, 3)
-    faces = asarray(faces).reshape(fnum, 3)
+    surf_file = Path(surf_file)
+    vert_file = surf_file.with_name(surf_file.name + '.vert.npy')
+    tri_file = surf_file.with_name(surf_file.name + '.tri.npy')
+
+    if cache and _is_newer(vert_file, surf_file) and _is_newer(tri_file,
+                                                               surf_file):
+        lg.debug('Reading cached surface ' + str(vert_file))
+        return load_npy(vert_file, mmap_mode='c'), load_npy(tri_file,
+                                                            mmap_mode='c')
+
+    with surf_file.open('rb') as f:
+        assert f.read(3) == b'\xff\xff\xfe'
+        header = b''
+        while b'\x0A\x0A' not in header:
+            chunk = f.read(1024)
+            if not chunk:
+                raise ValueError('Could not read header of ' + str(surf_file))
+            header += chunk
+        i0 = 3 + header.index(b'\x0A\x0A') + 2
+
+        f.seek(i0)
+        vnum, fnum = fromfile(f, dtype='>i4', count=2)
+        verts = fromfile(f, dtype='>f4', count=vnum * 3)
+        faces = fromfile(f, dtype='>i4', count=fnum * 3)
+
+    verts = verts.astype(float64).reshape(vnum, 3)
+    faces = faces.astype(int64).reshape(fnum, 3)
+
+    if cache:
+        try:
+            save_npy(vert_file, verts)
+            save_npy(tri_file, faces)
+        except OSError as err:
+            lg.warning('Could not cache surface: ' + str(err))
+
     return verts, faces
 
 
-def _find_neighboring_regions(pos, mri_dat, region, approx, exclude_regions):
+def _is_newer(cached_file, orig_file):
+    """Check if cached_file exists and it's more recent than orig_file."""
+    return (cached_file.exists() and
+            cached_file.stat().st_mtime >= orig_file.stat().st_mtime)
+
+
+def _find_neighboring_regions(pos, mri_dat, lut, approx):
+    """Find the most common region around each position.
 
+    Parameters
+    ----------
+    pos : ndarray
+        n_pos X 3 positions in the MRI matrix
+    mri_dat : ndarray
+        3d matrix with the segmentation
+    lut : ndarray
+        for each value in the segmentation, the index of the region (-1 for
+        excluded regions, -2 for values not in the lookup table)
+    approx : int
+        size of the spot around each position, in voxels
+
+    Returns
+    -------
+    ndarray
+        for each position, index of the most common region (-1 if there are
+        no regions). If more regions are equally common, it takes the first
+        one (in the order of the voxels in the spot).
+    """
     spot_size = approx * 2 + 1
 
     x, y, z = meshgrid(range(spot_size), range(spot_size), range(spot_size))
     neighb = vstack((reshape(x, (1, spot_size ** 3)),
                      reshape(y, (1, spot_size ** 3)),
                      reshape(z, (1, spot_size ** 3)))).T - approx
-    regions = []
-    for p in range(neighb.shape[0]):
-        d_type = mri_dat[pos[0] + neighb[p, 0], pos[1] + neighb[p, 1],
-                         pos[2] + neighb[p, 2]]
-        label_index = region['index'].index(d_type)
-        regions.append(region['label'][label_index])
+
+    vox = pos[:, None, :] + neighb[None, :, :]
+    d_type = mri_dat[vox[..., 0], vox[..., 1], vox[..., 2]]
+    if d_type.max() >= len(lut) or (lut[d_type] == -2).any():
+        raise ValueError('The segmentation contains values which are not in '
+                         'the lookup table')
+    regions = lut[d_type]
+
+    n_pos, n_neighb = regions.shape
+    rows = arange(n_pos)[:, None].repeat(n_neighb, axis=1)
+    cols = arange(n_neighb)[None, :].repeat(n_pos, axis=0)
+    valid = regions >= 0
+
+    n_regions = lut.max() + 1
+    counts = zeros((n_pos, n_regions), dtype=int)
+    add.at(counts, (rows[valid], regions[valid]), 1)
+    first = full((n_pos, n_regions), n_neighb)
+    minimum.at(first, (rows[valid], regions[valid]), cols[valid])
+
+    # most common, and the first one if they're equally common
+    best = (counts * (n_neighb + 1) - first).argmax(axis=1)
+    best[counts.max(axis=1) == 0] = -1
+    return best
+
+
+@lru_cache(maxsize=4)
+def _read_seg(seg_file, mtime):
+    """Read the MRI segmentation, cached (mtime is only used to read the file
+    again when it changes)."""
+    lg.debug('Reading segmentation ' + seg_file)
+    seg_mri = load(seg_file)
+    seg_dat = asanyarray(seg_mri.dataobj)
+    seg_dat.flags.writeable = False
+    return seg_dat, seg_mri.affine
+
+
+def _region_lookup(lookuptable, exclude_regions):
+    """Convert the lookup table into an array, to convert the values of the
+    segmentation into regions.
+
+    Returns
+    -------
+    ndarray
+        for each value of the segmentation, the index of the region name (-1
+        if excluded, -2 if not in the lookup table)
+    list of str
+        names of the regions
+    """
+    region_names, idx_name = unique(lookuptable['label'], return_inverse=True)
+    region_names = list(region_names)
 
     if exclude_regions:
         excluded = compile('|'.join(exclude_regions))
-        regions = [x for x in regions if not excluded.search(x)]
+        is_excluded = array([bool(excluded.search(x)) for x in region_names])
+    else:
+        is_excluded = zeros(len(region_names), dtype=bool)
+
+    index = asarray(lookuptable['index'])
+    lut = full(index.max() + 1, -2)
+    # reversed, so that the first value wins as in list.index
+    lut[index[::-1]] = where(is_excluded[idx_name], -1, idx_name)[::-1]
 
-    return regions
+    return lut, region_names
 
 
 def import_freesurfer_LUT(fs_lut=None):
@@ -151,6 +249,9 @@ class Surf:
     ----------
     surf_file : str or Path
         freesurfer file containing the surface
+    cache : bool
+        store the surface in .npy files next to the surface file, so that it
+        can be read faster the next time (see _read_geometry)
 
     Attributes
     ----------
@@ -161,9 +262,9 @@ class Surf:
     tri : numpy.ndarray
         triangulation of the mesh
     """
-    def __init__(self, surf_file):
+    def __init__(self, surf_file, cache=False):
         self.surf_file = surf_file
-        surf_vert, surf_tri = _read_geometry(self.surf_file)
+        surf_vert, surf_tri = _read_geometry(self.surf_file, cache=cache)
         self.vert = surf_vert
         self.tri = surf_tri
         self.n_vert = surf_vert.shape[0]
@@ -178,14 +279,16 @@ class Brain:
         subject-specific directory created by freesurfer
     surf_type : str
         'pial', 'smoothwm', 'inflated', 'white', or 'sphere'
+    cache : bool
+        store the surfaces in .npy files (see Surf)
     """
-    def __init__(self, freesurfer_dir, surf_type='pial'):
+    def __init__(self, freesurfer_dir, surf_type='pial', cache=False):
 
         freesurfer_dir = Path(freesurfer_dir)
 
         for hemi in HEMISPHERES:
             surf_file = freesurfer_dir / 'surf' / (hemi + '.' + surf_type)
-            setattr(self, hemi, Surf(surf_file))
+            setattr(self, hemi, Surf(surf_file, cache=cache))
 
 
 class Freesurfer:
@@ -269,28 +372,68 @@ class Freesurfer:
         and with 'aparc.a2009s', use:
             exclude_regions = ('White-Matter')
         """
+        regions, approx = self.find_brain_regions(atleast_2d(abs_pos),
+                                                  parc_type, max_approx,
+                                                  exclude_regions)
+        return regions[0], approx[0]
+
+    def find_brain_regions(self, abs_pos, parc_type='aparc', max_approx=None,
+                           exclude_regions=None):
+        """Find the name of the brain region for many electrodes at once.
+
+        Parameters
+        ----------
+        abs_pos : numpy.ndarray
+            n_pos X 3 matrix with the positions of interest.
+        parc_type : str
+            'aparc', 'aparc.a2009s', 'BA', 'BA.thresh', or 'aparc.DKTatlas40'
+            'aparc.DKTatlas40' is only for recent freesurfer versions
+        max_approx : int, optional
+            max approximation to define position of the electrode.
+        exclude_regions : list of str or empty list
+            do not report regions if they contain these substrings. None means
+            that it does not exclude any region.
+
+        Returns
+        -------
+        list of str
+            for each position, name of the brain region (or '--not found--')
+        list of int
+            for each position, the approximation used to find the region
+
+        Notes
+        -----
+        See find_brain_region. The segmentation is read only once (and kept
+        in memory for the following calls) and all the positions are looked
+        up at the same time.
+        """
         # convert to freesurfer coordinates of the MRI
-        pos = around(dot(FS_AFFINE, append(abs_pos, 1)))[:3].astype(int)
+        abs_pos = asarray(abs_pos)
+        pos = around(dot(FS_AFFINE, c_[abs_pos, ones(abs_pos.shape[0])].T))
+        pos = pos[:3].T.astype(int)
         lg.debug('Position in the MRI matrix: {}'.format(pos))
 
         mri_dat, _ = self.read_seg(parc_type)
+        lut, region_names = _region_lookup(self.lookuptable, exclude_regions)
 
         if max_approx is None:
             max_approx = 3
 
-        for approx in range(max_approx + 1):
-            lg.debug('Trying approx {} out of {}'.format(approx, max_approx))
-            regions = _find_neighboring_regions(pos, mri_dat,
-                                                self.lookuptable, approx,
-                                                exclude_regions)
-            if regions:
+        found = full(pos.shape[0], -1)
+        approx = full(pos.shape[0], max_approx)
+        for one_approx in range(max_approx + 1):
+            todo = found == -1
+            if not todo.any():
                 break
+            lg.debug('Trying approx {} out of {}'.format(one_approx,
+                                                         max_approx))
+            found[todo] = _find_neighboring_regions(pos[todo], mri_dat, lut,
+                                                    one_approx)
+            approx[todo & (found >= 0)] = one_approx
 
-        if regions:
-            c_regions = Counter(regions)
-            return c_regions.most_common(1)[0][0], approx
-        else:
-            return '--not found--', approx
+        regions = [region_names[x] if x >= 0 else '--not found--'
+                   for x in found]
+        return regions, [int(x) for x in approx]
 
     def read_label(self, hemi, parc_type='aparc'):
         """Read the labels (annotations) for each hemisphere.
@@ -333,10 +476,7 @@ class Freesurfer:
             4x4 affine matrix
         """
         seg_file = self.dir / 'mri' / (parc_type + '+aseg.mgz')
-        seg_mri = load(seg_file)
-        seg_aff = seg_mri.affine
-        seg_dat = seg_mri.get_data()
-        return seg_dat, seg_aff
+        return _read_seg(str(seg_file), seg_file.stat().st_mtime)
 
     def read_brain(self, surf_type='pial'):
         """Read the surface of both hemispheres.
@@ -2,19 +2,24 @@
 """
 from logging import getLogger
 from bisect import bisect_left
+from contextlib import closing
+from functools import wraps
+from inspect import signature
 from itertools import groupby
 from csv import reader, writer
-from json import dump
+from json import dump, dumps, loads
 from datetime import datetime, timedelta
 from numpy import (allclose, arange, around, asarray, clip, diff, isnan,
                    logical_and, modf, nan)
 from math import ceil, inf
+from os import replace
 from os.path import basename, splitext
 from pathlib import Path
 from re import search, sub
 from scipy.io import loadmat
-from xml.etree.ElementTree import Element, SubElement, tostring, parse
-from xml.dom.minidom import parseString
+from sqlite3 import connect
+from threading import RLock, Timer
+from xml.etree.ElementTree import Element, ElementTree, SubElement, parse
 
 try:
     from PyQt5.QtCore import Qt
@@ -25,10 +30,13 @@ except ImportError:
 
 from .. import __version__
 from ..utils.exceptions import UnrecognizedFormat
+from ..utils.table import TABLE_FORMATS, write_table
 
 
 lg = getLogger(__name__)
 VERSION = '5'
+JOURNAL_SUFFIX = '.journal'
+SQLITE_SUFFIXES = ('.db', '.sqlite')
 DOMINO_STAGE_KEY = {'N1': 'NREM1',
                     'N2': 'NREM2',
                     'N3': 'NREM3',
@@ -142,9 +150,7 @@ def create_empty_annotations(xml_file, dataset):
     x = SubElement(info, 'last_second')
     x.text = str(last_sec)
 
-    xml = parseString(tostring(root))
-    with xml_file.open('w') as f:
-        f.write(xml.toxml())
+    _write_xml(root, xml_file)
 
 
 def create_annotation(xml_file, from_fasst):
@@ -208,9 +214,7 @@ def create_annotation(xml_file, from_fasst):
     x = SubElement(info, 'last_second')
     x.text = str(int(last_sec))
 
-    xml = parseString(tostring(root))
-    with xml_file.open('w') as f:
-        f.write(xml.toxml())
+    _write_xml(root, xml_file)
 
     annot = Annotations(xml_file)
 
@@ -231,6 +235,37 @@ def create_annotation(xml_file, from_fasst):
     return annot
 
 
+def _journaled(method):
+    """Record the edit in the journal when the annotations are saved with a
+    delay, so that the edit can be replayed if the xml file was not written.
+    Only the outermost call is recorded (f.e. add_event calls add_event_type)
+    and not the calls with save=False (bulk edits, saved at the end).
+    """
+    sig = signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            rater = self.current_rater if self.rater is not None else None
+            self._journal_depth += 1
+            try:
+                out = method(self, *args, **kwargs)
+            finally:
+                self._journal_depth -= 1
+
+            if (self._journal_depth == 0 and self.save_delay is not None and
+                    not self._replaying):
+                params = sig.bind(self, *args, **kwargs).arguments
+                params.pop('self')
+                params.pop('parent', None)  # Qt widget
+                if params.get('save', True):
+                    self._append_journal(method.__name__, rater, params)
+
+        return out
+
+    return wrapper
+
+
 class Annotations():
     """Class to return nicely formatted information from xml.
 
@@ -238,32 +273,132 @@ class Annotations():
     ----------
     xml_file : path to xml file
         Annotation xml file
+    rater_name : str, optional
+        name of the rater to select (default: the first rater)
+    save_delay : float, optional
+        if None, the xml file is written after each edit. Otherwise, edits are
+        kept in memory and written to the xml file when no edit has been made
+        for this number of seconds (or when calling flush). In the meantime,
+        the edits are stored in a journal file, next to the xml file, which
+        is replayed when the annotations are loaded again.
+
+    Notes
+    -----
+    The xml file is first written to a temporary file in the same folder and
+    then renamed, so the xml file is never left half-written.
+
+    If xml_file ends in .db or .sqlite, the annotations are read from and
+    written to a sqlite file instead (see convert_annotations and
+    query_events), but the methods are the same. When saving, only the rows
+    which changed are written to the sqlite file, in one transaction.
+    However, the whole file is still read into the xml tree when loading and
+    all the rows are compared with the tree when saving, and the methods use
+    the xml tree: only query_events uses the indices of the sqlite file.
     """
-    def __init__(self, xml_file, rater_name=None):
+    def __init__(self, xml_file, rater_name=None, save_delay=None):
 
         self.xml_file = xml_file
+        self.save_delay = save_delay
+        self._lock = RLock()
+        self._timer = None
+        self._dirty = False
+        self._replaying = False
+        self._journal_depth = 0
+
         self.root = self.load()
         if rater_name is None:
             self.rater = self.root.find('rater')
         else:
             self.get_rater(rater_name)
 
+        self._replay_journal()
+
+    @property
+    def journal_file(self):
+        xml_file = Path(self.xml_file)
+        return xml_file.with_name(xml_file.name + JOURNAL_SUFFIX)
+
     def load(self):
-        """Load xml from file."""
+        """Load xml from file (or from a sqlite file, see query_events)."""
         lg.info('Loading ' + str(self.xml_file))
+        if _is_sqlite(self.xml_file):
+            return _read_sqlite(self.xml_file)
+
         update_annotation_version(self.xml_file)
 
         xml = parse(self.xml_file)
         return xml.getroot()
 
     def save(self):
-        """Save xml to file."""
-        if self.rater is not None:
-            self.rater.set('modified', datetime.now().isoformat())
+        """Save xml to file (or schedule it, if save_delay is not None)."""
+        with self._lock:
+            if self.rater is not None:
+                self.rater.set('modified', datetime.now().isoformat())
+            self._dirty = True
+
+            if self._replaying:
+                return
+
+            if self.save_delay is None:
+                self.flush()
+                return
 
-        xml = parseString(tostring(self.root))
-        with open(self.xml_file, 'w') as f:
-            f.write(xml.toxml())
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = Timer(self.save_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write all the pending edits to the xml file and clear the journal.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if self._dirty:
+                _write_annotations(self.root, self.xml_file)
+                self._dirty = False
+
+            if self.journal_file.exists():
+                self.journal_file.unlink()
+
+    def _append_journal(self, method, rater, params):
+        entry = {'method': method, 'rater': rater, 'params': params}
+        with self.journal_file.open('a') as f:
+            f.write(dumps(entry, default=_json_default) + '\n')
+            f.flush()
+
+    def _replay_journal(self):
+        """Apply the edits which were not written to the xml file."""
+        if not self.journal_file.exists():
+            return
+
+        lg.info('Replaying edits from ' + str(self.journal_file))
+        with self.journal_file.open() as f:
+            lines = f.readlines()
+
+        self._replaying = True  # do not write each edit, only at the end
+        current = self.current_rater if self.rater is not None else None
+        try:
+            for line in lines:
+                try:
+                    entry = loads(line)
+                except ValueError:  # last line, if writing was interrupted
+                    lg.warning('Incomplete edit in journal, skipping it')
+                    continue
+
+                if entry['rater'] is not None:
+                    self.get_rater(entry['rater'])
+                getattr(self, entry['method'])(**entry['params'])
+
+        finally:
+            self._replaying = False
+
+        if current in self.raters:
+            self.get_rater(current)
+        self.flush()
 
     @property
     def dataset(self):
@@ -310,6 +445,7 @@ class Annotations():
             raise KeyError(rater_name + ' not in the list of raters (' +
                            ', '.join(self.raters) + ')')
 
+    @_journaled
     def add_rater(self, rater_name, epoch_length=30):
         if rater_name in self.raters:
             lg.warning('rater ' + rater_name + ' already exists, selecting it')
@@ -332,6 +468,7 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def rename_rater(self, name, new_name):
         """Rename event type."""
         for rater in self.root.iterfind('rater'):
@@ -340,6 +477,7 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def remove_rater(self, rater_name):
         # remove one rater
         for rater in self.root.iterfind('rater'):
@@ -671,7 +809,9 @@ class Annotations():
                 idx_epoch += 1
 
         self.save()
+        self.flush()  # bulk import is not kept in the journal
 
+    @_journaled
     def add_bookmark(self, name, time, chan=''):
         """Add a new bookmark
 
@@ -706,9 +846,12 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def remove_bookmark(self, name=None, time=None, chan=None):
         """if you call it without arguments, it removes ALL the bookmarks."""
         bookmarks = self.rater.find('bookmarks')
+        if isinstance(chan, (tuple, list)):
+            chan = ', '.join(chan)
 
         for m in bookmarks:
 
@@ -798,6 +941,7 @@ class Annotations():
 
         return [x.get('type') for x in events]
 
+    @_journaled
     def add_event_type(self, name):
         """
         Raises
@@ -814,6 +958,7 @@ class Annotations():
         new_event_type.set('type', name)
         self.save()
 
+    @_journaled
     def remove_event_type(self, name):
         """Remove event type based on name."""
 
@@ -829,6 +974,7 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def rename_event_type(self, name, new_name):
         """Rename event type."""
 
@@ -843,6 +989,7 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def add_event(self, name, time, chan=''):
         """Add event to annotations file.
         Parameters
@@ -881,6 +1028,7 @@ class Annotations():
 
         self.save()
 
+    @_journaled
     def add_events(self, event_list, name=None, chan=None, parent=None):
         """Add series of events. Faster than calling add_event in a loop.
         Parameters
@@ -939,6 +1087,7 @@ class Annotations():
         if parent is not None:
             progress.close()
 
+    @_journaled
     def remove_event(self, name=None, time=None, chan=None):
         """get events inside window."""
         events = self.rater.find('events')
@@ -958,6 +1107,8 @@ class Annotations():
                 event_start = float(e.find('event_start').text)
                 event_end = float(e.find('event_end').text)
                 event_chan = e.find('event_chan').text
+                if event_chan is None:  # xml doesn't store empty string
+                    event_chan = ''
 
                 if time is None:
                     time_cond = True
@@ -1264,6 +1415,7 @@ class Annotations():
         return sum(x['end'] - x['start'] for x in self.epochs
                    if x[attr] == name)
 
+    @_journaled
     def set_stage_for_epoch(self, epoch_start, name, attr='stage', save=True):
         """Change the stage for one specific epoch.
 
@@ -1303,6 +1455,7 @@ class Annotations():
 
         raise KeyError('epoch starting at ' + str(epoch_start) + ' not found')
 
+    @_journaled
     def set_cycle_mrkr(self, epoch_start, end=False):
         """Mark epoch start as cycle start or end.
 
@@ -1331,6 +1484,7 @@ class Annotations():
 
         raise KeyError('epoch starting at ' + str(epoch_start) + ' not found')
 
+    @_journaled
     def remove_cycle_mrkr(self, epoch_start):
         """Remove cycle marker at epoch_start.
 
@@ -1356,6 +1510,7 @@ class Annotations():
 
         raise KeyError('cycle marker at ' + str(epoch_start) + ' not found')
 
+    @_journaled
     def clear_cycles(self):
         """Remove all cycle markers in current rater."""
         if self.rater is None:
@@ -1381,44 +1536,9 @@ class Annotations():
         if not cycles:
             return None
 
-        starts = sorted(
-                [float(mrkr.text) for mrkr in cycles.findall('cyc_start')])
-        ends = sorted(
-                [float(mrkr.text) for mrkr in cycles.findall('cyc_end')])
-        cyc_list = []
-
-        if not starts or not ends:
-            return None
-
-        if all(i < starts[0] for i in ends):
-            raise ValueError('First cycle has no start.')
-
-        for (this_start, next_start) in zip(starts, starts[1:] + [inf]):
-            # if an end is smaller than the next start, make it the end
-            # otherwise, the next_start is the end
-            end_between_starts = [end for end in ends \
-                                  if this_start < end <= next_start]
-
-            if len(end_between_starts) > 1:
-                raise ValueError('Found more than one cycle end for same '
-                                 'cycle')
-
-            if end_between_starts:
-                one_cycle = (this_start, end_between_starts[0])
-            else:
-                one_cycle = (this_start, next_start)
-
-            if one_cycle[1] == inf:
-                raise ValueError('Last cycle has no end.')
-
-            cyc_list.append(one_cycle)
-
-        output = []
-        for i, j in enumerate(cyc_list):
-            cyc = j[0], j[1], i + 1
-            output.append(cyc)
-
-        return output
+        return _compute_cycles(
+            [float(mrkr.text) for mrkr in cycles.findall('cyc_start')],
+            [float(mrkr.text) for mrkr in cycles.findall('cyc_end')])
 
     def switch(self, time=None):
         """Obtain switch parameter, ie number of times the stage shifts."""
@@ -1944,7 +2064,9 @@ class Annotations():
         Parameters
         ----------
         filename : str
-            path of export file
+            path of export file. The extension can also be '.tsv', '.npz',
+            '.parquet' or '.feather' (see utils.table.write_table), otherwise
+            it's replaced by '.csv'
         evt_type : list of str, optional
             event types to export
         chan : tuple of str, optional
@@ -1954,15 +2076,8 @@ class Annotations():
         cycle : list of int, optional
             list of cycles of interest, numbered starting at 1
         """
-        filename = splitext(filename)[0] + '.csv'
-        headings_row = ['Index',
-                       'Start time',
-                       'End time',
-                       'Stitches',
-                       'Stage',
-                       'Cycle',
-                       'Event type',
-                       'Channel']
+        if splitext(filename)[1].lower() not in TABLE_FORMATS:
+            filename = splitext(filename)[0] + '.csv'
 
         events = []
         if evt_type is None:
@@ -1977,22 +2092,18 @@ class Annotations():
             lg.info('No events found.')
             return
 
-        with open(filename, 'w', newline='') as f:
-            lg.info('Writing to ' + str(filename))
-            csv_file = writer(f)
-            csv_file.writerow(['Wonambi v{}'.format(__version__)])
-            csv_file.writerow(headings_row)
-
-            for i, ev in enumerate(events):
-                csv_file.writerow([i + 1,
-                                   ev['start'],
-                                   ev['end'],
-                                   0,
-                                   ev['stage'],
-                                   ev['cycle'],
-                                   ev['name'],
-                                   ', '.join(ev['chan']),
-                                   ])
+        columns = [('index', 'Index', arange(1, len(events) + 1)),
+                   ('start', 'Start time', [ev['start'] for ev in events]),
+                   ('end', 'End time', [ev['end'] for ev in events]),
+                   ('n_stitch', 'Stitches', [0] * len(events)),
+                   ('stage', 'Stage', [ev['stage'] for ev in events]),
+                   ('cycle', 'Cycle', [ev['cycle'] for ev in events]),
+                   ('name', 'Event type', [ev['name'] for ev in events]),
+                   ('chan', 'Channel', [', '.join(ev['chan'])
+                                        for ev in events]),
+                   ]
+        write_table(filename, columns,
+                    preamble=[['Wonambi v{}'.format(__version__)]])
 
     def import_events(self, filename, source='wonambi', rec_start=None,
                       chan_dict=None, chan_grp_name='eeg', parent=None):
@@ -2197,6 +2308,163 @@ class Annotations():
 
 
 
+def convert_annotations(input_file, output_file):
+    """Convert annotations between the xml and the sqlite format.
+
+    Parameters
+    ----------
+    input_file : path to file
+        annotation file (.xml, or .db / .sqlite)
+    output_file : path to file
+        file to create, the format depends on the extension (.db and .sqlite
+        are sqlite, anything else is xml)
+
+    Returns
+    -------
+    instance of Annotations
+        annotations in the new file
+    """
+    annot = Annotations(input_file)
+    _write_annotations(annot.root, output_file)
+    return Annotations(output_file)
+
+
+def query_events(db_file, name=None, time=None, chan=None, stage=None,
+                 qual=None, cycle=None, rater=None):
+    """Get the events directly from a sqlite annotation file, using indices
+    instead of loading all the annotations.
+
+    Parameters
+    ----------
+    db_file : path to file
+        annotation file in sqlite format (see convert_annotations)
+    name : str or list of str, optional
+        name of the event types of interest
+    time : tuple of two float, optional
+        start and end time of the period of interest
+    chan : tuple of str, optional
+        list of channels of interests, as in Annotations.get_events
+    stage : tuple of str, optional
+        list of stages of interest
+    qual : str, optional
+        epoch signal qualifier (Good or Poor)
+    cycle : list of int, optional
+        list of cycles of interest, numbered starting at 1
+    rater : str, optional
+        name of the rater (default: the first rater)
+
+    Returns
+    -------
+    list of dict
+        where each dict has 'name', 'start', 'end', 'chan', 'stage',
+        'quality' and 'cycle', as in Annotations.get_events
+
+    Raises
+    ------
+    IndexError
+        When there is no rater
+
+    Notes
+    -----
+    As in Annotations.get_events, the stage and the quality of an event are
+    those of the last epoch starting before the event (or of the last epoch,
+    if the event starts before the first epoch).
+    """
+    query = ('SELECT event_types.name, events.start_time, events.end_time, '
+             'events.chan, events.qual, ' + _epoch_column('stage') + ', ' +
+             _epoch_column('quality') + ' FROM events '
+             'JOIN event_types ON events.type_id = event_types.id '
+             'WHERE event_types.rater_id = ?')
+
+    with closing(connect(str(db_file))) as db:
+        if rater is None:
+            row = db.execute('SELECT id FROM raters ORDER BY id').fetchone()
+        else:
+            row = db.execute('SELECT id FROM raters WHERE name = ?',
+                             (rater, )).fetchone()
+        if row is None:
+            raise IndexError('Rater not found in ' + str(db_file))
+        rater_id = row[0]
+        params = [rater_id]
+
+        if name is not None:
+            if isinstance(name, str):
+                name = (name, )
+            query += (' AND event_types.name IN (' +
+                      ', '.join('?' * len(name)) + ')')
+            params.extend(name)
+
+        if time is not None:
+            query += ' AND events.start_time <= ? AND events.end_time >= ?'
+            params.extend((time[1], time[0]))
+
+        if chan is not None:
+            if isinstance(chan, (tuple, list)):
+                if chan[0] is not None:
+                    chan = ', '.join(chan)
+                else:
+                    chan = None
+        if chan is not None:
+            query += ' AND events.chan = ?'
+            params.append(chan)
+
+        # stage and quality are the columns computed by _epoch_column
+        if stage is not None:
+            query += ' AND stage IN (' + ', '.join('?' * len(stage)) + ')'
+            params.extend(stage)
+
+        if qual is not None:
+            query += ' AND quality = ?'
+            params.append(qual)
+
+        query += ' ORDER BY event_types.id, events.id'
+        rows = db.execute(query, params).fetchall()
+
+        if cycle is not None:
+            markers = db.execute('SELECT marker, time FROM cycles WHERE '
+                                 'rater_id = ?', (rater_id, )).fetchall()
+            cycles = _compute_cycles(
+                [float(t) for m, t in markers if m == 'cyc_start'],
+                [float(t) for m, t in markers if m == 'cyc_end']) or []
+
+    ev = []
+    for ev_name, ev_start, ev_end, ev_chan, ev_qual, ev_stage, _ in rows:
+        one_ev = {'name': ev_name,
+                  'start': ev_start,
+                  'end': ev_end,
+                  'chan': ev_chan.split(', '),  # always a list
+                  'stage': '',
+                  'quality': ev_qual,
+                  'cycle': '',
+                  }
+        if stage is not None:
+            one_ev['stage'] = ev_stage
+        if cycle is not None:
+            ev_cycle = None
+            for cyc_start, cyc_end, cyc_number in cycles:
+                if cyc_start <= ev_start < cyc_end:
+                    ev_cycle = cyc_number
+                    break
+            if ev_cycle not in cycle:
+                continue
+            one_ev['cycle'] = ev_cycle
+        ev.append(one_ev)
+
+    return ev
+
+
+def _epoch_column(column):
+    """Value in the epoch of each event, as in Annotations.get_events (the
+    last epoch starting before the event or, if there is none, the last
+    epoch)."""
+    last_epoch = ('SELECT epochs.' + column + ' FROM epochs WHERE '
+                  'epochs.rater_id = event_types.rater_id ')
+    return ('COALESCE((' + last_epoch +
+            'AND epochs.start_time <= events.start_time '
+            'ORDER BY epochs.start_time DESC LIMIT 1), (' + last_epoch +
+            'ORDER BY epochs.start_time DESC LIMIT 1)) AS ' + column)
+
+
 def update_annotation_version(xml_file):
     """Update the fields that have changed over different versions.
 
@@ -2231,6 +2499,326 @@ def update_annotation_version(xml_file):
         with open(xml_file, 'w') as f:
             f.write(s)
 
+SQLITE_SCHEMA = """
+CREATE TABLE dataset (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE raters (id INTEGER PRIMARY KEY, name TEXT, created TEXT,
+                     modified TEXT);
+CREATE TABLE bookmarks (id INTEGER PRIMARY KEY, rater_id INTEGER, name TEXT,
+                        start_time REAL, end_time REAL, chan TEXT);
+CREATE TABLE event_types (id INTEGER PRIMARY KEY, rater_id INTEGER,
+                          name TEXT);
+CREATE TABLE events (id INTEGER PRIMARY KEY, type_id INTEGER,
+                     start_time REAL, end_time REAL, chan TEXT, qual TEXT);
+CREATE TABLE epochs (id INTEGER PRIMARY KEY, rater_id INTEGER,
+                     start_time INTEGER, end_time INTEGER, stage TEXT,
+                     quality TEXT);
+CREATE TABLE cycles (id INTEGER PRIMARY KEY, rater_id INTEGER, marker TEXT,
+                     time TEXT);
+CREATE INDEX idx_event_types ON event_types (rater_id, name);
+CREATE INDEX idx_events_time ON events (type_id, start_time);
+CREATE INDEX idx_events_chan ON events (chan);
+CREATE INDEX idx_epochs ON epochs (rater_id, start_time);
+"""
+DATASET_FIELDS = ('filename', 'path', 'start_time', 'first_second',
+                  'last_second')
+
+
+def _is_sqlite(filename):
+    return Path(filename).suffix.lower() in SQLITE_SUFFIXES
+
+
+def _write_annotations(root, filename):
+    if _is_sqlite(filename):
+        _write_sqlite(root, filename)
+    else:
+        _write_xml(root, filename)
+
+
+def _write_sqlite(root, db_file):
+    """Write the annotation tree to a sqlite file, with one table per type of
+    annotation. Only the rows which changed are written, in one transaction,
+    so the file is never left half-written."""
+    db = connect(str(db_file))
+    try:
+        if db.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                      "AND name = 'raters'").fetchone() is None:
+            db.executescript(SQLITE_SCHEMA)
+
+        with db:  # one transaction
+            dataset = [('version', root.get('version'))]
+            for field in DATASET_FIELDS:
+                dataset.append((field, root.find('dataset/' + field).text))
+            db.executemany('INSERT OR REPLACE INTO dataset VALUES (?, ?)',
+                           dataset)
+
+            raters = list(root.iterfind('rater'))
+            rater_ids = _sync_rows(
+                db, 'raters', ('name', 'created', 'modified'), None, None,
+                [(r.get('name'), r.get('created'), r.get('modified'))
+                 for r in raters])
+
+            for rater_id, rater in zip(rater_ids, raters):
+                _sync_rows(
+                    db, 'bookmarks', ('name', 'start_time', 'end_time',
+                                      'chan'), 'rater_id', rater_id,
+                    [(m.find('bookmark_name').text,
+                      float(m.find('bookmark_start').text),
+                      float(m.find('bookmark_end').text),
+                      m.find('bookmark_chan').text or '')
+                     for m in rater.iterfind('bookmarks/bookmark')])
+
+                e_types = list(rater.iterfind('events/event_type'))
+                type_ids = _sync_rows(
+                    db, 'event_types', ('name', ), 'rater_id', rater_id,
+                    [(e_type.get('type'), ) for e_type in e_types])
+                for type_id, e_type in zip(type_ids, e_types):
+                    _sync_rows(
+                        db, 'events', ('start_time', 'end_time', 'chan',
+                                       'qual'), 'type_id', type_id,
+                        [(float(e.find('event_start').text),
+                          float(e.find('event_end').text),
+                          e.find('event_chan').text or '',
+                          e.find('event_qual').text)
+                         for e in e_type])
+
+                _sync_rows(
+                    db, 'epochs', ('start_time', 'end_time', 'stage',
+                                   'quality'), 'rater_id', rater_id,
+                    [(int(ep.find('epoch_start').text),
+                      int(ep.find('epoch_end').text),
+                      ep.find('stage').text,
+                      ep.find('quality').text)
+                     for ep in rater.iterfind('stages/epoch')])
+
+                _sync_rows(
+                    db, 'cycles', ('marker', 'time'), 'rater_id', rater_id,
+                    [(mrkr.tag, mrkr.text)
+                     for mrkr in rater.iterfind('cycles/*')])
+
+            # rows of the raters and event types which were removed
+            for table in ('bookmarks', 'event_types', 'epochs', 'cycles'):
+                db.execute('DELETE FROM ' + table + ' WHERE rater_id NOT IN '
+                           '(SELECT id FROM raters)')
+            db.execute('DELETE FROM events WHERE type_id NOT IN '
+                       '(SELECT id FROM event_types)')
+
+    finally:
+        db.close()
+
+
+def _sync_rows(db, table, columns, parent, parent_id, rows):
+    """Change the rows of one table (only those of one parent, if parent is
+    not None) so that they are the same as rows, in the same order.
+
+    Parameters
+    ----------
+    db : instance of sqlite3.Connection
+        open sqlite file
+    table : str
+        name of the table
+    columns : tuple of str
+        columns to compare (all the columns, except id and parent)
+    parent : str
+        column with the id of the parent (f.e. rater_id)
+    parent_id : int
+        id of the parent
+    rows : list of tuple
+        values of the columns, in order
+
+    Returns
+    -------
+    list of int
+        id of each row, in the same order as rows
+
+    Notes
+    -----
+    The rows are read in the order of their id, so the common cases (rows
+    appended at the end, rows removed, values changed in place) only need an
+    INSERT, DELETE or UPDATE of the rows which changed. Otherwise, the rows
+    after the first difference are written again.
+    """
+    where = ''
+    where_params = ()
+    if parent is not None:
+        where = ' WHERE ' + parent + ' = ?'
+        where_params = (parent_id, )
+    current = db.execute('SELECT id, ' + ', '.join(columns) + ' FROM ' +
+                         table + where + ' ORDER BY id',
+                         where_params).fetchall()
+    ids = [row[0] for row in current]
+    old = [row[1:] for row in current]
+
+    if len(old) == len(rows):
+        db.executemany('UPDATE ' + table + ' SET ' +
+                       ', '.join(c + ' = ?' for c in columns) +
+                       ' WHERE id = ?',
+                       [new + (i, ) for i, one_old, new
+                        in zip(ids, old, rows) if one_old != new])
+        return ids
+
+    if len(rows) < len(old):
+        # check if some rows were only removed
+        kept = []
+        for i, one_old in zip(ids, old):
+            if len(kept) < len(rows) and one_old == rows[len(kept)]:
+                kept.append(i)
+        if len(kept) == len(rows):
+            removed = set(ids) - set(kept)
+            db.executemany('DELETE FROM ' + table + ' WHERE id = ?',
+                           [(i, ) for i in ids if i in removed])
+            return kept
+
+    n_same = 0
+    for one_old, new in zip(old, rows):
+        if one_old != new:
+            break
+        n_same += 1
+
+    db.executemany('DELETE FROM ' + table + ' WHERE id = ?',
+                   [(i, ) for i in ids[n_same:]])
+    if parent is not None:
+        columns = (parent, ) + columns
+        rows = [(parent_id, ) + row for row in rows]
+    insert = ('INSERT INTO ' + table + ' (' + ', '.join(columns) +
+              ') VALUES (' + ', '.join('?' * len(columns)) + ')')
+    new_ids = [db.execute(insert, row).lastrowid for row in rows[n_same:]]
+
+    return ids[:n_same] + new_ids
+
+
+def _read_sqlite(db_file):
+    """Read the annotation tree from a sqlite file (see _write_sqlite)."""
+    with closing(connect(str(db_file))) as db:
+        dataset = dict(db.execute('SELECT key, value FROM dataset'))
+        raters = db.execute('SELECT id, name, created, modified FROM raters '
+                            'ORDER BY id').fetchall()
+        bookmarks = _group_rows(db.execute(
+            'SELECT rater_id, name, start_time, end_time, chan FROM bookmarks '
+            'ORDER BY id'))
+        event_types = _group_rows(db.execute(
+            'SELECT rater_id, id, name FROM event_types ORDER BY id'))
+        events = _group_rows(db.execute(
+            'SELECT type_id, start_time, end_time, chan, qual FROM events '
+            'ORDER BY id'))
+        epochs = _group_rows(db.execute(
+            'SELECT rater_id, start_time, end_time, stage, quality FROM '
+            'epochs ORDER BY id'))
+        cycles = _group_rows(db.execute(
+            'SELECT rater_id, marker, time FROM cycles ORDER BY id'))
+
+    root = Element('annotations')
+    root.set('version', dataset['version'])
+    info = SubElement(root, 'dataset')
+    for field in DATASET_FIELDS:
+        SubElement(info, field).text = dataset[field]
+
+    for rater_id, rater_name, created, modified in raters:
+        rater = SubElement(root, 'rater')
+        rater.set('name', rater_name)
+        for attr, value in (('created', created), ('modified', modified)):
+            if value is not None:
+                rater.set(attr, value)
+
+        parent = SubElement(rater, 'bookmarks')
+        for m_name, m_start, m_end, m_chan in bookmarks.get(rater_id, []):
+            m = SubElement(parent, 'bookmark')
+            SubElement(m, 'bookmark_name').text = m_name
+            SubElement(m, 'bookmark_start').text = str(m_start)
+            SubElement(m, 'bookmark_end').text = str(m_end)
+            SubElement(m, 'bookmark_chan').text = m_chan or None
+
+        parent = SubElement(rater, 'events')
+        for type_id, type_name in event_types.get(rater_id, []):
+            e_type = SubElement(parent, 'event_type')
+            e_type.set('type', type_name)
+            for e_start, e_end, e_chan, e_qual in events.get(type_id, []):
+                e = SubElement(e_type, 'event')
+                SubElement(e, 'event_start').text = str(e_start)
+                SubElement(e, 'event_end').text = str(e_end)
+                SubElement(e, 'event_chan').text = e_chan or None
+                SubElement(e, 'event_qual').text = e_qual
+
+        parent = SubElement(rater, 'stages')
+        for ep_start, ep_end, ep_stage, ep_qual in epochs.get(rater_id, []):
+            ep = SubElement(parent, 'epoch')
+            SubElement(ep, 'epoch_start').text = str(ep_start)
+            SubElement(ep, 'epoch_end').text = str(ep_end)
+            SubElement(ep, 'stage').text = ep_stage
+            SubElement(ep, 'quality').text = ep_qual
+
+        parent = SubElement(rater, 'cycles')
+        for marker, mrkr_time in cycles.get(rater_id, []):
+            SubElement(parent, marker).text = mrkr_time
+
+    return root
+
+
+def _compute_cycles(starts, ends):
+    """Cycle start and end times from the cycle markers (see get_cycles)."""
+    starts = sorted(starts)
+    ends = sorted(ends)
+    cyc_list = []
+
+    if not starts or not ends:
+        return None
+
+    if all(i < starts[0] for i in ends):
+        raise ValueError('First cycle has no start.')
+
+    for (this_start, next_start) in zip(starts, starts[1:] + [inf]):
+        # if an end is smaller than the next start, make it the end
+        # otherwise, the next_start is the end
+        end_between_starts = [end for end in ends \
+                              if this_start < end <= next_start]
+
+        if len(end_between_starts) > 1:
+            raise ValueError('Found more than one cycle end for same '
+                             'cycle')
+
+        if end_between_starts:
+            one_cycle = (this_start, end_between_starts[0])
+        else:
+            one_cycle = (this_start, next_start)
+
+        if one_cycle[1] == inf:
+            raise ValueError('Last cycle has no end.')
+
+        cyc_list.append(one_cycle)
+
+    output = []
+    for i, j in enumerate(cyc_list):
+        cyc = j[0], j[1], i + 1
+        output.append(cyc)
+
+    return output
+
+
+def _group_rows(rows):
+    """Group the rows of a query by the value in the first column."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(row[1:])
+    return groups
+
+
+def _write_xml(root, xml_file):
+    """Write the xml tree to a temporary file, then rename it, so that the
+    file on disk is always complete."""
+    xml_file = Path(xml_file)
+    tmp_file = xml_file.with_name(xml_file.name + '.tmp')
+    with tmp_file.open('wb') as f:
+        ElementTree(root).write(f, encoding='utf-8', xml_declaration=True)
+    replace(str(tmp_file), str(xml_file))
+
+
+def _json_default(x):
+    """Convert numpy values when writing the journal."""
+    try:
+        return x.tolist()
+    except AttributeError:
+        return str(x)
+
+
 def _abs_time_str(delay, abs_start, time_str='%Y-%m-%dT%H:%M:%S'):
     return (abs_start + timedelta(seconds=float(delay))).strftime(time_str)
 
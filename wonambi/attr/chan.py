@@ -11,8 +11,9 @@ In other words, the channel is where you want to plot the signal.
 """
 from logging import getLogger
 from pathlib import Path
-from numpy import asarray, ndindex, zeros
-from numpy.linalg import norm
+from numpy import (asarray, ceil, floor, full, inf, int32, minimum, mgrid,
+                   zeros)
+from numpy.linalg import inv, norm
 from re import match
 
 from ..utils import UnrecognizedFormat, MissingDependency
@@ -385,12 +386,12 @@ def assign_region_to_channels(channels, anat, parc_type='aparc', max_approx=3,
     instance of wonambi.attr.chan.Channels
         same instance as before, now Chan have attr 'region'
     """
-    for one_chan in channels.chan:
-        one_region, approx = anat.find_brain_region(one_chan.xyz,
-                                                    parc_type,
-                                                    max_approx,
-                                                    exclude_regions)
-        one_chan.attr.update({'region': one_region, 'approx': approx})
+    regions, approx = anat.find_brain_regions(channels.return_xyz(),
+                                              parc_type, max_approx,
+                                              exclude_regions)
+    for one_chan, one_region, one_approx in zip(channels.chan, regions,
+                                                approx):
+        one_chan.attr.update({'region': one_region, 'approx': one_approx})
 
     return channels
 
@@ -487,9 +488,88 @@ def create_sphere_around_elec(xyz, template_mri, distance=8, freesurfer=None):
         template_mri = nload(str(template_mri))
 
     mask = zeros(template_mri.shape, dtype='bool')
-    for vox in ndindex(template_mri.shape):
-        vox_ras = apply_affine(template_mri.affine, vox) - shift
-        if norm(xyz - vox_ras) <= distance:
-            mask[vox] = True
+    box, dist = _distance_in_sphere(xyz, template_mri.affine,
+                                    template_mri.shape, distance, shift)
+    mask[box] = dist <= distance
 
     return mask
+
+
+def create_sphere_around_chan(chan, template_mri, distance=8,
+                              freesurfer=None, labelled=True):
+    """Create MRI masks around the location of all the channels.
+
+    Parameters
+    ----------
+    chan : instance of Channels
+        channels, with their locations
+    template_mri : path or str (as path) or nibabel.Nifti
+        (path to) MRI to be used as template
+    distance : float
+        distance in mm between electrode and selected voxels
+    freesurfer : instance of Freesurfer
+        to adjust RAS coordinates, see create_sphere_around_elec
+    labelled : bool
+        if True, it returns one volume with the index of the channels; if
+        False, one mask for each channel.
+
+    Returns
+    -------
+    3d int ndarray or 4d bool ndarray
+        if labelled, volume where each voxel has the index of the closest
+        channel (starting at 1) within the selected distance, or 0 if there is
+        none; otherwise, n_chan X mask for each channel (see
+        create_sphere_around_elec)
+    """
+    if freesurfer is None:
+        shift = 0
+    else:
+        shift = freesurfer.surface_ras_shift
+
+    if isinstance(template_mri, str) or isinstance(template_mri, Path):
+        template_mri = nload(str(template_mri))
+
+    if labelled:
+        output = zeros(template_mri.shape, dtype=int32)
+        closest = full(template_mri.shape, inf)
+    else:
+        output = zeros((chan.n_chan, ) + template_mri.shape, dtype='bool')
+
+    for i, xyz in enumerate(chan.return_xyz()):
+        box, dist = _distance_in_sphere(xyz, template_mri.affine,
+                                        template_mri.shape, distance, shift)
+        if labelled:
+            is_closer = (dist <= distance) & (dist < closest[box])
+            output[box][is_closer] = i + 1
+            closest[box] = minimum(closest[box], dist)
+        else:
+            output[i][box] = dist <= distance
+
+    return output
+
+
+def _distance_in_sphere(xyz, affine, shape, distance, shift):
+    """Compute the distance between the electrode and the voxels, only in the
+    box in voxel space which contains the sphere around the electrode.
+
+    Returns
+    -------
+    tuple of slice
+        the box (in voxels) around the electrode
+    3d ndarray
+        distance in mm between each voxel in the box and the electrode
+    """
+    inv_affine = inv(affine)
+    center = inv_affine[:3, :3] @ (xyz + shift) + inv_affine[:3, 3]
+    # extent of the sphere along each voxel axis
+    extent = distance * norm(inv_affine[:3, :3], axis=1)
+    start = (floor(center - extent) - 1).astype(int).clip(0, shape)
+    end = (ceil(center + extent) + 2).astype(int).clip(0, shape)
+    box = tuple(slice(one_start, one_end)
+                for one_start, one_end in zip(start, end))
+
+    vox = mgrid[box].reshape(3, -1).T
+    vox_ras = apply_affine(affine, vox) - shift
+    dist = norm(xyz - vox_ras, axis=1).reshape(tuple(end - start))
+
+    return box, dist
@@ -0,0 +1,370 @@
+"""Index of the files in a BIDS dataset, so that the sidecar files can be found
+without checking every possible filename on disk.
+"""
+from hashlib import sha1
+from json import dump, load
+from logging import getLogger
+from os import scandir
+from pathlib import Path
+from time import time
+
+lg = getLogger(__name__)
+
+# directory where to store the index of each BIDS dataset (if None, the index
+# is only kept in memory)
+CACHE_DIR = None
+# resolution of the modification time of the directories in the coarsest
+# filesystems (2 s in FAT, 1 s in HFS+ and in some NFS/SMB shares)
+MTIME_RESOLUTION = 2
+
+_layouts = {}
+
+
+def get_layout(path, refresh=False):
+    """Return the layout of the BIDS dataset containing path (the layout is
+    created only once for each dataset).
+
+    Parameters
+    ----------
+    path : path to file or directory
+        any file or directory inside the BIDS dataset
+    refresh : bool
+        scan the whole dataset again (not necessary if files were added or
+        removed, because the modified directories are scanned again before
+        each lookup)
+
+    Returns
+    -------
+    instance of BIDSLayout
+        layout of the whole dataset
+    """
+    root = find_root(path)
+    if refresh or root not in _layouts:
+        cache_file = None
+        if CACHE_DIR is not None:
+            name = sha1(str(root).encode()).hexdigest()
+            cache_file = Path(CACHE_DIR) / f'bids_layout_{name}.json'
+        _layouts[root] = BIDSLayout(root, cache_file=cache_file)
+
+    return _layouts[root]
+
+
+def find_root(path):
+    """Find the directory with dataset_description.json, above path."""
+    path = Path(path).resolve()
+    for one_dir in (path, ) + tuple(path.parents):
+        if (one_dir / 'dataset_description.json').exists():
+            return one_dir
+
+    raise ValueError(f'{path} is not in a BIDS dataset (there is no '
+                     'dataset_description.json)')
+
+
+class BIDSLayout:
+    """Index of all the files in a BIDS dataset.
+
+    Parameters
+    ----------
+    root : path to directory
+        directory with dataset_description.json
+    cache_file : path to file, optional
+        json file where to store the list of files. It's reused if none of the
+        directories in the dataset was modified after it was created.
+
+    Attributes
+    ----------
+    files : list of dict
+        for each file: 'path', 'entities' (dict), 'suffix' and 'extension'
+
+    Notes
+    -----
+    The dataset is scanned only once. Then, the files are grouped by
+    directory and by ending (f.e. 'channels.tsv') so that finding the sidecar
+    files (walk) or all the files of one subject (get) are dictionary lookups.
+
+    Before each lookup, the modification time of the directories is checked
+    and the directories which were modified (f.e. files were added) are
+    scanned again.
+    """
+    def __init__(self, root, cache_file=None):
+        self.root = Path(root).resolve()
+        self.cache_file = cache_file
+
+        listing = None
+        if cache_file is not None:
+            listing = _read_cache(cache_file, self.root)
+        if listing is None:
+            listing = _scan(self.root)
+            if cache_file is not None:
+                _write_cache(cache_file, listing)
+
+        self._dirs = {}  # for each directory: mtime, names, index by ending
+        for rel_dir, (mtime, names) in listing.items():
+            self._add_dir(self.root / rel_dir, mtime, names)
+
+        self._walk = {}
+
+    @property
+    def files(self):
+        return [one_file for mtime, names, index in self._dirs.values()
+                for same_ending in index.values() for one_file in same_ending]
+
+    def walk(self, path, values, ending):
+        """Find the files with a given ending whose entities are a subset of
+        values, in path and in all the directories above it (up to the root).
+
+        Parameters
+        ----------
+        path : path to directory
+            directory where to start
+        values : dict
+            values of the entities (if None, the entity is ignored)
+        ending : str
+            suffix and extension (f.e. 'channels.tsv')
+
+        Returns
+        -------
+        list of Path
+            matching files, from the most specific (in the lowest directory,
+            with the most entities) to the least specific.
+        """
+        path = Path(path).resolve()
+        self.update(path)
+
+        v = tuple((k, v) for k, v in values.items() if v is not None)
+        key = (path, v, ending)
+        if key not in self._walk:
+            self._walk[key] = self._find_in_parents(path, v, ending)
+        return list(self._walk[key])
+
+    def get(self, suffix=None, extension=None, **entities):
+        """Find all the files with given entities.
+
+        Parameters
+        ----------
+        suffix : str, optional
+            f.e. 'ieeg' or 'channels'
+        extension : str, optional
+            f.e. '.edf' or '.tsv'
+        entities
+            values of the entities, f.e. sub='01', task='rest'
+
+        Returns
+        -------
+        list of Path
+            all the files with those values
+
+        Examples
+        --------
+        >>> layout.get(sub='01', suffix='ieeg', extension='.edf')
+        """
+        self.update()
+
+        matches = []
+        for one_file in self.files:
+            if suffix is not None and one_file['suffix'] != suffix:
+                continue
+            if extension is not None and one_file['extension'] != extension:
+                continue
+            if all(one_file['entities'].get(k) == v
+                   for k, v in entities.items()):
+                matches.append(one_file['path'])
+
+        return sorted(matches)
+
+    def update(self, path=None):
+        """Scan again the directories which were modified since they were
+        scanned.
+
+        Parameters
+        ----------
+        path : path to directory, optional
+            if specified, only this directory and the directories above it
+            are checked. Otherwise, all the directories are checked.
+        """
+        if path is None:
+            to_check = sorted(self._dirs)
+        else:
+            path = Path(path).resolve()
+            to_check = [one_dir for one_dir in (path, ) + tuple(path.parents)
+                        if one_dir == self.root or self.root in one_dir.parents]
+            to_check = to_check[::-1]  # from the root
+
+        modified = False
+        for one_dir in to_check:
+            try:
+                mtime = one_dir.stat().st_mtime
+            except FileNotFoundError:
+                for old_dir in list(self._dirs):
+                    if old_dir == one_dir or one_dir in old_dir.parents:
+                        del self._dirs[old_dir]
+                        modified = True
+                continue
+
+            # mtime is None if the directory was scanned right after it was
+            # modified (see _scan_dir)
+            if one_dir in self._dirs and self._dirs[one_dir][0] == mtime:
+                continue
+            modified = True
+
+            lg.debug(f'{one_dir} was modified, scanning it again')
+            mtime, names, subdirs = _scan_dir(one_dir)
+            self._add_dir(one_dir, mtime, names)
+            for subdir in subdirs:  # new directories are scanned completely
+                if subdir not in self._dirs:
+                    for rel_dir, (mtime, names) in _scan(subdir).items():
+                        self._add_dir(subdir / rel_dir, mtime, names)
+
+        if modified:
+            self._walk = {}
+            if self.cache_file is not None:
+                _write_cache(self.cache_file, {
+                    str(one_dir.relative_to(self.root)): (mtime, names)
+                    for one_dir, (mtime, names, index) in self._dirs.items()})
+
+    def _add_dir(self, one_dir, mtime, names):
+        index = {}
+        for name in names:
+            parsed = parse_name(name)
+            if parsed is None:
+                continue
+            entities, suffix, extension = parsed
+            one_file = {'path': one_dir / name,
+                        'entities': entities,
+                        'suffix': suffix,
+                        'extension': extension,
+                        }
+            index.setdefault(suffix + extension, []).append(one_file)
+        self._dirs[one_dir] = (mtime, names, index)
+
+    def _find_in_parents(self, path, values, ending):
+        order = {kv: i for i, kv in enumerate(values)}
+
+        filenames = []
+        for one_dir in (path, ) + tuple(path.parents):
+            found = []
+            if one_dir in self._dirs:
+                index = self._dirs[one_dir][2]
+            else:
+                index = {}
+            for one_file in index.get(ending, []):
+                position = [order.get(kv) for kv in
+                            one_file['entities'].items()]
+                # all the entities of the file should be in values, in order
+                if None in position or position != sorted(position):
+                    continue
+                found.append((-len(position), position, one_file['path']))
+            filenames.extend(x[2] for x in sorted(found))
+
+            if one_dir == self.root:
+                break
+
+        return filenames
+
+
+def parse_name(name):
+    """Split the name of a file into entities, suffix and extension.
+
+    Parameters
+    ----------
+    name : str
+        name of the file, f.e. 'sub-01_task-rest_ieeg.edf'
+
+    Returns
+    -------
+    dict
+        entities with their values, f.e. {'sub': '01', 'task': 'rest'}
+    str
+        suffix, f.e. 'ieeg'
+    str
+        extension, f.e. '.edf'
+    or None if the name does not have any entity.
+    """
+    parts = name.split('_')
+    if len(parts) < 2:
+        return None
+
+    entities = {}
+    for part in parts[:-1]:
+        k, sep, v = part.partition('-')
+        if not sep or not v:
+            return None
+        entities[k] = v
+
+    last = parts[-1]
+    if last.endswith('.nii.gz'):
+        suffix, extension = last[:-len('.nii.gz')], '.nii.gz'
+    else:
+        suffix, dot, extension = last.rpartition('.')
+        if dot:
+            extension = '.' + extension
+        else:
+            suffix, extension = last, ''
+
+    return entities, suffix, extension
+
+
+def _scan(root):
+    """Names of all the files in each directory (with its mtime)."""
+    listing = {}
+    to_scan = [root, ]
+    while to_scan:
+        one_dir = to_scan.pop()
+        mtime, names, subdirs = _scan_dir(one_dir)
+        to_scan.extend(subdirs)
+        rel_dir = str(one_dir.relative_to(root))
+        listing[rel_dir] = (mtime, names)
+
+    return listing
+
+
+def _scan_dir(one_dir):
+    """mtime, names of the files and subdirectories of one directory.
+
+    mtime is None if the directory was modified less than MTIME_RESOLUTION
+    ago, because a file added in the same tick as the listing would not
+    change the mtime: the directory is scanned again the next time.
+    """
+    # mtime before the listing, so that files added meanwhile are found later
+    mtime = one_dir.stat().st_mtime
+    if abs(time() - mtime) < MTIME_RESOLUTION:
+        mtime = None
+    names = []
+    subdirs = []
+    with scandir(one_dir) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirs.append(Path(entry.path))
+            else:
+                names.append(entry.name)
+
+    return mtime, sorted(names), subdirs
+
+
+def _read_cache(cache_file, root):
+    """Read the listing, but only if no directory was modified since."""
+    cache_file = Path(cache_file)
+    if not cache_file.exists():
+        return None
+
+    with cache_file.open() as f:
+        listing = load(f)
+
+    for rel_dir, (mtime, names) in listing.items():
+        try:
+            if (root / rel_dir).stat().st_mtime != mtime:
+                lg.debug(f'{root / rel_dir} was modified, scanning again')
+                return None
+        except FileNotFoundError:
+            return None
+
+    return listing
+
+
+def _write_cache(cache_file, listing):
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with cache_file.open('w') as f:
+        dump(listing, f)
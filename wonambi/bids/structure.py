@@ -2,7 +2,7 @@ from pathlib import Path
 from numpy import ndarray
 
 from .utils import _match, get_tsv, get_json
-from ..dataset import Dataset
+from ..dataset import open_dataset
 
 
 BIDS_ENTITIES = (
@@ -92,7 +92,7 @@ class BIDSEEG(BIDSMain):
                 events = events['onset']
             events = list(events)
 
-        return Dataset(self.filename).read_data(
+        return open_dataset(self.filename).read_data(
             chan=chan, begtime=begtime, endtime=endtime, events=events,
             pre=pre, post=post)
 
@@ -242,6 +242,9 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         """save the name of the last open dataset."""
+        if self.notes.annot is not None:
+            self.notes.annot.flush()
+
         max_dataset_history = self.value('max_dataset_history')
         keep_recent_datasets(max_dataset_history, self.info)
 
@@ -2,36 +2,31 @@
 
 """
 from datetime import timedelta, datetime
+from functools import lru_cache
+from hashlib import sha1
 from math import ceil
 from logging import getLogger
+from os import scandir
 from pathlib import Path
+from pickle import dumps, loads, PicklingError
 
 from numpy import arange, asarray, concatenate, empty, int64, zeros, ndarray
 
-from .ioeeg import (Abf,
-                    Edf,
-                    Ktlx,
-                    BlackRock,
-                    EgiMff,
-                    EEGLAB,
-                    FieldTrip,
-                    BrainVision,
-                    Moberg,
-                    Wonambi,
-                    Micromed,
-                    BCI2000,
-                    OpenEphys,
-                    Text,
-                    BIDS,
-                    LyonRRI,
-                    )
-from .ioeeg.bci2000 import _read_header_length
+from . import __version__, ioeeg
 from .datatype import ChanTime
 from .utils import UnrecognizedFormat
 
 
 lg = getLogger('wonambi')
 
+# number of datasets kept open by open_dataset
+MAX_OPEN_DATASETS = 16
+# default directory for header_cache=True
+HEADER_CACHE_DIR = Path.home() / '.cache' / 'wonambi' / 'headers'
+# readers whose state is larger than this (f.e. with the data in memory) are
+# not cached
+MAX_HEADER_CACHE_SIZE = 16 * 1024 ** 2
+
 
 def _convert_time_to_sample(abs_time, dataset):
     """Convert absolute time into samples.
@@ -86,39 +81,40 @@ def detect_format(filename):
 
     if filename.is_dir():
         if list(filename.glob('*.stc')) and list(filename.glob('*.erd')):
-            return Ktlx, sessions
+            return ioeeg.Ktlx, sessions
         elif (filename / 'patient.info').exists():
-            return Moberg, sessions
+            return ioeeg.Moberg, sessions
         elif (filename / 'info.xml').exists():
-            return EgiMff, sessions
+            return ioeeg.EgiMff, sessions
         elif list(filename.glob('*.openephys')):
             sessions = _count_openephys_sessions(filename)
-            return OpenEphys, sessions
+            return ioeeg.OpenEphys, sessions
         elif list(filename.glob('*.txt')):
-            return Text, sessions
+            return ioeeg.Text, sessions
         else:
             raise UnrecognizedFormat('Unrecognized format for directory ' +
                                      str(filename))
     else:
         if filename.suffix == '.won':
-            return Wonambi, sessions
+            return ioeeg.Wonambi, sessions
 
         if filename.suffix.lower() == '.trc':
-            return Micromed, sessions
+            return ioeeg.Micromed, sessions
 
         if filename.suffix == '.set':
-            return EEGLAB, sessions
+            return ioeeg.EEGLAB, sessions
 
         if filename.suffix in ['.edf', '.rec']:
-            return Edf, sessions
+            return ioeeg.Edf, sessions
 
         if filename.suffix == '.abf':
-            return Abf, sessions
+            return ioeeg.Abf, sessions
 
         if filename.suffix == '.vhdr' or filename.suffix == '.eeg':
-            return BrainVision, sessions
+            return ioeeg.BrainVision, sessions
 
         if filename.suffix == '.dat':  # very general
+            from .ioeeg.bci2000 import _read_header_length
             try:
                 _read_header_length(filename)
 
@@ -126,20 +122,20 @@ def detect_format(filename):
                 pass
 
             else:
-                return BCI2000, sessions
+                return ioeeg.BCI2000, sessions
 
         with filename.open('rb') as f:
             file_header = f.read(8)
             if file_header in (b'NEURALCD', b'NEURALSG', b'NEURALEV'):
-                return BlackRock, sessions
+                return ioeeg.BlackRock, sessions
             elif file_header[:6] == b'MATLAB':  # we might need to read more
-                return FieldTrip, sessions
+                return ioeeg.FieldTrip, sessions
 
         if filename.suffix.lower() == '.txt':
             with filename.open('rt') as f:
                 first_line = f.readline()
                 if '.rr' in first_line[-4:]:
-                    return LyonRRI, sessions
+                    return ioeeg.LyonRRI, sessions
 
         else:
             raise UnrecognizedFormat('Unrecognized format for file ' +
@@ -158,6 +154,12 @@ class Dataset:
     bids : bool
         whether you give precedence to the information stored in the accompanying
         files which are in the BIDS format
+    header_cache : bool or str or Path
+        if True, store the header in HEADER_CACHE_DIR (or in the directory
+        passed as argument) and reuse it the next time the same file is
+        opened, if the files did not change in size or modification time
+        (including the files which come with it, see _recording_files). If
+        None (default), the header is always read from the file.
 
     Attributes
     ----------
@@ -192,24 +194,41 @@ class Dataset:
     while the latter is the file that you really read. There might be
     differences, for example, if the argument points to a file within a
     directory, or if the file is mapped to memory.
+
+    The header cache stores the header and the reader (the instance of
+    IOClass, after reading the header) with pickle, so only use a directory
+    that you trust. It's useful for formats that are slow to open (f.e. Ktlx,
+    EgiMff, Micromed, BlackRock).
     """
-    def __init__(self, filename, IOClass=None, session=None, bids=False):
+    def __init__(self, filename, IOClass=None, session=None, bids=False,
+                 header_cache=None):
         self.filename = Path(filename)
 
         if bids:
-            IOClass = BIDS
+            IOClass = ioeeg.BIDS
 
         if IOClass is not None:
             self.IOClass = IOClass
         else:
             self.IOClass, sessions = detect_format(filename)
 
-        if self.IOClass in (OpenEphys, ):
+        if self.IOClass in (ioeeg.OpenEphys, ):
             if session is None:
                 session = 1
                 if len(sessions) > 1:
                     lg.warning(f'Multiple sessions in the dataset, selecting the first one. You can specify the session with "session="')
 
+        cache_file = None
+        if header_cache:
+            cache_file, signature = _header_cache_file(
+                self.filename, self.IOClass, session, header_cache)
+        if cache_file is not None:
+            cached = _read_header_cache(cache_file, signature)
+            if cached is not None:
+                self.header, self.dataset = cached
+                return
+
+        if self.IOClass in (ioeeg.OpenEphys, ):
             lg.debug(f'Reading session {session}')
             self.dataset = self.IOClass(self.filename, session=session)
 
@@ -228,6 +247,10 @@ class Dataset:
         hdr['orig'] = output[5]
         self.header = hdr
 
+        if cache_file is not None:
+            _write_header_cache(cache_file, signature, self.header,
+                                self.dataset)
+
     def read_markers(self, **kwargs):
         """Return the markers. You can add optional arguments that will be
         passed to the method specific for each datafile.
@@ -424,6 +447,173 @@ class Dataset:
         return samples
 
 
+def open_dataset(filename, IOClass=None, session=None, bids=False,
+                 header_cache=None):
+    """Return a Dataset, which is shared with the previous calls with the same
+    arguments (if the file was not modified in the meantime).
+
+    Parameters
+    ----------
+    filename : str or Path
+        name of the file or directory
+    IOClass, session, bids, header_cache
+        see Dataset
+
+    Returns
+    -------
+    instance of Dataset
+        dataset with the parsed header and the open reader. Do not modify it,
+        because it's shared with the other callers.
+
+    Notes
+    -----
+    The datasets are kept in a process-wide registry, keyed by path, size and
+    modification time of the file and of the files which come with it (f.e.
+    the .eeg file of BrainVision, see _recording_files). Only the last
+    MAX_OPEN_DATASETS datasets are kept. Formats which cannot list their files
+    (BIDS) are opened again every time. Use this function instead of Dataset
+    if you read the same recording many times (f.e. epoch by epoch), so that
+    the format is detected and the header is parsed only once.
+    """
+    filename = Path(filename).resolve()
+    if bids:
+        file_format = ioeeg.BIDS
+    elif IOClass is None:
+        stat = filename.stat()
+        file_format = _detect_format(filename, stat.st_size, stat.st_mtime_ns)
+    else:
+        file_format = IOClass
+
+    files = _recording_files(filename, file_format)
+    if files is None:
+        return Dataset(filename, IOClass=IOClass, session=session, bids=bids,
+                       header_cache=header_cache)
+
+    return _open_dataset(filename, _signature(files), IOClass, session, bids,
+                         header_cache)
+
+
+@lru_cache(maxsize=MAX_OPEN_DATASETS)
+def _open_dataset(filename, signature, IOClass, session, bids, header_cache):
+    """signature is only used to open the dataset again, if the files were
+    modified."""
+    lg.debug(f'Opening {filename}')
+    return Dataset(filename, IOClass=IOClass, session=session, bids=bids,
+                   header_cache=header_cache)
+
+
+@lru_cache(maxsize=MAX_OPEN_DATASETS)
+def _detect_format(filename, size, mtime):
+    """size and mtime are only used to detect the format again, if the file
+    was modified."""
+    return detect_format(filename)[0]
+
+
+def _recording_files(filename, IOClass):
+    """Files which are read with the header.
+
+    Parameters
+    ----------
+    filename : Path
+        file or directory with the recording
+    IOClass : class
+        one of the classes of wonambi.ioeeg
+
+    Returns
+    -------
+    list of Path
+        the file (or all the files in the directory) and the files returned by
+        IOClass.companion_files, if the reader has this method (f.e. the .eeg
+        and .vmrk files for BrainVision). None if the reader cannot list all
+        the files it reads (companion_files returns None).
+    """
+    if filename.is_dir():
+        with scandir(filename) as it:
+            files = [Path(x.path) for x in it if x.is_file()]
+    else:
+        files = [filename, ]
+
+    companion_files = getattr(IOClass, 'companion_files', None)
+    if companion_files is not None:
+        companions = companion_files(filename)
+        if companions is None:
+            return None
+        files.extend(companions)
+
+    return files
+
+
+def _signature(files):
+    """Path, size and modification time of each file."""
+    signature = []
+    for one_file in set(files):
+        try:
+            stat = one_file.stat()
+            signature.append((str(one_file), stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((str(one_file), None, None))
+
+    return tuple(sorted(signature, key=lambda x: x[0]))
+
+
+def _header_cache_file(filename, IOClass, session, cache_dir):
+    """Name of the file in the header cache and signature of the recording
+    (see _recording_files). The name of the file is None, if the header
+    cannot be cached.
+    """
+    if cache_dir is True:
+        cache_dir = HEADER_CACHE_DIR
+    filename = filename.resolve()
+
+    files = _recording_files(filename, IOClass)
+    if files is None:
+        lg.debug(f'The header of {filename} cannot be cached')
+        return None, None
+
+    # the version, because the reader (and its attributes) is stored too
+    key = (f'{__version__}|{filename}|{IOClass.__module__}.'
+           f'{IOClass.__name__}|{session}')
+    cache_file = Path(cache_dir) / (sha1(key.encode()).hexdigest() + '.pkl')
+    return cache_file, _signature(files)
+
+
+def _read_header_cache(cache_file, signature):
+    """Return header and reader, if the recording did not change."""
+    if not cache_file.exists():
+        return None
+
+    try:
+        cached = loads(cache_file.read_bytes())
+    except Exception as err:  # corrupted or from a different version
+        lg.debug(f'Could not read header cache {cache_file}: {err}')
+        return None
+
+    if cached['signature'] != signature:
+        lg.debug(f'Header cache {cache_file} is out of date')
+        return None
+
+    lg.debug(f'Reading header from cache {cache_file}')
+    return cached['header'], cached['reader']
+
+
+def _write_header_cache(cache_file, signature, header, reader):
+    try:
+        cached = dumps({'signature': signature,
+                        'header': header,
+                        'reader': reader,
+                        })
+    except (PicklingError, TypeError, AttributeError) as err:
+        lg.debug(f'Cannot store the header of {reader.filename}: {err}')
+        return
+
+    if len(cached) > MAX_HEADER_CACHE_SIZE:
+        lg.debug(f'Header of {reader.filename} is too large to be stored')
+        return
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_bytes(cached)
+
+
 def _count_openephys_sessions(filename):
     """Open-ephys can have multiple sessions. We count how many files are in
     the format:
@@ -1,7 +1,16 @@
 """Package to detect spindles, ripples, slow waves.
 """
-from .spindle import DetectSpindle, merge_close, transform_signal
-from .ripple import DetectRipple
-from .slowwave import DetectSlowWave
-from .arousal import DetectArousal
-from .agreement import consensus, match_events
+from ..utils.lazy import lazy_attributes
+
+# imported only when used (PEP 562), because of scipy.signal / scipy.ndimage
+_LAZY = {'DetectSpindle': '.spindle',
+         'merge_close': '.spindle',
+         'transform_signal': '.spindle',
+         'DetectRipple': '.ripple',
+         'DetectSlowWave': '.slowwave',
+         'DetectArousal': '.arousal',
+         'consensus': '.agreement',
+         'match_events': '.agreement',
+         }
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY, globals())
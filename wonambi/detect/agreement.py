@@ -1,8 +1,10 @@
 """Module for agreement and consensus analysis between raters"""
 
-from numpy import (arange, argmax, asarray, concatenate, diff, invert, 
-                   logical_and, maximum, mean, minimum, newaxis, ones, repeat, 
-                   sum, vstack, where, zeros)
+from numpy import (arange, argmax, argsort, asarray, concatenate, cumsum,
+                   diff, invert, isin, lexsort, logical_and, maximum, mean,
+                   minimum, newaxis, ones, repeat, searchsorted, unique,
+                   vstack, where, zeros)
+from scipy.sparse import csr_matrix, issparse
 
 from .. import Graphoelement
 
@@ -11,8 +13,9 @@ class MatchedEvents:
     
     Parameters
     ----------
-    tp : ndarray
+    tp : ndarray or csr_matrix
         true positives as boolean array of shape len(detection) x len(standard)
+        or as sparse matrix (see the attribute tp)
     fp : ndarray
         indices of false positives in detection
     fn : ndarray
@@ -25,18 +28,37 @@ class MatchedEvents:
     threshold : float
         minimum intersection-union score for events to be considered 
         overlapping
+    sparse : bool
+        if True, the attribute tp is the sparse matrix. If False, a sparse
+        matrix is converted to boolean array, but only when tp is used.
     """
-    def __init__(self, tp, fp, fn, detection, standard, threshold):
-        self.tp = tp
+    def __init__(self, tp, fp, fn, detection, standard, threshold,
+                 sparse=False):
+        self._tp = tp
+        self.sparse = sparse
         self.fp = fp
         self.fn = fn
         self.detection = detection
         self.standard = standard
         self.threshold = threshold        
-        self.n_tp = sum(tp)
+        self.n_tp = tp.sum()
         self.n_fp = len(fp)
         self.n_fn = len(fn)
 
+    @property
+    def tp(self):
+        """True positives, as boolean array of shape len(detection) x
+        len(standard) or as csr_matrix (if sparse is True).
+
+        The boolean array is created from the sparse matrix the first time tp
+        is used and it takes len(detection) x len(standard) bytes (f.e. 2.5 GB
+        for 50000 events in each). recall, precision, f1score and to_annot
+        do not create it.
+        """
+        if issparse(self._tp) and not self.sparse:
+            self._tp = self._tp.toarray()
+        return self._tp
+
     @property
     def recall(self):
         tp = self.n_tp
@@ -80,10 +102,10 @@ class MatchedEvents:
             events = cons.events
         
         elif 'tp_det' == category:
-            events = asarray(self.detection)[self.tp.any(axis=1)]
+            events = asarray(self.detection)[_any(self._tp, axis=1)]
             
         elif 'tp_std' == category:
-            events = asarray(self.standard)[self.tp.any(axis=0)] 
+            events = asarray(self.standard)[_any(self._tp, axis=0)]
             
         elif 'fp' == category:
             events = asarray(self.detection)[self.fp]
@@ -105,7 +127,8 @@ class MatchedEvents:
         self.to_annot(annot, 'fn', names[3])
 
 
-def consensus(events, threshold, s_freq, min_duration=None, weights=None):
+def consensus(events, threshold, s_freq, min_duration=None, weights=None,
+              by_chan=False, method='sweep'):
     """Take two or more event lists and output a merged list based on 
     consensus.
     
@@ -125,19 +148,71 @@ def consensus(events, threshold, s_freq, min_duration=None, weights=None):
         sampling frequency, in Hz
     min_duration : float, optional
         minimum duration for merged events, in s.
+    weights : list of float, optional
+        weight of each rater (default: 1 for all the raters)
+    by_chan : bool
+        if True, compute the consensus separately for each channel. If False,
+        all the events are merged and get the channel of the first event.
+    method : str
+        'sweep' computes the consensus only at the event boundaries, so that
+        the memory does not depend on the duration of the recording. 'dense'
+        computes the consensus for each sample. Both give the same events.
         
     Returns
     -------
     instance of wonambi.Graphoelement
         events merged by consensus
     """
-    chan = [one_rater[0]['chan'] for one_rater in events if one_rater][0]
+    if weights is None:
+        weights = ones(len(events))
+
+    if by_chan:
+        groups = {}
+        for i, one_rater in enumerate(events):
+            for ev in one_rater:
+                chan = groups.setdefault(_chan_key(ev['chan']),
+                                         (ev['chan'], [[] for x in events]))
+                chan[1][i].append(ev)
+        groups = list(groups.values())
+    else:
+        chan = [one_rater[0]['chan'] for one_rater in events if one_rater][0]
+        groups = [(chan, events)]
+
+    out = Graphoelement()
+    out.events = []
+    for chan, chan_events in groups:
+        if method == 'sweep':
+            merged = _consensus_sweep(chan_events, threshold, s_freq, weights)
+        elif method == 'dense':
+            merged = _consensus_dense(chan_events, threshold, s_freq, weights)
+        else:
+            raise ValueError('Unknown method ' + method)
+
+        if min_duration:
+            merged = merged[:, merged[1, :] - merged[0, :] >= min_duration]
+
+        out.events.extend({'start': merged[0, i],
+                           'end': merged[1, i],
+                           'chan': chan} for i in range(merged.shape[1]))
+
+    if by_chan:
+        out.events.sort(key=lambda ev: ev['start'])
+
+    return out
+
+
+def _consensus_dense(events, threshold, s_freq, weights):
+    """Consensus with one value per rater and per sample.
+
+    Returns
+    -------
+    ndarray
+        2 x n_events array with start and end times
+    """
     beg = min([one_rater[0]['start'] for one_rater in events if one_rater])
     end = max([one_rater[-1]['end'] for one_rater in events if one_rater])
     n_samples = int((end - beg) * s_freq)
     times = arange(beg, end + 1/s_freq, 1/s_freq)
-    if weights is None:
-        weights = ones(len(events))
     
     positives = zeros((len(events), n_samples))
     for i, (one_rater, wt) in enumerate(zip(events, weights)):
@@ -155,19 +230,58 @@ def consensus(events, threshold, s_freq, min_duration=None, weights=None):
     offsets = where(on_off == -1)
     start_times = times[onsets]
     end_times = times[offsets]
-    merged = vstack((start_times, end_times))
-    
-    if min_duration:
-        merged = merged[:, merged[1, :] - merged[0, :] >= min_duration]
-        
-    out = Graphoelement()
-    out.events = [{'start': merged[0, i], 
-                   'end': merged[1, i],
-                   'chan': chan} for i in range(merged.shape[1])]
 
-    return out     
-            
-def match_events(detection, standard, threshold):
+    return vstack((start_times, end_times))
+
+
+def _consensus_sweep(events, threshold, s_freq, weights):
+    """Consensus computed between consecutive event boundaries (in samples),
+    where the number of raters scoring an event does not change.
+
+    Returns
+    -------
+    ndarray
+        2 x n_events array with start and end times
+    """
+    beg = min([one_rater[0]['start'] for one_rater in events if one_rater])
+    end = max([one_rater[-1]['end'] for one_rater in events if one_rater])
+    n_samples = int((end - beg) * s_freq)
+    step = (beg + 1 / s_freq) - beg  # same steps as arange
+
+    # boundaries of the events of each rater, in samples, as +1 / -1
+    bounds = [asarray([0, n_samples])]
+    rater_bounds = []
+    for one_rater in events:
+        n_start = asarray([ev['start'] for ev in one_rater], dtype=float)
+        n_end = asarray([ev['end'] for ev in one_rater], dtype=float)
+        n_start = ((n_start - beg) * s_freq).astype(int)
+        n_end = minimum(((n_end - beg) * s_freq).astype(int), n_samples)
+        keep = n_end > n_start
+        rater_bounds.append((n_start[keep], n_end[keep]))
+        bounds.extend((n_start[keep], n_end[keep]))
+
+    bounds = unique(concatenate(bounds))
+    segments = bounds[:-1]  # each segment goes until the next boundary
+
+    # number of events of each rater in each segment (can overlap)
+    level = zeros(len(segments))
+    for (n_start, n_end), wt in zip(rater_bounds, weights):
+        change = zeros(len(bounds), dtype=int)
+        change += _count(searchsorted(bounds, n_start), len(bounds))
+        change -= _count(searchsorted(bounds, n_end), len(bounds))
+        level += (cumsum(change)[:-1] > 0) * wt
+    level /= len(events)
+
+    positive = concatenate(([False], level >= threshold, [False]))
+    on_off = diff(positive.astype(int))
+    onsets = bounds[where(on_off == 1)[0]]
+    offsets = bounds[where(on_off == -1)[0]]
+
+    return vstack((beg + onsets * step, beg + offsets * step))
+
+
+def match_events(detection, standard, threshold, by_chan=False,
+                 method='sweep', sparse=False):
     """Find best matches between detected and standard events, by a thresholded
     intersection-union rule.
     
@@ -180,6 +294,18 @@ def match_events(detection, standard, threshold):
         list of ground-truth events, with 'start', 'end' and 'chan'
     threshold : float
         minimum intersection-union score to match a pair, between 0 and 1
+    by_chan : bool
+        if True, only events on the same channel can be matched
+    method : str
+        'sweep' only computes the intersection-union for the pairs of events
+        which overlap (found by sorting the start times). 'dense' computes it
+        for all the pairs.
+    sparse : bool
+        if True and method is 'sweep', MatchedEvents.tp is a sparse matrix
+        (csr_matrix). If False, it's a boolean array of shape len(detection) x
+        len(standard), which is much larger when there are many events (it's
+        created only when tp is used, see MatchedEvents.tp). The 'dense'
+        method always uses the boolean array.
         
     Returns
     -------
@@ -187,69 +313,199 @@ def match_events(detection, standard, threshold):
         indices of true positives, false positives and false negatives, with
         statistics (recall, precision, F1)
     """
-    # Vectorize start and end times and set up for broadcasting
-    det_beg = asarray([x['start'] for x in detection])[:, newaxis]
-    det_end = asarray([x['end'] for x in detection])[:, newaxis]
-    std_beg = asarray([x['start'] for x in standard])[newaxis, :]
-    std_end = asarray([x['end'] for x in standard])[newaxis, :]
+    det_beg = asarray([x['start'] for x in detection], dtype=float)
+    det_end = asarray([x['end'] for x in detection], dtype=float)
+    std_beg = asarray([x['start'] for x in standard], dtype=float)
+    std_end = asarray([x['end'] for x in standard], dtype=float)
+    det_chan = std_chan = None
+    if by_chan:
+        det_chan = asarray([_chan_key(x['chan']) for x in detection])
+        std_chan = asarray([_chan_key(x['chan']) for x in standard])
+
+    # If no events, tp and fp are empty, fn is all events
+    if len(detection) == 0 or len(standard) == 0:
+        tp = fp = asarray([])
+        fn = arange(len(standard))
+
+    elif method == 'sweep':
+        tp, fp, fn = _match_sweep(det_beg, det_end, std_beg, std_end,
+                                  threshold, det_chan, std_chan)
+    elif method == 'dense':
+        tp, fp, fn = _match_dense(det_beg, det_end, std_beg, std_end,
+                                  threshold, det_chan, std_chan)
+    else:
+        raise ValueError('Unknown method ' + method)
+
+    # Store in MatchedEvents class, which computes statistics
+    match = MatchedEvents(tp, fp, fn, detection, standard, threshold,
+                          sparse=sparse)
+    
+    return match
+
+
+def _match_dense(det_beg, det_end, std_beg, std_end, threshold, det_chan,
+                 std_chan):
+    """Match events, using the matrix of all pairs of events."""
+    # Set up for broadcasting
+    det_beg = det_beg[:, newaxis]
+    det_end = det_end[:, newaxis]
+    std_beg = std_beg[newaxis, :]
+    std_end = std_end[newaxis, :]
 
     # Get durations and broadcast them
-    det_dur = repeat(det_end - det_beg, len(standard), axis=1)
-    std_dur = repeat(std_end - std_beg, len(detection), axis=0)
+    det_dur = repeat(det_end - det_beg, std_beg.shape[1], axis=1)
+    std_dur = repeat(std_end - std_beg, det_beg.shape[0], axis=0)
     
     # Subtract every end by every start and find overlaps
     det_minus_std = det_end - std_beg # array of shape (len(det), len(std))
     std_minus_det = std_end - det_beg    
     overlapping = logical_and(det_minus_std > 0, std_minus_det > 0)
-    
-    # Find intersection and union
-    shorter_diff = minimum(det_minus_std, std_minus_det)
-    longer_diff = maximum(det_minus_std, std_minus_det)
-    
-    shorter_dur = minimum(det_dur, std_dur)
-    longer_dur = maximum(det_dur, std_dur)
-    
-    interx = minimum(shorter_diff, shorter_dur)
-    union = maximum(longer_diff, longer_dur)
-        
-    # Compute intersection-union score and set non-overlapping pairs to 0
-    iu = interx / union
+    if det_chan is not None:
+        overlapping &= det_chan[:, newaxis] == std_chan[newaxis, :]
+
+    iu = _intersection_union(det_minus_std, std_minus_det, det_dur, std_dur)
     iu[invert(overlapping)] = 0
     
     # Threshold IU score to yield  True Positive candidates
     iu[iu <= threshold] = 0
     
-    # If no events, tp and fp are empty, fn is all events
-    if iu.size == 0:
-        tp = fp = asarray([])
-        fn = arange(len(standard))
-    else:
-    
-        # Find partial matches, round 1
-        det_match1 = argmax(iu, axis=1)
-        std_match1 = argmax(iu, axis=0)
-        
-        # Find full matches, round 1, then remove them from IU
-        tp = zeros(iu.shape, dtype=bool)
-        for i, j in enumerate(std_match1):
-            if det_match1[j] == i:
-                tp[j, i] = True
-                iu[j, :].fill(0)
-                iu[:, i].fill(0)
-        
-        # Round 2
-        det_match2 = argmax(iu, axis=1)
-        std_match2 = argmax(iu, axis=0)
-        
-        for i, j in enumerate(std_match2):
-            if det_match2[j] == i:
-                tp[j, i] = True
+    # Find partial matches, round 1
+    det_match1 = argmax(iu, axis=1)
+    std_match1 = argmax(iu, axis=0)
     
-        # Find false positives and false negatives
-        fp = where(logical_and(det_match1 == 0, det_match2 == 0))[0]
-        fn = where(logical_and(std_match1 == 0, std_match2 == 0))[0]
+    # Find full matches, round 1, then remove them from IU
+    tp = zeros(iu.shape, dtype=bool)
+    for i, j in enumerate(std_match1):
+        if det_match1[j] == i:
+            tp[j, i] = True
+            iu[j, :].fill(0)
+            iu[:, i].fill(0)
     
-    # Store in MatchedEvents class, which computes statistics
-    match = MatchedEvents(tp, fp, fn, detection, standard, threshold)
+    # Round 2
+    det_match2 = argmax(iu, axis=1)
+    std_match2 = argmax(iu, axis=0)
     
-    return match
+    for i, j in enumerate(std_match2):
+        if det_match2[j] == i:
+            tp[j, i] = True
+
+    # Find false positives and false negatives
+    fp = where(logical_and(det_match1 == 0, det_match2 == 0))[0]
+    fn = where(logical_and(std_match1 == 0, std_match2 == 0))[0]
+
+    return tp, fp, fn
+
+
+def _match_sweep(det_beg, det_end, std_beg, std_end, threshold, det_chan,
+                 std_chan):
+    """Match events, using only the pairs of events which overlap. It follows
+    the same steps as _match_dense, where argmax over all the pairs is
+    replaced by the best pair (the first one if tied, 0 if none)."""
+    n_det = len(det_beg)
+    n_std = len(std_beg)
+
+    # candidate pairs: standard events starting between the start of the
+    # detected event (minus the longest standard event) and its end
+    order = argsort(std_beg, kind='stable')
+    sorted_beg = std_beg[order]
+    max_dur = (std_end - std_beg).max()
+    lo = searchsorted(sorted_beg, det_beg - max_dur - 1, side='left')
+    hi = searchsorted(sorted_beg, det_end, side='left')
+    counts = maximum(hi - lo, 0)
+    det_idx = repeat(arange(n_det), counts)
+    offsets = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+    std_idx = order[repeat(lo, counts) + offsets]
+
+    det_minus_std = det_end[det_idx] - std_beg[std_idx]
+    std_minus_det = std_end[std_idx] - det_beg[det_idx]
+    overlapping = logical_and(det_minus_std > 0, std_minus_det > 0)
+    if det_chan is not None:
+        overlapping &= det_chan[det_idx] == std_chan[std_idx]
+
+    det_idx = det_idx[overlapping]
+    std_idx = std_idx[overlapping]
+    iu = _intersection_union(det_minus_std[overlapping],
+                             std_minus_det[overlapping],
+                             (det_end - det_beg)[det_idx],
+                             (std_end - std_beg)[std_idx])
+
+    # Threshold IU score to yield  True Positive candidates
+    keep = iu > threshold
+    det_idx = det_idx[keep]
+    std_idx = std_idx[keep]
+    iu = iu[keep]
+
+    tp_det = []
+    tp_std = []
+    det_match = []
+    std_match = []
+    for i_round in range(2):
+        det_match.append(_best_pair(det_idx, std_idx, iu, n_det))
+        std_match.append(_best_pair(std_idx, det_idx, iu, n_std))
+
+        # Find full matches, then remove them from the candidates
+        j = std_match[-1]
+        i = arange(n_std)
+        full = det_match[-1][j] == i
+        tp_det.append(j[full])
+        tp_std.append(i[full])
+
+        keep = ~(isin(det_idx, j[full]) | isin(std_idx, i[full]))
+        det_idx = det_idx[keep]
+        std_idx = std_idx[keep]
+        iu = iu[keep]
+
+    pairs = unique(concatenate(tp_det) * n_std + concatenate(tp_std))
+    tp = csr_matrix((ones(len(pairs), dtype=bool),
+                     (pairs // n_std, pairs % n_std)), shape=(n_det, n_std))
+
+    # Find false positives and false negatives
+    fp = where(logical_and(det_match[0] == 0, det_match[1] == 0))[0]
+    fn = where(logical_and(std_match[0] == 0, std_match[1] == 0))[0]
+
+    return tp, fp, fn
+
+
+def _intersection_union(det_minus_std, std_minus_det, det_dur, std_dur):
+    """Compute intersection-union score of overlapping pairs of events."""
+    shorter_diff = minimum(det_minus_std, std_minus_det)
+    longer_diff = maximum(det_minus_std, std_minus_det)
+
+    shorter_dur = minimum(det_dur, std_dur)
+    longer_dur = maximum(det_dur, std_dur)
+
+    interx = minimum(shorter_diff, shorter_dur)
+    union = maximum(longer_diff, longer_dur)
+
+    return interx / union
+
+
+def _best_pair(idx, other_idx, iu, n):
+    """For each event, index of the other event with the highest score (the
+    lowest index if tied), or 0 if there are no pairs, as argmax would do."""
+    best = zeros(n, dtype=int)
+    if len(idx) > 0:
+        order = lexsort((other_idx, -iu, idx))
+        idx = idx[order]
+        first = concatenate(([True], idx[1:] != idx[:-1]))
+        best[idx[first]] = other_idx[order][first]
+    return best
+
+
+def _count(positions, n):
+    """Number of times each position occurs, for positions between 0 and n."""
+    count = zeros(n, dtype=int)
+    values, counts = unique(positions, return_counts=True)
+    count[values] = counts
+    return count
+
+
+def _chan_key(chan):
+    if isinstance(chan, (tuple, list)):
+        return ', '.join(chan)
+    return chan
+
+
+def _any(tp, axis):
+    """any() for dense arrays and sparse matrices."""
+    return asarray(tp.sum(axis=axis)).ravel() > 0
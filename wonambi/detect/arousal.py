@@ -1,8 +1,9 @@
 """Module to detect arousals
 """
 
-from logging import getLogger
-from numpy import abs, argmin, asarray, hstack, mean, sum, vstack, where, zeros
+from logging import getLogger, DEBUG
+from numpy import (abs, argmin, hstack, mean, minimum, searchsorted, sum,
+                   vstack, where, zeros)
 from scipy.signal import spectrogram
 
 try:
@@ -15,6 +16,9 @@ from .spindle import within_duration, remove_straddlers
 from ..graphoelement import Arousals
 
 lg = getLogger(__name__)
+# thresholds of frequency acceleration reported in the log, at debug level
+DEBUG_THRESHOLDS = (1.01, 1.02, 1.05, 1.1, 1.2, 1.3, 1.4, 1.5, 1.75, 2, 2.5,
+                    3, 5, 10)
 
 
 class DetectArousal:
@@ -91,10 +95,10 @@ class DetectArousal:
         arousal.chan_name = data.axis['chan'][0]
 
         all_arousals = []
+        time = hstack(data.axis['time'])
         for i, chan in enumerate(data.axis['chan'][0]):
-            
+
             lg.info('Detecting arousals on chan %s', chan)
-            time = hstack(data.axis['time'])
             dat_orig = hstack(data(chan=chan))
 
             if 'HouseDetector' in self.method:
@@ -156,50 +160,24 @@ def detect_HouseDetector(dat_orig, s_freq, time, opts):
                                  detrend=detrend)
     freq1 = opts.freq_band1
     freq2 = opts.freq_band2
-    f0 = asarray([abs(freq1[0] - x) for x in sf]).argmin() if freq1[0] else None
-    f1 = asarray([abs(freq1[1] - x) for x in sf]).argmin() if freq1[1] else None
-    f2 = asarray([abs(freq2[1] - x) for x in sf]).argmin() if freq2[1] else None
-    f3 = asarray([abs(freq2[1] - x) for x in sf]).argmin() if freq2[1] else None
+    f0 = abs(sf - freq1[0]).argmin() if freq1[0] else None
+    f1 = abs(sf - freq1[1]).argmin() if freq1[1] else None
+    f2 = abs(sf - freq2[1]).argmin() if freq2[1] else None
+    f3 = abs(sf - freq2[1]).argmin() if freq2[1] else None
     
-    dat_eq1 = zeros(dat_det.shape[1])
-    dat_eq2 = zeros(dat_det.shape[1])
-    for i in range(dat_det.shape[1]):
-        dat_eq1[i] = splitpoint(dat_det[f0:f1, i], sf[f0:f1])
-        dat_eq2[i] = splitpoint(dat_det[f2:f3, i], sf[f2:f3])
+    dat_eq1 = splitpoint(dat_det[f0:f1, :], sf[f0:f1])
+    dat_eq2 = splitpoint(dat_det[f2:f3, :], sf[f2:f3])
         
     dat_acc = dat_eq1[1:] / dat_eq1[:-1]
     starts = dat_acc >= opts.det_thresh
-    print(f'starts: {sum(starts)}')
-    print(f'1.01: {sum(dat_acc >= 1.01)}')
-    print(f'1.02: {sum(dat_acc >= 1.02)}')
-    print(f'1.05: {sum(dat_acc >= 1.05)}')
-    print(f'1.1: {sum(dat_acc >= 1.1)}')
-    print(f'1.2: {sum(dat_acc >= 1.2)}')
-    print(f'1.3: {sum(dat_acc >= 1.3)}')
-    print(f'1.4: {sum(dat_acc >= 1.4)}')
-    print(f'1.5: {sum(dat_acc >= 1.5)}')
-    print(f'1.75: {sum(dat_acc >= 1.75)}')
-    print(f'2: {sum(dat_acc >= 2)}')
-    print(f'2.5: {sum(dat_acc >= 2.5)}')
-    print(f'3: {sum(dat_acc >= 3)}')
-    print(f'5: {sum(dat_acc >= 5)}')
-    print(f'10: {sum(dat_acc >= 10)}')
+    lg.debug('starts: %d', sum(starts))
+    if lg.isEnabledFor(DEBUG):
+        for thresh in DEBUG_THRESHOLDS:
+            lg.debug('%s: %d', thresh, sum(dat_acc >= thresh))
     
     if starts.any():
-        new_starts = asarray(zeros(len(starts)), dtype=bool)
-        ends = asarray(zeros(len(starts) - 1), dtype=bool)
-        iter_len = len(starts) - 2
-        i = 0
-        while i <= iter_len:
-            if starts[i]:
-                for j, k in enumerate(dat_eq2[i + 2:-1]):
-                    if k < dat_eq2[i] * opts.det_thresh_end:
-                        new_starts[i] = True
-                        ends[i + j + 1] = True
-                        break
-                i += j + min_interval
-            else:
-                i += 1
+        new_starts, ends = find_start_end(starts, dat_eq2, 
+                                          opts.det_thresh_end, min_interval)
         
         if sum(new_starts) > sum(ends): # a start without an end
             ends[-1] = True
@@ -209,11 +187,11 @@ def detect_HouseDetector(dat_orig, s_freq, time, opts):
         if overlap: 
             events = events - int(1 / 2 / overlap) # from win centre to win start
         events = events * (nperseg - noverlap) # upsample
-        print(f'n_events before dur = {events.shape}')
+        lg.debug('n_events before dur = %s', events.shape)
         events = within_duration(events, time, opts.duration)
-        print(f'n_events after dur = {events.shape}')
+        lg.debug('n_events after dur = %s', events.shape)
         events = remove_straddlers(events, time, s_freq)
-        print(f'n_events after strad = {events.shape}')
+        lg.debug('n_events after strad = %s', events.shape)
     
         ar_in_chan = make_arousals(events, time, s_freq)
         
@@ -225,11 +203,118 @@ def detect_HouseDetector(dat_orig, s_freq, time, opts):
 
 
 def splitpoint(a, sf):
-    c1 = a.cumsum()
-    c2 = a[::-1].cumsum()[::-1]
-    split = argmin(abs(c1-c2))
+    """Frequency which splits the power in two halves.
+
+    Parameters
+    ----------
+    a : ndarray (dtype='float')
+        power spectrum, with frequency as first dimension. If 2-D, the second
+        dimension is time and one split point is computed for each window.
+    sf : ndarray (dtype='float')
+        frequency of each row of a
+
+    Returns
+    -------
+    float or ndarray (dtype='float')
+        split point, for each window if a is 2-D
+    """
+    c1 = a.cumsum(axis=0)
+    c2 = a[::-1].cumsum(axis=0)[::-1]
+    split = argmin(abs(c1-c2), axis=0)
     return sf[split]
 
+
+def find_start_end(starts, dat_eq2, det_thresh_end, min_interval):
+    """Find start and end of the arousals.
+
+    Parameters
+    ----------
+    starts : ndarray (dtype='bool')
+        windows where the split point increases above threshold
+    dat_eq2 : ndarray (dtype='float')
+        split point of each window, in the frequency band used for the end
+    det_thresh_end : float
+        the arousal ends when the split point falls below its value at the
+        start, multiplied by this factor
+    min_interval : int
+        number of windows to skip after the end of an arousal
+
+    Returns
+    -------
+    ndarray (dtype='bool')
+        windows where the arousals start, same length as starts
+    ndarray (dtype='bool')
+        windows where the arousals end, length of starts - 1
+
+    Notes
+    -----
+    The end of every candidate start is searched at once and only the walk
+    over the accepted arousals, which skips the following candidates, is done
+    in a python loop.
+    """
+    new_starts = zeros(len(starts), dtype=bool)
+    ends = zeros(len(starts) - 1, dtype=bool)
+
+    dat_end = dat_eq2[:-1]
+    candidates = where(starts[:-1])[0]
+    first = candidates + 2
+    end = first_below(dat_end, first, dat_eq2[candidates] * det_thresh_end)
+    found = end < len(dat_end)
+    # without end, the search reached the last window
+    step = where(found, end, len(dat_end) - 1) - first + min_interval
+
+    k = 0
+    while k < len(candidates):
+        i = candidates[k]
+        if found[k]:
+            new_starts[i] = True
+            ends[end[k] - 1] = True
+        elif first[k] >= len(dat_end):
+            break
+        k = searchsorted(candidates, i + max(step[k], 1))
+
+    return new_starts, ends
+
+
+def first_below(x, first, thresh):
+    """Find the first value below threshold, starting from different points.
+
+    Parameters
+    ----------
+    x : ndarray (dtype='float')
+        vector of values
+    first : ndarray (dtype='int')
+        index where to start the search
+    thresh : ndarray (dtype='float')
+        threshold, one for each index in first
+
+    Returns
+    -------
+    ndarray (dtype='int')
+        index of the first value of x below thresh, at or after first. If
+        there is no such value, it's the length of x.
+
+    Notes
+    -----
+    It computes the minimum of x over windows of length 1, 2, 4 etc, so that
+    it can skip over long stretches of values above threshold with few steps.
+    """
+    n = len(x)
+    min_x = [x, ]  # min_x[i][j] is the minimum of x[j:j + 2 ** i]
+    width = 1
+    while 2 * width <= n:
+        min_x.append(minimum(min_x[-1][:-width], min_x[-1][width:]))
+        width *= 2
+
+    idx = first.copy()
+    for i in reversed(range(len(min_x))):
+        valid = idx < len(min_x[i])
+        above = valid & (min_x[i][where(valid, idx, 0)] >= thresh)
+        idx[above] += 2 ** i
+
+    return minimum(idx, n)
+
+
 def make_arousals(events, time, s_freq):
     """Create dict for each arousal, based on events of time points.
 
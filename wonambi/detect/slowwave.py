@@ -1,9 +1,12 @@
 """Module to detect slow waves.
 
 """
+from functools import partial
 from logging import getLogger
-from numpy import (argmin, concatenate, diff, hstack, logical_and, newaxis, 
-                   ones, sign, sum, vstack, where, zeros)
+from multiprocessing import Pool
+from numpy import (arange, argmin, argsort, column_stack, concatenate, diff,
+                   empty, full, hstack, logical_and, newaxis, ones, sign, sum,
+                   vstack, where, zeros)
 
 try:
     from PyQt5.QtCore import Qt
@@ -17,6 +20,13 @@ from ..graphoelement import SlowWaves
 
 lg = getLogger(__name__)
 MAXIMUM_DURATION = 5
+# in chunks, add this number of cycles of the lowest filter frequency on each
+# side, so that the filter gives the same values as on the whole recording
+PADDING_CYCLES = 10
+SW_FIELDS = ('start', 'trough_time', 'zero_time', 'peak_time', 'end',
+             'trough_val', 'peak_val', 'dur', 'ptp')
+# time points of the recording, sent once to each process (see _init_worker)
+_worker_time = None
 
 
 class DetectSlowWave:
@@ -76,7 +86,8 @@ class DetectSlowWave:
         return ('detsw_{0}_{1:04.2f}-{2:04.2f}Hz'
                 ''.format(self.method, *self.det_filt['freq']))
 
-    def __call__(self, data, parent=None):
+    def __call__(self, data, parent=None, n_jobs=1, chunk_duration=None,
+                 columnar=False):
         """Detect slow waves on the data.
 
         Parameters
@@ -85,6 +96,19 @@ class DetectSlowWave:
             data used for detection
         parent : QWidget
             for use with GUI, as parent widget for the progress bar
+        n_jobs : int
+            number of processes, to detect slow waves on multiple channels at
+            the same time
+        chunk_duration : float, optional
+            if specified, the signal is filtered and the slow waves are
+            detected in blocks of this duration (in s), with some overlap
+            between the blocks, so that the filtered signal of the whole
+            recording is never in memory. Events are assigned to the block
+            where they start, so the events are the same as without blocks.
+        columnar : bool
+            if True, the slow waves are returned in the attribute 'columns',
+            as one array for each property of the slow waves, instead of a
+            list of dict in 'events' (see columns_to_events).
         
         Returns
         -------
@@ -99,41 +123,175 @@ class DetectSlowWave:
         slowwave = SlowWaves()
         slowwave.chan_name = data.axis['chan'][0]
 
-        all_slowwaves = []
-        for i, chan in enumerate(data.axis['chan'][0]):
-            
-            lg.info('Detecting slow waves on chan %s', chan)
-            time = hstack(data.axis['time'])
-            dat_orig = hstack(data(chan=chan))
-            dat_orig = dat_orig - dat_orig.mean()  # demean
-
-            if 'Massimini2004' in self.method:
-                sw_in_chan = detect_Massimini2004(dat_orig, data.s_freq, time,
-                                                  self)
-                
-            elif 'Ngo2015' == self.method:
-                sw_in_chan = detect_Ngo2015(dat_orig, data.s_freq, time, self)
-
-            else:
-                raise ValueError('Unknown method')
-
-            for sw in sw_in_chan:
-                sw.update({'chan': chan})
-            all_slowwaves.extend(sw_in_chan)
-            
-            if parent is not None:
-                progress.setValue(i)
-                if progress.wasCanceled():
-                    return
-            # end of loop over chan
+        time = hstack(data.axis['time'])
+        all_dat = (hstack(data(chan=chan)) for chan in slowwave.chan_name)
 
-        slowwave.events = sorted(all_slowwaves, key=lambda x: x['start'])
+        if n_jobs == 1:
+            pool = None
+            results = map(partial(_detect_chan, opts=self, s_freq=data.s_freq,
+                                  time=time, chunk_duration=chunk_duration),
+                          all_dat)
+        else:
+            # the time points are sent once to each process, not with each
+            # channel
+            pool = Pool(n_jobs, initializer=_init_worker, initargs=(time, ))
+            results = pool.imap(partial(_detect_chan_in_worker, opts=self,
+                                        s_freq=data.s_freq,
+                                        chunk_duration=chunk_duration),
+                                all_dat)
+
+        no_sw = _slow_wave_columns(empty((0, 5), dtype=int), empty(0),
+                                   empty(0), time, data.s_freq)
+        no_sw['chan'] = empty(0, dtype='O')
+        all_slowwaves = [no_sw, ]
+        try:
+            for i, (chan, sw_in_chan) in enumerate(zip(slowwave.chan_name,
+                                                       results)):
+                lg.info('Detected slow waves on chan %s', chan)
+                n_sw = len(sw_in_chan['start'])
+                sw_in_chan['chan'] = full(n_sw, chan, dtype='O')
+                all_slowwaves.append(sw_in_chan)
+
+                if parent is not None:
+                    progress.setValue(i)
+                    if progress.wasCanceled():
+                        return
+                # end of loop over chan
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        columns = {k: concatenate([sw[k] for sw in all_slowwaves])
+                   for k in SW_FIELDS + ('chan', )}
+        order = argsort(columns['start'], kind='stable')
+        columns = {k: v[order] for k, v in columns.items()}
+
+        if columnar:
+            slowwave.events = []
+            slowwave.columns = columns
+        else:
+            slowwave.events = columns_to_events(columns)
 
         if parent is not None:
-            progress.setValue(i + 1)
+            progress.setValue(len(slowwave.chan_name))
 
         return slowwave
 
+
+def columns_to_events(columns):
+    """Convert slow waves from columns (dict of ndarray) to list of dict.
+
+    Parameters
+    ----------
+    columns : dict of ndarray
+        one array for each property of the slow waves (such as 'start',
+        'trough_time', 'chan')
+
+    Returns
+    -------
+    list of dict
+        one dict for each slow wave
+    """
+    keys = list(columns)
+    return [dict(zip(keys, values))
+            for values in zip(*(columns[k] for k in keys))]
+
+
+def _init_worker(time):
+    """Store the time points in each process of the pool."""
+    global _worker_time
+    _worker_time = time
+
+
+def _detect_chan_in_worker(dat_orig, opts, s_freq, chunk_duration=None):
+    """_detect_chan, with the time points stored by _init_worker."""
+    return _detect_chan(dat_orig, opts, s_freq, _worker_time, chunk_duration)
+
+
+def _detect_chan(dat_orig, opts, s_freq, time, chunk_duration=None):
+    """Detect slow waves on one channel, possibly in overlapping blocks.
+
+    Parameters
+    ----------
+    dat_orig : ndarray (dtype='float')
+        vector with the data for one channel
+    opts : instance of 'DetectSlowWave'
+        detection parameters
+    s_freq : float
+        sampling frequency
+    time : ndarray (dtype='float')
+        vector with the time points for each sample
+    chunk_duration : float, optional
+        duration of each block, in s
+
+    Returns
+    -------
+    dict of ndarray
+        one array for each property of the slow waves (see make_slow_waves)
+    """
+    dat_orig = dat_orig - dat_orig.mean()  # demean
+    n_smp = len(dat_orig)
+
+    if 'Massimini2004' in opts.method:
+        find_slow_waves = _find_Massimini2004
+        lowest_freq = opts.det_filt['freq'][0]
+    elif 'Ngo2015' == opts.method:
+        find_slow_waves = _find_Ngo2015
+        lowest_freq = opts.lowpass['freq']
+    else:
+        raise ValueError('Unknown method')
+
+    if chunk_duration is None:
+        blocks = [(0, n_smp)]
+        pad = 0
+    else:
+        max_dur = opts.duration[1]
+        if max_dur is None:
+            max_dur = MAXIMUM_DURATION
+        n_block = int(chunk_duration * s_freq)
+        pad = int((PADDING_CYCLES / lowest_freq + max_dur) * s_freq)
+        blocks = [(beg, min(beg + n_block, n_smp))
+                  for beg in range(0, n_smp, n_block)]
+
+    events = [empty((0, 5), dtype=int)]
+    trough_val = []
+    peak_val = []
+    for beg, end in blocks:
+        lo = max(beg - pad, 0)
+        hi = min(end + pad, n_smp)
+        ev, dat_det = find_slow_waves(dat_orig[lo:hi], s_freq, time[lo:hi],
+                                      opts)
+
+        # each event belongs to the block where it starts
+        ev = ev[(ev[:, 0] + lo >= beg) & (ev[:, 0] + lo < end), :]
+        events.append(ev + lo)
+        trough_val.append(dat_det[ev[:, 1]])
+        peak_val.append(dat_det[ev[:, 3]])
+
+    events = concatenate(events)
+    trough_val = concatenate(trough_val)
+    peak_val = concatenate(peak_val)
+
+    if 'Ngo2015' == opts.method and len(events):
+        # thresholds depend on all the candidate slow waves in the channel
+        selected = _select_Ngo2015(trough_val, peak_val, opts)
+        events = events[selected, :]
+
+        # add index as second column, to keep the values of the same events
+        idx = remove_straddlers(column_stack((events[:, 0],
+                                              arange(events.shape[0]),
+                                              events[:, -1])),
+                                time, s_freq)[:, 1]
+        events = events[idx, :]
+        trough_val = trough_val[selected][idx]
+        peak_val = peak_val[selected][idx]
+
+    if len(events) == 0:
+        lg.info('No slow wave found')
+
+    return _slow_wave_columns(events, trough_val, peak_val, time, s_freq)
+
+
 def detect_Massimini2004(dat_orig, s_freq, time, opts):
     """Slow wave detection based on Massimini et al., 2004.
 
@@ -166,6 +324,28 @@ def detect_Massimini2004(dat_orig, s_freq, time, opts):
     ----------
     Massimini, M. et al. J Neurosci 24(31) 6862-70 (2004).
 
+    """
+    events, dat_det = _find_Massimini2004(dat_orig, s_freq, time, opts)
+
+    sw_in_chan = []
+    if len(events):
+        sw_in_chan = make_slow_waves(events, dat_det, time, s_freq)
+
+    if len(sw_in_chan) == 0:
+        lg.info('No slow wave found')
+
+    return sw_in_chan
+
+
+def _find_Massimini2004(dat_orig, s_freq, time, opts):
+    """Find slow waves based on Massimini et al., 2004.
+
+    Returns
+    -------
+    ndarray (dtype='int')
+        N x 5 matrix with start, trough, zero, peak, end samples
+    ndarray (dtype='float')
+        vector with the filtered data
     """
     if opts.invert:
         dat_orig = -dat_orig
@@ -174,7 +354,7 @@ def detect_Massimini2004(dat_orig, s_freq, time, opts):
                                opts.det_filt)
     above_zero = detect_events(dat_det, 'above_thresh', value=0.)
 
-    sw_in_chan = []
+    events = empty((0, 5), dtype=int)
     if above_zero is not None:
         troughs = within_duration(above_zero, time, opts.trough_duration)
         #lg.info('troughs within duration: ' + str(troughs.shape))
@@ -184,20 +364,15 @@ def detect_Massimini2004(dat_orig, s_freq, time, opts):
             #lg.info('troughs deep enough: ' + str(troughs.shape))
 
             if troughs is not None:
-                events = _add_halfwave(dat_det, troughs, s_freq, opts)
+                troughs = _add_halfwave(dat_det, troughs, s_freq, opts)
                 #lg.info('SWs high enough: ' + str(events.shape))
 
-                if len(events):
-                    events = within_duration(events, time, opts.duration)
+                if len(troughs):
+                    events = within_duration(troughs, time, opts.duration)
                     events = remove_straddlers(events, time, s_freq)
                     #lg.info('SWs within duration: ' + str(events.shape))
 
-                    sw_in_chan = make_slow_waves(events, dat_det, time, s_freq)
-
-    if len(sw_in_chan) == 0:
-        lg.info('No slow wave found')
-
-    return sw_in_chan
+    return events, dat_det
 
 def detect_Ngo2015(dat_orig, s_freq, time, opts):
     """Slow wave detection based on Ngo et al., 2015.
@@ -231,38 +406,68 @@ def detect_Ngo2015(dat_orig, s_freq, time, opts):
     ----------
     Ngo, H-V. et al. J Neurosci 35(17) 6630-8 (2015).
 
+    """
+    sw_in_chan = []
+    events, dat_det = _find_Ngo2015(dat_orig, s_freq, time, opts)
+    if len(events):
+        selected = _select_Ngo2015(dat_det[events[:, 1]],
+                                   dat_det[events[:, 3]], opts)
+        events = events[selected, :]
+        #events = within_duration(events, time, opts.duration)
+        events = remove_straddlers(events, time, s_freq)
+        sw_in_chan = make_slow_waves(events, dat_det, time, s_freq)
+        
+    if sw_in_chan:
+        lg.info('No slow waves found')
+
+    return sw_in_chan
+
+
+def _find_Ngo2015(dat_orig, s_freq, time, opts):
+    """Find candidate slow waves based on Ngo et al., 2015, before applying
+    the amplitude thresholds (see _select_Ngo2015).
+
+    Returns
+    -------
+    ndarray (dtype='int')
+        N x 5 matrix with start, trough, zero, peak, end samples
+    ndarray (dtype='float')
+        vector with the filtered data
     """
     if opts.invert:
         dat_orig = -dat_orig
 
-    sw_in_chan = []
     dat_det = transform_signal(dat_orig, s_freq, 'low_butter', opts.lowpass)
     idx_zx = find_zero_crossings(dat_det, xtype='pos_to_neg')
     events = find_intervals(idx_zx, s_freq, opts.duration)
     if events is not None:
         events = find_peaks_in_slowwwave(dat_det, events)
-        
-        if events is not None:
-            # Negative peak threshold
-            idx_neg_peak = events[:, 1]
-            neg_peak_thresh = dat_det[idx_neg_peak].mean() * opts.peak_thresh
-            events = events[dat_det[idx_neg_peak] < neg_peak_thresh, :]
-            
-            if events is not None:
-                # Peak-to-peak amplitude threshold
-                ptp = dat_det[events[:, 3]] - dat_det[events[:, 1]]
-                ptp_thresh = ptp.mean() * opts.ptp_thresh
-                events = events[ptp > ptp_thresh, :]
-                
-                if events is not None:
-                    #events = within_duration(events, time, opts.duration)
-                    events = remove_straddlers(events, time, s_freq)
-                    sw_in_chan = make_slow_waves(events, dat_det, time, s_freq)
-        
-    if sw_in_chan:
-        lg.info('No slow waves found')
 
-    return sw_in_chan
+    if events is None:
+        events = empty((0, 5), dtype=int)
+
+    return events, dat_det
+
+
+def _select_Ngo2015(trough_val, peak_val, opts):
+    """Apply the amplitude thresholds of Ngo et al., 2015, relative to the
+    mean of the candidate slow waves.
+
+    Returns
+    -------
+    ndarray (dtype='bool')
+        which candidate slow waves are selected
+    """
+    # Negative peak threshold
+    neg_peak_thresh = trough_val.mean() * opts.peak_thresh
+    selected = trough_val < neg_peak_thresh
+
+    # Peak-to-peak amplitude threshold
+    ptp = peak_val[selected] - trough_val[selected]
+    ptp_thresh = ptp.mean() * opts.ptp_thresh
+    selected[selected] = ptp > ptp_thresh
+
+    return selected
 
 
 def select_peaks(data, events, limit):
@@ -310,21 +515,43 @@ def make_slow_waves(events, data, time, s_freq):
         peak_val, peak-to-peak amplitude (signal units), area_under_curve
         (signal units * s)
     """
-    slow_waves = []
-    for ev in events:
-        one_sw = {'start': time[ev[0]],
-                  'trough_time': time[ev[1]],
-                  'zero_time': time[ev[2]],
-                  'peak_time': time[ev[3]],
-                  'end': time[ev[4] - 1],
-                  'trough_val': data[ev[1]],
-                  'peak_val': data[ev[3]],
-                  'dur': (ev[4] - ev[0]) / s_freq,
-                  'ptp': abs(ev[3] - ev[1])
-                  }
-        slow_waves.append(one_sw)
-
-    return slow_waves
+    return columns_to_events(_slow_wave_columns(events, data[events[:, 1]],
+                                                data[events[:, 3]], time,
+                                                s_freq))
+
+
+def _slow_wave_columns(events, trough_val, peak_val, time, s_freq):
+    """Compute the properties of the slow waves, one array per property.
+
+    Parameters
+    ----------
+    events : ndarray (dtype='int')
+        N x 5 matrix with start, trough, zero, peak, end samples
+    trough_val : ndarray (dtype='float')
+        value of the data at the trough of each slow wave
+    peak_val : ndarray (dtype='float')
+        value of the data at the peak of each slow wave
+    time : ndarray (dtype='float')
+        vector with time points
+    s_freq : float
+        sampling frequency
+
+    Returns
+    -------
+    dict of ndarray
+        start, trough_time, zero_time, peak_time, end, trough_val, peak_val,
+        dur, ptp (see make_slow_waves)
+    """
+    return {'start': time[events[:, 0]],
+            'trough_time': time[events[:, 1]],
+            'zero_time': time[events[:, 2]],
+            'peak_time': time[events[:, 3]],
+            'end': time[events[:, 4] - 1],
+            'trough_val': trough_val,
+            'peak_val': peak_val,
+            'dur': (events[:, 4] - events[:, 0]) / s_freq,
+            'ptp': abs(events[:, 3] - events[:, 1]),
+            }
 
 
 def _add_halfwave(data, events, s_freq, opts):
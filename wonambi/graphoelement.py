@@ -112,10 +112,14 @@ class SlowWaves(Graphoelement):
                 peak-to-peak (difference between highest and lowest value)
             - chan': str
                 channel label
+    columns : dict of ndarray
+        the same information as events, with one array for each key (only if
+        the slow waves were detected with columnar=True, events is then empty)
     
     """
     def __init__(self):
         super().__init__()
+        self.columns = None
         
         one_sw = {'start_time': None,
                   'trough_time': None,
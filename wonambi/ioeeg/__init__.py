@@ -1,20 +1,35 @@
 """Package to import and export common formats.
 
+The readers and writers are imported only when they are used (PEP 562), so
+that importing the package does not import the dependencies of all the
+formats.
 """
-from .abf import Abf
-from .brainvision import BrainVision, write_brainvision, _write_vmrk
-from .eeglab import EEGLAB
-from .edf import Edf, write_edf
-from .ktlx import Ktlx
-from .blackrock import BlackRock
-from .egimff import EgiMff
-from .moberg import Moberg
-from .mnefiff import write_mnefiff
-from .openephys import OpenEphys
-from .fieldtrip import FieldTrip, write_fieldtrip
-from .wonambi import Wonambi, write_wonambi
-from .micromed import Micromed
-from .bci2000 import BCI2000
-from .text import Text
-from .bids import BIDS, write_bids, write_bids_channels
-from .lyonrri import LyonRRI
+from ..utils.lazy import lazy_attributes
+
+_LAZY = {'Abf': '.abf',
+         'BrainVision': '.brainvision',
+         'write_brainvision': '.brainvision',
+         '_write_vmrk': '.brainvision',
+         'EEGLAB': '.eeglab',
+         'Edf': '.edf',
+         'write_edf': '.edf',
+         'Ktlx': '.ktlx',
+         'BlackRock': '.blackrock',
+         'EgiMff': '.egimff',
+         'Moberg': '.moberg',
+         'write_mnefiff': '.mnefiff',
+         'OpenEphys': '.openephys',
+         'FieldTrip': '.fieldtrip',
+         'write_fieldtrip': '.fieldtrip',
+         'Wonambi': '.wonambi',
+         'write_wonambi': '.wonambi',
+         'Micromed': '.micromed',
+         'BCI2000': '.bci2000',
+         'Text': '.text',
+         'BIDS': '.bids',
+         'write_bids': '.bids',
+         'write_bids_channels': '.bids',
+         'LyonRRI': '.lyonrri',
+         }
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY, globals())
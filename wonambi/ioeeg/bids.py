@@ -21,11 +21,17 @@ class BIDS:
         the name of the filename or directory
     """
     def __init__(self, filename):
-        from ..dataset import Dataset
+        from ..dataset import open_dataset
         self.filename = filename
         self.task = iEEG(filename)
 
-        self.baseformat = Dataset(filename)
+        self.baseformat = open_dataset(filename)
+
+    @staticmethod
+    def companion_files(filename):
+        """The sidecar files cannot be listed in advance, so the header is
+        not cached."""
+        return None
 
     def return_hdr(self, sf_from_bids=False):
         """Return the header for further use.
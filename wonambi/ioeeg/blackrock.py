@@ -33,6 +33,14 @@ class BlackRock:
         self.sess_end = None
         self.factor = None
 
+    @staticmethod
+    def companion_files(filename):
+        """The .nev file, whose header is read with the .nsX files."""
+        filename = Path(filename)
+        if filename.suffix.lower() == '.nev':
+            return []
+        return [filename.with_suffix('.nev'), ]
+
     def return_hdr(self):
         """Return the header for further use.
 
@@ -48,6 +48,15 @@ class BrainVision:
     def __init__(self, filename):
         self.filename = filename.with_suffix('.vhdr')
 
+    @staticmethod
+    def companion_files(filename):
+        """Files read with the header: .vhdr, data and marker files."""
+        vhdr_file = Path(filename).with_suffix('.vhdr')
+        hdr = _parse_ini(vhdr_file)
+        return [vhdr_file,
+                vhdr_file.parent / hdr['Common Infos']['DataFile'],
+                vhdr_file.parent / hdr['Common Infos']['MarkerFile']]
+
     def return_hdr(self):
         """Return the header for further use.
 
@@ -19,6 +19,12 @@ class EEGLAB:
     def __init__(self, filename):
         self.filename = Path(filename).resolve()
 
+    @staticmethod
+    def companion_files(filename):
+        """All the .fdt files in the same directory (the name of the .fdt file
+        is stored in the .set file, which is slow to read)."""
+        return list(Path(filename).resolve().parent.glob('*.fdt'))
+
     def return_hdr(self):
         """
         subj_id : str
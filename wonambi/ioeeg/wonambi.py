@@ -17,6 +17,11 @@ class Wonambi:
     def __init__(self, filename):
         self.filename = filename
 
+    @staticmethod
+    def companion_files(filename):
+        """The .dat file, with the data."""
+        return [Path(filename).with_suffix('.dat'), ]
+
     def return_hdr(self):
         """Return the header for further use.
 
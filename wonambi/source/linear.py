@@ -2,18 +2,14 @@
 
 """
 from copy import deepcopy
-from functools import partial
+from hashlib import sha1
 from logging import getLogger
-from multiprocessing import Pool
+from pathlib import Path
 
-from numpy import (arange, asarray, atleast_2d, empty, exp, isnan, NaN,
-                   nansum)
-from numpy.linalg import norm
-try:
-    from scipy.sparse import csr_matrix as sparse
-    # test if csr_matrix is the fastest approach
-except ImportError:
-    sparse = lambda x: x
+from numpy import (arange, ascontiguousarray, asarray, bincount, empty,
+                   errstate, exp, isfinite, NaN)
+from scipy.sparse import csr_matrix as sparse, load_npz, save_npz
+from scipy.spatial import cKDTree
 
 lg = getLogger(__name__)
 
@@ -26,10 +22,11 @@ class Linear:
     ----
     both hemispheres
     """
-    def __init__(self, surf, chan, threshold=20, exponent=None, std=None):
-        inverse = calc_xyz2surf(surf, chan.return_xyz(), threshold=threshold,
-                                exponent=exponent, std=std)
-        self.inv = sparse(inverse)
+    def __init__(self, surf, chan, threshold=20, exponent=None, std=None,
+                 cache_dir=None):
+        self.inv = calc_xyz2surf(surf, chan.return_xyz(), threshold=threshold,
+                                 exponent=exponent, std=std,
+                                 cache_dir=cache_dir)
         self.chan = chan.return_label()
 
     def __call__(self, data, parameter='chan'):
@@ -54,7 +51,8 @@ class Linear:
         return output
 
 
-def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
+def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None,
+                  cache_dir=None):
     """Calculate transformation matrix from xyz values to vertices.
 
     Parameters
@@ -70,10 +68,14 @@ def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
     threshold : float
         distance in mm for a vertex to pick up electrode activity (if distance
         is above the threshold, one electrode does not affect a vertex).
+    cache_dir : path to dir, optional
+        if specified, the matrix is stored in this directory and read from
+        there the next time it's computed for the same surface, electrodes and
+        parameters.
 
     Returns
     -------
-    numpy.ndarray
+    scipy.sparse.csr_matrix
         nVertices X xyz.shape[0] matrix
 
     Notes
@@ -94,91 +96,68 @@ def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
 
     You can also create your own matrix (and skip calc_xyz2surf altogether) and
     pass it as attribute to the main figure.
-    Because it's a loop over all the vertices, this function is pretty slow,
-    but if you calculate it once, you can reuse it.
-    We take advantage of multiprocessing, which speeds it up considerably.
+    Only the pairs of vertices and electrodes closer than the threshold are
+    computed (with a KD-tree), so the matrix is sparse from the beginning.
     """
     if exponent is None and std is None:
         exponent = 1
 
-    if exponent is not None:
-        lg.debug('Vertex values based on inverse-law, with exponent ' +
-                 str(exponent))
-        funct = partial(calc_one_vert_inverse, xyz=xyz, exponent=exponent)
-    elif std is not None:
-        lg.debug('Vertex values based on gaussian, with s.d. ' + str(std))
-        funct = partial(calc_one_vert_gauss, xyz=xyz, std=std)
+    vert = ascontiguousarray(surf.vert, dtype=float)
+    xyz = ascontiguousarray(xyz, dtype=float)
 
-    with Pool() as p:
-        xyz2surf = p.map(funct, surf.vert)
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / ('xyz2surf_' + _hash_xyz2surf(
+            vert, xyz, threshold, exponent, std) + '.npz')
+        if cache_file.exists():
+            lg.debug('Reading transformation matrix from ' + str(cache_file))
+            return load_npz(cache_file)
 
-    xyz2surf = asarray(xyz2surf)
+    pairs = cKDTree(vert).sparse_distance_matrix(
+        cKDTree(xyz), threshold, output_type='ndarray')
+    i_vert, i_chan, dist = pairs['i'], pairs['j'], pairs['v']
 
     if exponent is not None:
+        lg.debug('Vertex values based on inverse-law, with exponent ' +
+                 str(exponent))
+        with errstate(divide='ignore'):
+            val = 1 / (dist ** exponent)
         threshold_value = (1 / (threshold ** exponent))
         external_threshold_value = threshold_value
     elif std is not None:
+        lg.debug('Vertex values based on gaussian, with s.d. ' + str(std))
+        val = gauss(dist, std)
         threshold_value = gauss(threshold, std)
         external_threshold_value = gauss(std, std) # this is around 0.607
     lg.debug('Values thresholded at ' + str(threshold_value))
 
-    xyz2surf[xyz2surf < threshold_value] = NaN
+    keep = val >= threshold_value
+    i_vert, i_chan, val = i_vert[keep], i_chan[keep], val[keep]
 
     # here we deal with vertices that are within the threshold value but far
     # from a single electrodes, so those remain empty
-    sumval = nansum(xyz2surf, axis=1)
+    sumval = bincount(i_vert, weights=val, minlength=vert.shape[0])
     sumval[sumval < external_threshold_value] = NaN
 
     # normalize by the number of electrodes
-    xyz2surf /= atleast_2d(sumval).T
-    xyz2surf[isnan(xyz2surf)] = 0
-
-    return xyz2surf
-
-
-def calc_one_vert_inverse(one_vert, xyz=None, exponent=None):
-    """Calculate how many electrodes influence one vertex, using the inverse
-    function.
-
-    Parameters
-    ----------
-    one_vert : ndarray
-        vector of xyz position of a vertex
-    xyz : ndarray
-        nChan X 3 with the position of all the channels
-    exponent : int
-        inverse law (1-> direct inverse, 2-> inverse square, 3-> inverse cube)
+    with errstate(invalid='ignore'):
+        val = val / sumval[i_vert]
+    keep = isfinite(val) & (val != 0)
 
-    Returns
-    -------
-    ndarray
-        one vector with values for one vertex
-    """
-    trans = empty(xyz.shape[0])
-    for i, one_xyz in enumerate(xyz):
-        trans[i] = 1 / (norm(one_vert - one_xyz) ** exponent)
-    return trans
+    xyz2surf = sparse((val[keep], (i_vert[keep], i_chan[keep])),
+                      shape=(vert.shape[0], xyz.shape[0]))
 
+    if cache_dir is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        save_npz(cache_file, xyz2surf)
 
-def calc_one_vert_gauss(one_vert, xyz=None, std=None):
-    """Calculate how many electrodes influence one vertex, using a Gaussian
-    function.
+    return xyz2surf
 
-    Parameters
-    ----------
-    one_vert : ndarray
-        vector of xyz position of a vertex
-    xyz : ndarray
-        nChan X 3 with the position of all the channels
-    std : float
-        distance in mm of the Gaussian kernel
 
-    Returns
-    -------
-    ndarray
-        one vector with values for one vertex
-    """
-    trans = empty(xyz.shape[0])
-    for i, one_xyz in enumerate(xyz):
-        trans[i] = gauss(norm(one_vert - one_xyz), std)
-    return trans
+def _hash_xyz2surf(vert, xyz, threshold, exponent, std):
+    """Hash of the surface, electrodes and parameters of calc_xyz2surf."""
+    h = sha1()
+    h.update(vert.tobytes())
+    h.update(xyz.tobytes())
+    h.update(repr((vert.shape, xyz.shape, threshold, exponent,
+                   std)).encode())
+    return h.hexdigest()
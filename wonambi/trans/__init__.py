@@ -6,10 +6,11 @@ use this package to transform to other classes. If you want to transform to
 basic elements, use the package "detect" for example.
 
 """
-from .filter import filter_, convolve
-from .select import (select, resample, get_times, _select_channels, fetch,
+from .filter import filter_, filter_dataset, convolve
+from .select import (select, resample, resample_dataset, get_times,
+                     _select_channels, fetch,
                      Segments)
-from .frequency import frequency, timefrequency, band_power
+from .frequency import frequency, timefrequency, band_power, connectivity
 from .merge import concatenate
 from .math import math, get_descriptives
 from .montage import montage, create_virtual_channel
@@ -1,11 +1,12 @@
 """Analysis and export convenience functions.
 """
 
+from collections import OrderedDict
 from logging import getLogger
-from itertools import compress
-from csv import writer
-from numpy import (amax, amin, asarray, concatenate, in1d, mean, negative, ptp, 
-                   reshape, sqrt, square)
+from math import ceil
+from numpy import (add, arange, asarray, concatenate, cumsum, empty,
+                   flatnonzero, maximum, minimum, negative, repeat, sqrt,
+                   square, stack)
 
 try:
     from PyQt5.QtCore import Qt
@@ -15,21 +16,33 @@ except ImportError:
     QProgressDialog = None
 
 from .. import __version__
-from .math import math, get_descriptives
-from .frequency import band_power
+from .math import get_descriptives
+from .frequency import _band_power, _fft
 from .peaks import get_slopes
+from ..utils.table import write_table
 
 lg = getLogger(__name__)
 
+AMP_KEYS = ['minamp', 'maxamp', 'ptp', 'rms']
+PW_KEYS = ['power', 'peakpf', 'energy', 'peakef']
+PARAM_KEYS = AMP_KEYS + PW_KEYS
+# maximum number of values (channels X samples) whose parameters are computed
+# at once, if the segments are not in memory already
+EVT_CHUNK = 2 ** 22
+# number of steps of the progress dialog of event_params
+EVT_PROGRESS_STEPS = 100
 
-def event_params(segments, params, band=None, n_fft=None, slopes=None, 
-                 prep=None, parent=None):
+
+def event_params(segments, params, band=None, n_fft=None, slopes=None,
+                 prep=None, parent=None, table=False, workers=None):
     """Compute event parameters.
     
     Parameters
     ----------
     segments : instance of wonambi.trans.select.Segments
-        list of segments, with time series and metadata
+        list of segments, with time series and metadata. It can also be any
+        iterable of segments (f.e. Segments.iter_data), which is consumed
+        in chunks of EVT_CHUNK values.
     params : dict of bool, or str
         'dur', 'minamp', 'maxamp', 'ptp', 'rms', 'power', 'peakf', 'energy', 
         'peakef'. If 'all', a dict will be created with these keys and all 
@@ -44,252 +57,386 @@ def event_params(segments, params, band=None, n_fft=None, slopes=None,
     prep : dict of bool
         same keys as params. if True, segment['trans_data'] will be used as dat
     parent : QMainWindow
-        for use with GUI only
+        for use with GUI only. The segments are computed in (at most
+        EVT_PROGRESS_STEPS) chunks, so that the progress is shown and the
+        computation can be aborted.
+    table : bool
+        if True, return a table (see event_params_table) instead of a list of
+        dict
+    workers : int
+        number of threads used to compute the FFT
         
     Returns
     -------
     list of dict
-        list of segments, with time series, metadata and parameters
+        list of segments, with time series, metadata and parameters. The
+        parameters are dict, with channel as key. None, if aborted by the user.
     """
+    n_seg = len(segments) if hasattr(segments, '__len__') else 0
+    max_seg = None
     if parent is not None:
         progress = QProgressDialog('Computing parameters', 'Abort',
-                                   0, len(segments) - 1, parent)
+                                   0, n_seg, parent)
         progress.setWindowModality(Qt.ApplicationModal)
+        progress.setValue(0)
+        max_seg = max(ceil(n_seg / EVT_PROGRESS_STEPS), 1)
 
-    param_keys = ['dur', 'minamp', 'maxamp', 'ptp', 'rms', 'power', 'peakpf', 
-                  'energy', 'peakef']
-    
-    if params == 'all':
-        params = {k: 1 for k in param_keys}
-    if prep is None:
-        prep = {k: 0 for k in param_keys}    
-    if band is None:
-        band = (None, None)
-
+    evt_tables = []
     params_out = []
-    evt_output = False
+    n_done = 0
+    for chunk in _chunks(segments, EVT_CHUNK, max_seg):
+        evt_table = event_params_table(chunk, params, band=band, n_fft=n_fft,
+                                       slopes=slopes, prep=prep,
+                                       workers=workers)
+        if not evt_table:
+            break
+
+        if not table:
+            params_out.extend(_table_to_segments(chunk, evt_table))
+        evt_table['segment'] += n_done
+        evt_tables.append(evt_table)
+
+        n_done += len(chunk)
+        if parent is not None:
+            progress.setValue(min(n_done, n_seg))
+            if progress.wasCanceled():
+                parent.parent.statusBar().showMessage(
+                    'Process canceled by user.')
+                return
+
+    if parent is not None:
+        progress.close()
 
+    if not evt_tables:
+        return {}
+    if not table:
+        return params_out
+
+    return {k: concatenate([x[k] for x in evt_tables])
+            for k in evt_tables[0]}
+
+
+def _chunks(segments, size, max_seg=None):
+    """Split segments into lists with at most size values (but at least one
+    segment) and at most max_seg segments. If max_seg is None, a list of
+    segments is returned as it is."""
+    if isinstance(segments, list) and max_seg is None:
+        if segments:
+            yield segments
+        return
+
+    chunk = []
+    n_values = 0
+    for seg in segments:
+        n = seg['data'].data[0].size
+        if chunk and (n_values + n > size or len(chunk) == max_seg):
+            yield chunk
+            chunk = []
+            n_values = 0
+        chunk.append(seg)
+        n_values += n
+
+    if chunk:
+        yield chunk
+
+
+def _table_to_segments(segments, evt_table):
+    """Add the parameters in the table to each segment (see event_params)."""
+    params_out = []
     for i, seg in enumerate(segments):
         out = dict(seg)
-        dat = seg['data']            
-
-        if params['dur']:
-            out['dur'] = float(dat.number_of('time')) / dat.s_freq
-            evt_output = True
-
-        if params['minamp']:
-            dat1 = dat
-            if prep['minamp']:
-                dat1 = seg['trans_data']
-            out['minamp'] = math(dat1, operator=_amin, axis='time')
-            evt_output = True
-
-        if params['maxamp']:
-            dat1 = dat
-            if prep['maxamp']:
-                dat1 = seg['trans_data']
-            out['maxamp'] = math(dat1, operator=_amax, axis='time')
-            evt_output = True
-
-        if params['ptp']:
-            dat1 = dat
-            if prep['ptp']:
-                dat1 = seg['trans_data']
-            out['ptp'] = math(dat1, operator=_ptp, axis='time')
-            evt_output = True
-
-        if params['rms']:
-            dat1 = dat
-            if prep['rms']:
-                dat1 = seg['trans_data']
-            out['rms'] = math(dat1, operator=(square, _mean, sqrt),
-               axis='time')
-            evt_output = True
+        rows = flatnonzero(evt_table['segment'] == i)
+
+        if 'dur' in evt_table:
+            out['dur'] = evt_table['dur'][rows[0]]
+        for k in AMP_KEYS:
+            if k in evt_table:
+                out[k] = _chan_values(seg['data'], evt_table[k][rows])
+        for k in PW_KEYS:
+            if k in evt_table:
+                out[k] = dict(zip(evt_table['chan'][rows],
+                                  evt_table[k][rows]))
+        if 'avg_slope' in evt_table:
+            out['slope'] = {chan: (evt_table['avg_slope'][i_row],
+                                   evt_table['max_slope'][i_row])
+                            for chan, i_row in zip(evt_table['chan'][rows],
+                                                   rows)}
+        out['start'] = evt_table['start'][rows[0]]
+        out['end'] = evt_table['end'][rows[0]]
+        params_out.append(out)
 
-        for pw, pk in [('power', 'peakpf'), ('energy', 'peakef')]:
+    return params_out
 
-            if params[pw] or params[pk]:
-                evt_output = True
-
-                if prep[pw] or prep[pk]:
-                    prep_pw, prep_pk = band_power(seg['trans_data'], band,
-                                                 scaling=pw, n_fft=n_fft)
-                if not (prep[pw] and prep[pk]):
-                    raw_pw, raw_pk = band_power(dat, band, 
-                                                scaling=pw, n_fft=n_fft)
-
-                if prep[pw]:
-                    out[pw] = prep_pw
-                else:
-                    out[pw] = raw_pw
-
-                if prep[pk]:
-                    out[pk] = prep_pk
-                else:
-                    out[pk] = raw_pk
-
-        if slopes:
-            evt_output = True
-            out['slope'] = {}
-            dat1 = dat
-            if slopes['prep']:
-                dat1 = seg['trans_data']
-            if slopes['invert']:
-                dat1 = math(dat1, operator=negative, axis='time')
-
-            if slopes['avg_slope'] and slopes['max_slope']:
-                level = 'all'
-            elif slopes['avg_slope']:
-                level = 'average'
-            else:
-                level = 'maximum'
-
-            for chan in dat1.axis['chan'][0]:
-                d = dat1(chan=chan)[0]
-                out['slope'][chan] = get_slopes(d, dat.s_freq, level=level)
-                
-        if evt_output:
-            timeline = dat.axis['time'][0]
-            out['start'] = timeline[0]
-            out['end'] = timeline[-1]
-            params_out.append(out)
-
-        if parent:
-            progress.setValue(i)
-            if progress.wasCanceled():
-                msg = 'Analysis canceled by user.'
-                parent.statusBar().showMessage(msg)
-                return
 
-    if parent:
-        progress.close()
+def _chan_values(data, values):
+    """One value per channel, like math(data, axis='time')."""
+    output = data._copy(axis=False)
+    output.axis = OrderedDict([('chan', data.axis['chan'].copy())])
+    output.data[0] = values
+    return output
+
+
+def event_params_table(segments, params, band=None, n_fft=None, slopes=None,
+                       prep=None, workers=None):
+    """Compute event parameters for all the segments at once.
+
+    Parameters
+    ----------
+    segments, params, band, n_fft, slopes, prep, workers
+        see event_params
+
+    Returns
+    -------
+    dict of ndarray
+        one column for each parameter, one row for each channel in each
+        segment: 'segment' (index of the segment), 'chan', 'start', 'end',
+        'n_stitch', 'stage', 'cycle', 'name' and the parameters of interest
+        ('dur', 'minamp', 'maxamp', 'ptp', 'rms', 'power', 'peakpf', 'energy',
+        'peakef', 'avg_slope' and 'max_slope', with 5 values per row, see
+        get_slopes). It's empty if no parameter was requested.
+
+    Notes
+    -----
+    The data of all the segments and channels are concatenated, so that the
+    amplitude parameters are computed with one reduction over all the rows.
+    The segments with the same number of channels and samples are stacked and
+    their spectrum is computed with one FFT.
+    """
+    if params == 'all':
+        params = {k: 1 for k in ['dur'] + PARAM_KEYS}
+    if prep is None:
+        prep = {}
+    if band is None:
+        band = (None, None)
+
+    amp_params = [k for k in AMP_KEYS if params.get(k)]
+    pw_params = [k for k in PW_KEYS if params.get(k)]
+    if not (params.get('dur') or amp_params or pw_params or slopes):
+        return {}
+
+    n_chan = asarray([seg['data'].number_of('chan')[0] for seg in segments])
+    n_smp = asarray([seg['data'].number_of('time')[0] for seg in segments])
+    # first row of each segment
+    first_row = concatenate(([0], cumsum(n_chan)[:-1])).astype(int)
+
+    evt_table = {}
+    evt_table['segment'] = repeat(arange(len(segments)), n_chan)
+    evt_table['chan'] = concatenate([seg['data'].axis['chan'][0]
+                                     for seg in segments])
+    for k in ('start', 'end'):
+        idx = 0 if k == 'start' else -1
+        evt_table[k] = repeat([seg['data'].axis['time'][0][idx]
+                               for seg in segments], n_chan)
+    for k in ('n_stitch', 'stage', 'cycle', 'name'):
+        values = [seg.get(k) for seg in segments]
+        if k == 'cycle':
+            values = [x if x is None else x[2] for x in values]
+        evt_table[k] = repeat(asarray(values, dtype='O'), n_chan)
+
+    if params.get('dur'):
+        s_freq = asarray([seg['data'].s_freq for seg in segments])
+        evt_table['dur'] = repeat(n_smp / s_freq, n_chan)
+
+    for data_key in ('data', 'trans_data'):
+        is_prep = data_key == 'trans_data'
+        sel_amp = [k for k in amp_params if bool(prep.get(k)) == is_prep]
+        sel_pw = [k for k in pw_params if bool(prep.get(k)) == is_prep]
+        if not sel_amp and not sel_pw:
+            continue
+        dat = [seg[data_key] for seg in segments]
+
+        if sel_amp:
+            evt_table.update(_amplitude_params(dat, n_chan, n_smp, sel_amp))
+
+        for pw, pk in [('power', 'peakpf'), ('energy', 'peakef')]:
+            if pw not in sel_pw and pk not in sel_pw:
+                continue
+            power, peakf = _band_power_params(dat, first_row, band, pw,
+                                              n_fft, workers)
+            if pw in sel_pw:
+                evt_table[pw] = power
+            if pk in sel_pw:
+                evt_table[pk] = peakf
+
+    if slopes:
+        if slopes['avg_slope'] and slopes['max_slope']:
+            level = 'all'
+        elif slopes['avg_slope']:
+            level = 'average'
+        else:
+            level = 'maximum'
+
+        avg_slope = []
+        max_slope = []
+        for seg in segments:
+            dat = seg['trans_data'] if slopes['prep'] else seg['data']
+            for d in dat.data[0]:
+                if slopes['invert']:
+                    d = negative(d)
+                one_slope = get_slopes(d, seg['data'].s_freq, level=level)
+                avg_slope.append(one_slope[0])
+                max_slope.append(one_slope[1])
+        evt_table['avg_slope'] = asarray(avg_slope)
+        evt_table['max_slope'] = asarray(max_slope)
+
+    return evt_table
+
+
+def _amplitude_params(dat, n_chan, n_smp, sel_params):
+    """Amplitude parameters of all the channels in all the segments, computed
+    on the concatenated data (one row per channel and segment)."""
+    flat = concatenate([x.data[0].ravel() for x in dat])
+    row_smp = repeat(n_smp, n_chan)
+    starts = concatenate(([0], cumsum(row_smp)[:-1])).astype(int)
+
+    out = {}
+    if 'minamp' in sel_params or 'ptp' in sel_params:
+        min_amp = minimum.reduceat(flat, starts)
+    if 'maxamp' in sel_params or 'ptp' in sel_params:
+        max_amp = maximum.reduceat(flat, starts)
+    if 'minamp' in sel_params:
+        out['minamp'] = min_amp
+    if 'maxamp' in sel_params:
+        out['maxamp'] = max_amp
+    if 'ptp' in sel_params:
+        out['ptp'] = max_amp - min_amp
+    if 'rms' in sel_params:
+        out['rms'] = sqrt(add.reduceat(square(flat), starts) / row_smp)
+
+    return out
+
+
+def _band_power_params(dat, first_row, band, scaling, n_fft, workers):
+    """Power (or energy) and peak frequency of all the channels in all the
+    segments. Segments with the same shape are computed together."""
+    n_rows = sum(x.number_of('chan')[0] for x in dat)
+    power = empty(n_rows)
+    peakf = empty(n_rows)
+
+    same_shape = {}
+    for i, x in enumerate(dat):
+        same_shape.setdefault((x.data[0].shape, x.s_freq), []).append(i)
+
+    for (shape, s_freq), idx_seg in same_shape.items():
+        x = stack([dat[i].data[0] for i in idx_seg])
+        sf, Sxx = _fft(x, s_freq=s_freq, detrend=None, scaling=scaling,
+                       n_fft=n_fft, workers=workers)
+        pw, pf = _band_power(Sxx, sf, band)
+        rows = (first_row[idx_seg, None] + arange(shape[0])).ravel()
+        power[rows] = pw.ravel()
+        peakf[rows] = pf.ravel()
+
+    return power, peakf
 
-    return params_out
 
 def export_event_params(filename, params, count=None, density=None):
-    """Write event analysis data to CSV."""
-    heading_row_1 = ['Segment index',
-                   'Start time',
-                   'End time',
-                   'Stitches',
-                   'Stage',
-                   'Cycle',
-                   'Event type',
-                   'Channel']
-    spacer = [''] * (len(heading_row_1) - 1)
-
-    param_headings_1 = ['Min. amplitude (uV)',
-                        'Max. amplitude (uV)',
-                        'Peak-to-peak amplitude (uV)',
-                        'RMS (uV)']
-    param_headings_2 = ['Power (uV^2)',
-                        'Peak power frequency (Hz)',
-                        'Energy (uV^2s)',
-                        'Peak energy frequency (Hz)']
-    slope_headings =   ['Q1 average slope (uV/s)',
-                        'Q2 average slope (uV/s)',
-                        'Q3 average slope (uV/s)',
-                        'Q4 average slope (uV/s)',
-                        'Q23 average slope (uV/s)',
-                        'Q1 max. slope (uV/s^2)',
-                        'Q2 max. slope (uV/s^2)',
-                        'Q3 max. slope (uV/s^2)',
-                        'Q4 max. slope (uV/s^2)',
-                        'Q23 max. slope (uV/s^2)']
-    ordered_params_1 = ['minamp', 'maxamp', 'ptp', 'rms']
-    ordered_params_2 = ['power', 'peakpf', 'energy', 'peakef']
-
-    idx_params_1 = in1d(ordered_params_1, list(params[0].keys()))
-    sel_params_1 = list(compress(ordered_params_1, idx_params_1))
-    heading_row_2 = list(compress(param_headings_1, idx_params_1))
-
-    if 'dur' in params[0].keys():
-        heading_row_2 = ['Duration (s)'] + heading_row_2
-
-    idx_params_2 = in1d(ordered_params_2, list(params[0].keys()))
-    sel_params_2 = list(compress(ordered_params_2, idx_params_2))
-    heading_row_3 = list(compress(param_headings_2, idx_params_2))
-
-    heading_row_4 = []
-    if 'slope' in params[0].keys():
-        if next(iter(params[0]['slope']))[0]:
-            heading_row_4.extend(slope_headings[:5])
-        if next(iter(params[0]['slope']))[1]:
-            heading_row_4.extend(slope_headings[5:])
+    """Write event analysis data to CSV.
+
+    Parameters
+    ----------
+    filename : str
+        output filename. The extension can also be '.tsv', '.npz', '.parquet'
+        or '.feather' (see utils.table.write_table)
+    params : list of dict or dict of ndarray
+        output of event_params, as list of segments or as table
+    count : int
+        number of events
+    density : float
+        density of events
+    """
+    if isinstance(params, dict):
+        evt_table = params
+    else:
+        evt_table = _segments_to_table(params)
+
+    param_headings = {'dur': 'Duration (s)',
+                      'minamp': 'Min. amplitude (uV)',
+                      'maxamp': 'Max. amplitude (uV)',
+                      'ptp': 'Peak-to-peak amplitude (uV)',
+                      'rms': 'RMS (uV)',
+                      'power': 'Power (uV^2)',
+                      'peakpf': 'Peak power frequency (Hz)',
+                      'energy': 'Energy (uV^2s)',
+                      'peakef': 'Peak energy frequency (Hz)'}
+    quartiles = ['q1', 'q2', 'q3', 'q4', 'q23']
+
+    preamble = [['Wonambi v{}'.format(__version__)]]
+    if count:
+        preamble.append(['Count', count])
+    if density:
+        preamble.append(['Density', density])
 
     # Get data as matrix and compute descriptives
-    dat = []
-    if 'dur' in params[0].keys():
-        one_mat = asarray([seg['dur'] for seg in params \
-                           for chan in seg['data'].axis['chan'][0]])
-        one_mat = reshape(one_mat, (len(one_mat), 1))
-        dat.append(one_mat)
-
-    if sel_params_1:
-        one_mat = asarray([[seg[x](chan=chan)[0] for x in sel_params_1] \
-                for seg in params for chan in seg['data'].axis['chan'][0]])
-        dat.append(one_mat)
-
-    if sel_params_2:
-        one_mat = asarray([[seg[x][chan] for x in sel_params_2] \
-                for seg in params for chan in seg['data'].axis['chan'][0]])
-        dat.append(one_mat)
-
-    if 'slope' in params[0].keys():
-        one_mat = asarray([[x for y in seg['slope'][chan] for x in y] \
-                for seg in params for chan in seg['data'].axis['chan'][0]])
-        dat.append(one_mat)
-
-    if dat:
-        dat = concatenate(dat, axis=1)
-        desc = get_descriptives(dat)
-
-    with open(filename, 'w', newline='') as f:
-        lg.info('Writing to ' + str(filename))
-        csv_file = writer(f)
-        csv_file.writerow(['Wonambi v{}'.format(__version__)])
-
-        if count:
-            csv_file.writerow(['Count', count])
-        if density:
-            csv_file.writerow(['Density', density])
-
-        if dat == []:
-            return
-
-        csv_file.writerow(heading_row_1 + heading_row_2 + heading_row_3 \
-                          + heading_row_4)
-        csv_file.writerow(['Mean'] + spacer + list(desc['mean']))
-        csv_file.writerow(['SD'] + spacer + list(desc['sd']))
-        csv_file.writerow(['Mean of ln'] + spacer + list(desc['mean_log']))
-        csv_file.writerow(['SD of ln'] + spacer + list(desc['sd_log']))
-        idx = 0
-
-        for seg in params:
-            if seg['cycle'] is not None:
-                seg['cycle'] = seg['cycle'][2]
-
-            for chan in seg['data'].axis['chan'][0]:
-                idx += 1
-                data_row_1 = [seg[x](chan=chan)[0] for x in sel_params_1]
-                data_row_2 = [seg[x][chan] for x in sel_params_2]
-
-                if 'dur' in seg.keys():
-                    data_row_1 = [seg['dur']] + data_row_1
-
-                if 'slope' in seg.keys():
-                    data_row_3 = [x for y in seg['slope'][chan] for x in y]
-                    data_row_2 = data_row_2 + data_row_3
-
-                csv_file.writerow([idx,
-                                   seg['start'],
-                                   seg['end'],
-                                   seg['n_stitch'],
-                                   seg['stage'],
-                                   seg['cycle'],
-                                   seg['name'],
-                                   chan,
-                                   ] + data_row_1 + data_row_2)
+    param_columns = [(k, param_headings[k], evt_table[k])
+                     for k in ['dur'] + PARAM_KEYS if k in evt_table]
+    if 'avg_slope' in evt_table:
+        param_columns.extend(
+            (f'avg_slope_{q}', f'{q.upper()} average slope (uV/s)',
+             evt_table['avg_slope'][:, i]) for i, q in enumerate(quartiles))
+        param_columns.extend(
+            (f'max_slope_{q}', f'{q.upper()} max. slope (uV/s^2)',
+             evt_table['max_slope'][:, i]) for i, q in enumerate(quartiles))
+
+    if not param_columns:
+        write_table(filename, [], preamble=preamble)
+        return
+
+    dat = stack([values for name, heading, values in param_columns],
+                axis=1).astype(float)
+    desc = get_descriptives(dat)
+
+    columns = [('segment', 'Segment index', arange(1, dat.shape[0] + 1)),
+               ('start', 'Start time', evt_table['start']),
+               ('end', 'End time', evt_table['end']),
+               ('n_stitch', 'Stitches', evt_table['n_stitch']),
+               ('stage', 'Stage', evt_table['stage']),
+               ('cycle', 'Cycle', evt_table['cycle']),
+               ('name', 'Event type', evt_table['name']),
+               ('chan', 'Channel', evt_table['chan']),
+               ]
+    columns.extend((name, heading, dat[:, i]) for i, (name, heading, values)
+                   in enumerate(param_columns))
+
+    write_table(filename, columns, preamble=preamble,
+                summary=_summary_rows(desc, len(columns) - len(param_columns)))
+
+
+def _segments_to_table(params):
+    """Convert the list of segments from event_params into a table."""
+    evt_table = {}
+    chans = [list(seg['data'].axis['chan'][0]) for seg in params]
+    n_chan = [len(x) for x in chans]
+    evt_table['chan'] = asarray([x for y in chans for x in y], dtype='U')
+    for k in ('start', 'end', 'n_stitch', 'stage', 'cycle', 'name'):
+        values = [seg[k] for seg in params]
+        if k == 'cycle':
+            values = [x if x is None else x[2] for x in values]
+        evt_table[k] = repeat(asarray(values, dtype='O'), n_chan)
+
+    if not params:
+        return evt_table
+
+    if 'dur' in params[0]:
+        evt_table['dur'] = repeat([seg['dur'] for seg in params], n_chan)
+    for k in AMP_KEYS:
+        if k in params[0]:
+            evt_table[k] = asarray([seg[k](chan=chan)[0]
+                                    for seg, one_chans in zip(params, chans)
+                                    for chan in one_chans])
+    for k in PW_KEYS:
+        if k in params[0]:
+            evt_table[k] = asarray([seg[k][chan]
+                                    for seg, one_chans in zip(params, chans)
+                                    for chan in one_chans])
+    if 'slope' in params[0]:
+        slope = asarray([seg['slope'][chan]
+                         for seg, one_chans in zip(params, chans)
+                         for chan in one_chans])
+        evt_table['avg_slope'] = slope[:, 0, :]
+        evt_table['max_slope'] = slope[:, 1, :]
+
+    return evt_table
+
 
 def export_freq(xfreq, filename, desc=None):
     """Write frequency analysis data to CSV.
@@ -299,131 +446,84 @@ def export_freq(xfreq, filename, desc=None):
     xfreq : list of dict
         spectral data, one dict per segment, where 'data' is ChanFreq
     filename : str
-        output filename
+        output filename. The extension can also be '.tsv', '.npz', '.parquet'
+        or '.feather' (see utils.table.write_table)
     desc : dict of ndarray
         descriptives
     '"""
-    heading_row_1 = ['Segment index',
-                   'Start time',
-                   'End time',
-                   'Duration',
-                   'Stitches',
-                   'Stage',
-                   'Cycle',
-                   'Event type',
-                   'Channel',
-                   ]
-    spacer = [''] * (len(heading_row_1) - 1)
-    freq = list(xfreq[0]['data'].axis['freq'][0])
-
-    with open(filename, 'w', newline='') as f:
-        lg.info('Writing to ' + str(filename))
-        csv_file = writer(f)
-        csv_file.writerow(['Wonambi v{}'.format(__version__)])
-        csv_file.writerow(heading_row_1 + freq)
-
-        if desc:
-            csv_file.writerow(['Mean'] + spacer + list(desc['mean']))
-            csv_file.writerow(['SD'] + spacer + list(desc['sd']))
-            csv_file.writerow(['Mean of ln'] + spacer + list(
-                    desc['mean_log']))
-            csv_file.writerow(['SD of ln'] + spacer + list(desc['sd_log']))
-
-        idx = 0
-        for seg in xfreq:
-
-            for chan in seg['data'].axis['chan'][0]:
-                idx += 1
-
-                cyc = None
-                if seg['cycle'] is not None:
-                    cyc = seg['cycle'][2]
-
-                data_row = list(seg['data'](chan=chan)[0])
-                csv_file.writerow([idx,
-                                   seg['start'],
-                                   seg['end'],
-                                   seg['duration'],
-                                   seg['n_stitch'],
-                                   seg['stage'],
-                                   cyc,
-                                   seg['name'],
-                                   chan,
-                                   ] + data_row)
+    freq = xfreq[0]['data'].axis['freq'][0]
+
+    columns = _freq_info_columns(xfreq)
+    n_info = len(columns)
+    dat = concatenate([seg['data'].data[0] for seg in xfreq])
+    columns.extend((str(f), str(f), dat[:, i]) for i, f in enumerate(freq))
+
+    summary = []
+    if desc:
+        summary = _summary_rows(desc, n_info)
+
+    write_table(filename, columns,
+                preamble=[['Wonambi v{}'.format(__version__)]],
+                summary=summary)
 
 
 def export_freq_band(xfreq, bands, filename):
-    """Write frequency analysis data to CSV by pre-defined band."""
-    heading_row_1 = ['Segment index',
-                   'Start time',
-                   'End time',
-                   'Duration',
-                   'Stitches',
-                   'Stage',
-                   'Cycle',
-                   'Event type',
-                   'Channel',
-                   ]
-    spacer = [''] * (len(heading_row_1) - 1)
-    band_hdr = [str(b1) + '-' + str(b2) for b1, b2 in bands]
-    xband = xfreq.copy()
-
-    for seg in xband:
-        bandlist = []
-
-        for i, b in enumerate(bands):
-            pwr, _ = band_power(seg['data'], b)
-            bandlist.append(pwr)
-
-        seg['band'] = bandlist
-
-    as_matrix = asarray([
-            [x['band'][y][chan] for y in range(len(x['band']))] \
-            for x in xband for chan in x['band'][0].keys()])
-    desc = get_descriptives(as_matrix)
-
-    with open(filename, 'w', newline='') as f:
-        lg.info('Writing to ' + str(filename))
-        csv_file = writer(f)
-        csv_file.writerow(['Wonambi v{}'.format(__version__)])
-        csv_file.writerow(heading_row_1 + band_hdr)
-        csv_file.writerow(['Mean'] + spacer + list(desc['mean']))
-        csv_file.writerow(['SD'] + spacer + list(desc['sd']))
-        csv_file.writerow(['Mean of ln'] + spacer + list(desc['mean_log']))
-        csv_file.writerow(['SD of ln'] + spacer + list(desc['sd_log']))
-        idx = 0
-
-        for seg in xband:
-
-            for chan in seg['band'][0].keys():
-                idx += 1
-
-                cyc = None
-                if seg['cycle'] is not None:
-                    cyc = seg['cycle'][2]
-
-                data_row = list(
-                        [seg['band'][x][chan] for x in range(
-                                len(seg['band']))])
-                csv_file.writerow([idx,
-                                   seg['start'],
-                                   seg['end'],
-                                   seg['duration'],
-                                   seg['n_stitch'],
-                                   seg['stage'],
-                                   cyc,
-                                   seg['name'],
-                                   chan,
-                                   ] + data_row)
-
-def _amax(x, axis, keepdims=None):
-    return amax(x, axis=axis)
-
-def _amin(x, axis, keepdims=None):
-    return amin(x, axis=axis)
-
-def _ptp(x, axis, keepdims=None):
-    return ptp(x, axis=axis)
-
-def _mean(x, axis, keepdims=None):
-    return mean(x, axis=axis)
\ No newline at end of file
+    """Write frequency analysis data to CSV by pre-defined band.
+
+    Parameters
+    ----------
+    xfreq : list of dict
+        spectral data, one dict per segment, where 'data' is ChanFreq
+    bands : list of tuple of float
+        frequency bands, each as (low, high)
+    filename : str
+        output filename. The extension can also be '.tsv', '.npz', '.parquet'
+        or '.feather' (see utils.table.write_table)
+    """
+    dat = concatenate([
+        stack([_band_power(seg['data'].data[0], seg['data'].axis['freq'][0],
+                           b)[0] for b in bands], axis=1)
+        for seg in xfreq])
+    desc = get_descriptives(dat)
+
+    columns = _freq_info_columns(xfreq)
+    n_info = len(columns)
+    columns.extend((f'{b1}-{b2}', str(b1) + '-' + str(b2), dat[:, i])
+                   for i, (b1, b2) in enumerate(bands))
+
+    write_table(filename, columns,
+                preamble=[['Wonambi v{}'.format(__version__)]],
+                summary=_summary_rows(desc, n_info))
+
+
+def _freq_info_columns(xfreq):
+    """Columns describing each channel of each segment, in export_freq."""
+    chans = [seg['data'].axis['chan'][0] for seg in xfreq]
+    n_chan = [len(x) for x in chans]
+
+    columns = [('segment', 'Segment index', arange(1, sum(n_chan) + 1)), ]
+    for k, heading in [('start', 'Start time'),
+                       ('end', 'End time'),
+                       ('duration', 'Duration'),
+                       ('n_stitch', 'Stitches'),
+                       ('stage', 'Stage'),
+                       ('cycle', 'Cycle'),
+                       ('name', 'Event type')]:
+        values = [seg[k] for seg in xfreq]
+        if k == 'cycle':
+            values = [x if x is None else x[2] for x in values]
+        columns.append((k, heading, repeat(asarray(values, dtype='O'),
+                                           n_chan)))
+    columns.append(('chan', 'Channel', concatenate(chans)))
+
+    return columns
+
+
+def _summary_rows(desc, n_info):
+    """Rows with the descriptives, below the heading row."""
+    spacer = [''] * (n_info - 1)
+    return [['Mean'] + spacer + list(desc['mean']),
+            ['SD'] + spacer + list(desc['sd']),
+            ['Mean of ln'] + spacer + list(desc['mean_log']),
+            ['SD of ln'] + spacer + list(desc['sd_log']),
+            ]
@@ -1,17 +1,23 @@
 """Module to filter the data.
 """
+from functools import lru_cache
 from logging import getLogger
 
 from itertools import product
+from pathlib import Path
 
-from numpy import arange, empty, ix_, expand_dims, squeeze
+from numpy import (abs, arange, asarray, ceil, empty, ix_, expand_dims, log,
+                   memmap, roots, squeeze, stack, vstack)
 from scipy.signal import (iirfilter,
                           iirnotch,
-                          filtfilt,
+                          sosfiltfilt,
+                          tf2sos,
                           get_window,
                           fftconvolve,
                           )
 
+from .. import ChanTime
+
 lg = getLogger(__name__)
 
 
@@ -59,7 +65,150 @@ def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
     ValueError
         if the cutoff frequency is larger than the Nyquist frequency.
     """
-    nyquist = data.s_freq / 2.
+    sos = _design_sos(data.s_freq, low_cut, high_cut, order, ftype, Rs,
+                      notchfreq, notchquality)
+
+    fdata = data._copy()
+    idx_axis = data.index_of(axis)
+
+    # trials with the same shape are filtered in one call
+    same_shape = {}
+    for i in range(data.number_of('trial')):
+        same_shape.setdefault(data.data[i].shape, []).append(i)
+
+    for trials in same_shape.values():
+        if len(trials) == 1:
+            fdata.data[trials[0]] = _filtfilt(sos, data.data[trials[0]],
+                                              idx_axis, ftype)
+        else:
+            x = _filtfilt(sos, stack([data.data[i] for i in trials]),
+                          idx_axis + 1, ftype)
+            for i, one_x in zip(trials, x):
+                fdata.data[i] = one_x
+
+    return fdata
+
+
+def filter_dataset(dataset, chan=None, begsam=None, endsam=None,
+                   low_cut=None, high_cut=None, order=4, ftype='butter',
+                   Rs=None, notchfreq=50, notchquality=25, block_duration=60,
+                   out=None, tol=1e-9):
+    """Filter a whole recording block by block, without reading it all in
+    memory.
+
+    Parameters
+    ----------
+    dataset : instance of Dataset
+        recording to filter
+    chan : list of str, optional
+        channels to filter (default: all the channels)
+    begsam : int, optional
+        first sample (this sample will be included)
+    endsam : int, optional
+        last sample (this sample will NOT be included)
+    low_cut, high_cut, order, ftype, Rs, notchfreq, notchquality
+        see filter_
+    block_duration : float
+        duration of each block, in s, not including the padding
+    out : ndarray or str or Path, optional
+        array (n_chan X n_samples) where to write the filtered data, or path
+        of the file to create as memmap. If None, it allocates a new array.
+    tol : float
+        the padding of each block is long enough for the impulse response of
+        the filter to decay below this value
+
+    Returns
+    -------
+    instance of ChanTime
+        filtered data, with one trial, whose data is "out"
+
+    Notes
+    -----
+    Each block is read with some padding on both sides, filtered with
+    sosfiltfilt, and only the central part is written to out. Because of the
+    padding, the results are the same as filtering the whole recording at
+    once (within "tol"), but peak memory depends only on block_duration and
+    the number of channels.
+    """
+    s_freq = dataset.header['s_freq']
+    if chan is None:
+        chan = dataset.header['chan_name']
+    chan = list(chan)
+    if begsam is None:
+        begsam = 0
+    if endsam is None:
+        endsam = dataset.header['n_samples']
+    n_smp = endsam - begsam
+
+    sos = _design_sos(s_freq, low_cut, high_cut, order, ftype, Rs,
+                      notchfreq, notchquality)
+    padding = _decay_samples(sos, tol)
+    block = max(int(block_duration * s_freq), 1)
+
+    if out is None:
+        out = empty((len(chan), n_smp))
+    elif isinstance(out, (str, Path)):
+        out = memmap(str(out), dtype='float64', mode='w+',
+                     shape=(len(chan), n_smp))
+    if out.shape != (len(chan), n_smp):
+        raise ValueError('"out" should have shape ' +
+                         str((len(chan), n_smp)))
+
+    for beg in range(begsam, endsam, block):
+        end = min(beg + block, endsam)
+        beg_pad = max(beg - padding, begsam)
+        end_pad = min(end + padding, endsam)
+        lg.debug('Filtering samples {0: 9} - {1: 9}'.format(beg, end))
+
+        dat = dataset.read_data(chan=chan, begsam=beg_pad,
+                                endsam=end_pad).data[0]
+        dat = _filtfilt(sos, dat, 1, ftype)
+        out[:, beg - begsam:end - begsam] = dat[:, beg - beg_pad:end - beg_pad]
+
+    if isinstance(out, memmap):
+        out.flush()
+
+    data = ChanTime()
+    data.start_time = dataset.header['start_time']
+    data.s_freq = s_freq
+    data.axis['chan'] = empty(1, dtype='O')
+    data.axis['chan'][0] = asarray(chan, dtype='U')
+    data.axis['time'] = empty(1, dtype='O')
+    data.axis['time'][0] = arange(begsam, endsam) / s_freq
+    data.data = empty(1, dtype='O')
+    data.data[0] = out
+
+    return data
+
+
+def _filtfilt(sos, x, axis, ftype):
+    """Apply the filter forward and backward. All the harmonics of the notch
+    filter are applied in one pass, but the padding at the edges (which by
+    default grows with the number of harmonics) is at most the length of the
+    signal, so that short trials can be filtered."""
+    padlen = None
+    if ftype == 'notch':
+        # default padlen of sosfiltfilt
+        n_zeros = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        padlen = 3 * (2 * len(sos) + 1 - n_zeros)
+        padlen = max(min(padlen, x.shape[axis] - 1), 0)
+
+    return sosfiltfilt(sos, x, axis=axis, padlen=padlen)
+
+
+def _decay_samples(sos, tol):
+    """Number of samples for the impulse response of the filter to decay
+    below tol, based on the pole closest to the unit circle."""
+    radius = max(abs(roots(section[3:])).max() for section in sos)
+    if radius == 0:
+        return 3 * len(sos)
+    return int(ceil(log(tol) / log(radius))) + 3 * len(sos)
+
+
+def _design_sos(s_freq, low_cut, high_cut, order, ftype, Rs, notchfreq,
+                notchquality):
+    """Check the cutoff frequencies and design the filter (see filter_)."""
+    nyquist = s_freq / 2.
 
     btype = None
     if low_cut is not None and high_cut is not None:
@@ -90,22 +239,69 @@ def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
     if Rs is None:
         Rs = 40
 
+    # sosfilt needs a writable array, but the cached filters are read-only
     if ftype == 'notch':
-        b_a = [iirnotch(w0 / nyquist, notchquality) for w0 in arange(notchfreq, nyquist, notchfreq)]
+        return design_notch(notchfreq, notchquality, s_freq).copy()
 
     else:
         lg.debug('order {0: 2}, Wn {1}, btype {2}, ftype {3}'
                  ''.format(order, str(Wn), btype, ftype))
-        b_a = [iirfilter(order, Wn, btype=btype, ftype=ftype, rs=Rs), ]
+        return design_filter(ftype, order, Wn, btype, Rs).copy()
 
-    fdata = data._copy()
-    for i in range(data.number_of('trial')):
-        x = data.data[i]
-        for b, a in b_a:
-            x = filtfilt(b, a, x, axis=data.index_of(axis))
-        fdata.data[i] = x
 
-    return fdata
+@lru_cache(maxsize=64)
+def design_filter(ftype, order, Wn, btype, Rs):
+    """Design IIR filter as second-order sections (memoized).
+
+    Parameters
+    ----------
+    ftype : str
+        'butter', 'cheby1', 'cheby2', 'ellip', 'bessel'
+    order : int
+        filter order
+    Wn : float or tuple of float
+        cutoff frequency (or frequencies) as ratio of the Nyquist
+    btype : str
+        'bandpass', 'highpass', 'lowpass'
+    Rs : float
+        minimum attenuation in the stop band, in dB
+
+    Returns
+    -------
+    ndarray
+        second-order sections, n_sections X 6 (read-only, because it's shared
+        between calls)
+    """
+    sos = iirfilter(order, Wn, btype=btype, ftype=ftype, rs=Rs, output='sos')
+    sos.setflags(write=False)
+    return sos
+
+
+@lru_cache(maxsize=64)
+def design_notch(notchfreq, notchquality, s_freq):
+    """Design notch filter at one frequency and its harmonics, as one cascade
+    of second-order sections (memoized).
+
+    Parameters
+    ----------
+    notchfreq : float
+        frequency to apply notch filter to (+ harmonics)
+    notchquality : int
+        Quality factor (see scipy.signal.iirnotch)
+    s_freq : float
+        sampling frequency
+
+    Returns
+    -------
+    ndarray
+        second-order sections, n_harmonics X 6 (read-only, because it's
+        shared between calls)
+    """
+    nyquist = s_freq / 2.
+    sos = vstack([tf2sos(*iirnotch(w0 / nyquist, notchquality))
+                  for w0 in arange(notchfreq, nyquist, notchfreq)])
+    sos.setflags(write=False)
+    return sos
 
 
 def convolve(data, window, axis='time', length=1):
@@ -1,16 +1,21 @@
 """Module to compute frequency representation.
 """
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from functools import lru_cache
 from logging import getLogger
-from functools import partial
-from multiprocessing import Pool
+from os import cpu_count
+from threading import Lock
 
-from numpy import (arange, array, asarray, copy, empty, exp, log, max, mean,
-                   median, moveaxis, pi, real, reshape, sqrt, swapaxes, zeros)
+from numpy import (abs, arange, array, asarray, ascontiguousarray, ceil, copy,
+                   empty, exp, imag, log, log2, max, mean, median, moveaxis,
+                   pi, real, sqrt, stack, swapaxes, zeros)
 from numpy.linalg import norm
 import numpy.fft as np_fft
 from scipy import fftpack
-from scipy.signal import windows, get_window, fftconvolve
+from scipy import fft as sp_fft
+from scipy.signal import windows, get_window
 from scipy.signal import detrend as detrend_func
 
 from .extern.dpss import dpss_windows  # this will be in scipy v1.1
@@ -19,11 +24,22 @@ from .select import _create_subepochs
 
 lg = getLogger(__name__)
 
+# max number of complex values computed at once for each channel (morlet)
+MORLET_BLOCK = 2 ** 24
+# max number of values (of the trials with the same shape) whose spectrum is
+# computed at once (frequency). The tapered data and the spectrum are larger.
+FREQUENCY_BLOCK = 2 ** 22
+# max number of cross-spectra computed at once (connectivity)
+CONNECTIVITY_BLOCK = 2 ** 24
+# pools of threads, one for each number of threads (see _get_executor)
+_executors = {}
+_executors_lock = Lock()
+
 
 def frequency(data, output='spectraldensity', scaling='power', sides='one',
               taper=None, halfbandwidth=3, NW=None, duration=None,
               overlap=0.5, step=None, detrend='linear', n_fft=None,
-              log_trans=False, centend='mean'):
+              log_trans=False, centend='mean', dtype=None, workers=None):
     """Compute the
     power spectral density (PSD, output='spectraldensity', scaling='power'), or
     energy spectral density (ESD, output='spectraldensity', scaling='energy') or
@@ -74,6 +90,12 @@ def frequency(data, output='spectraldensity', scaling='power', sides='one',
     centend : str
         (only if duration is not None). Central tendency measure to use, either
         mean (arithmetic) or median.
+    dtype : str
+        if 'float32', the data is converted to single precision before the
+        FFT (faster, half the memory). If None, it keeps the original dtype.
+    workers : int
+        number of threads used to compute the FFT (see scipy.fft). If None,
+        it uses one thread.
 
     Returns
     -------
@@ -100,6 +122,10 @@ def frequency(data, output='spectraldensity', scaling='power', sides='one',
 
     Use of log or median for Welch's method is included based on
     recommendations from Izhikevich et al., bioRxiv, 2018.
+
+    Trials with the same number of samples are stacked and computed in one
+    call, so that many short trials (f.e. from Segments) are as fast as one
+    long trial. The tapers are computed only once for each length.
     """
     if output not in ('spectraldensity', 'complex', 'csd'):
         raise TypeError(f'output can be "spectraldensity", "complex" or "csd",'
@@ -132,8 +158,29 @@ def frequency(data, output='spectraldensity', scaling='power', sides='one',
         freq.axis['taper'] = empty(data.number_of('trial'), dtype='O')
     freq.data = empty(data.number_of('trial'), dtype='O')
 
+    # trials with the same shape are computed in one call, in blocks of at
+    # most FREQUENCY_BLOCK values (not csd, which uses the first dimension for
+    # the two channels)
+    same_shape = {}
     for i in range(data.number_of('trial')):
-        x = data(trial=i)
+        if output == 'csd':
+            same_shape[i] = [i, ]
+        else:
+            same_shape.setdefault(data.data[i].shape, []).append(i)
+
+    blocks = []
+    for trials in same_shape.values():
+        block = FREQUENCY_BLOCK // (data.data[trials[0]].size or 1) or 1
+        blocks.extend(trials[i:i + block]
+                      for i in range(0, len(trials), block))
+
+    for trials in blocks:
+        if len(trials) == 1:
+            x = data(trial=trials[0])
+        else:
+            x = stack([data.data[i] for i in trials])
+        if dtype is not None:
+            x = x.astype(dtype, copy=False)
         if duration is not None:
             x = _create_subepochs(x, nperseg, nstep)
 
@@ -146,7 +193,8 @@ def frequency(data, output='spectraldensity', scaling='power', sides='one',
                       scaling=scaling,
                       halfbandwidth=halfbandwidth,
                       NW=NW,
-                      n_fft=n_fft)
+                      n_fft=n_fft,
+                      workers=workers)
 
         if log_trans:
             Sxx = log(Sxx)
@@ -160,17 +208,216 @@ def frequency(data, output='spectraldensity', scaling='power', sides='one',
                 raise ValueError('Invalid central tendency measure. '
                                  'Use mean or median.')
 
-        freq.axis['freq'][i] = f
-        if output == 'complex':
-            freq.axis['taper'][i] = arange(Sxx.shape[-1])
-        if output == 'csd':
-            newchan = ' * '.join(freq.axis['chan'][i])
-            freq.axis['chan'][i] = asarray([newchan], dtype='U')
-        freq.data[i] = Sxx
+        if len(trials) == 1:
+            Sxx = Sxx[None, ...]
+
+        for i, one_Sxx in zip(trials, Sxx):
+            freq.axis['freq'][i] = f
+            if output == 'complex':
+                freq.axis['taper'][i] = arange(one_Sxx.shape[-1])
+            if output == 'csd':
+                newchan = ' * '.join(freq.axis['chan'][i])
+                freq.axis['chan'][i] = asarray([newchan], dtype='U')
+            freq.data[i] = one_Sxx
 
     return freq
 
 
+def connectivity(data, method='coherence', taper='hann', halfbandwidth=3,
+                 NW=None, duration=None, overlap=0.5, step=None,
+                 detrend='linear', n_fft=None, dtype=None, n_jobs=None):
+    """Compute the connectivity between all the pairs of channels, in the
+    frequency domain.
+
+    Parameters
+    ----------
+    data : instance of ChanTime or list of ChanTime
+        data to analyze. All the trials (of all the instances, if it's a list,
+        f.e. the 'data' of each segment) are used to estimate the spectra, so
+        they should have the same channels.
+    method : str
+        'csd' (cross-spectral density, as in frequency with output='csd'),
+        'coherence' (magnitude-squared coherence), 'imcoh' (imaginary part of
+        the coherency) or 'plv' (phase-locking value)
+    taper, halfbandwidth, NW, duration, overlap, step, detrend, n_fft
+        see frequency
+    dtype : str
+        if 'float32', the data is converted to single precision before the
+        FFT. If None, it keeps the original dtype.
+    n_jobs : int
+        number of threads (the FFT of the trials is computed in parallel)
+
+    Returns
+    -------
+    instance of ChanFreq
+        one trial, with axes 'chan', 'chan2' and 'freq', so that data[i, j] is
+        the connectivity between the i-th and the j-th channel at each
+        frequency
+
+    Raises
+    ------
+    ValueError
+        if the trials do not have the same channels or frequencies (if the
+        trials have different lengths, use duration or n_fft)
+
+    Notes
+    -----
+    The tapered FFT of each channel is computed only once for each trial, each
+    epoch (if duration is not None) and each taper. Then the cross-spectra of
+    all the pairs of channels are computed for each frequency as one matrix
+    product (channels X repetitions by repetitions X channels), in blocks of
+    at most CONNECTIVITY_BLOCK values.
+    """
+    if method not in ('csd', 'coherence', 'imcoh', 'plv'):
+        raise ValueError('method can be "csd", "coherence", "imcoh" or "plv", '
+                         'not "' + str(method) + '"')
+
+    if isinstance(data, ChanTime):
+        data = [data, ]
+    trials = []
+    chan = data[0].axis['chan'][0]
+    for one_data in data:
+        for i in range(one_data.number_of('trial')):
+            if list(one_data.axis['chan'][i]) != list(chan):
+                raise ValueError('All the trials should have the same '
+                                 'channels')
+            trials.append(one_data.data[i])
+    s_freq = data[0].s_freq
+
+    def _one_trial(x):
+        if dtype is not None:
+            x = x.astype(dtype, copy=False)
+        if duration is not None:
+            nperseg = int(duration * s_freq)
+            if step is not None:
+                nstep = int(step * s_freq)
+            else:
+                nstep = nperseg - int(overlap * nperseg)
+            x = _create_subepochs(x, nperseg, nstep)
+        else:
+            x = x[:, None, :]
+        return _tapered_fft(x, s_freq, taper, halfbandwidth, NW, detrend,
+                            n_fft)
+
+    executor, n_workers = _get_executor(n_jobs)
+    n_chan = len(chan)
+    freqs = None
+    n_rep = 0
+    for i0 in range(0, len(trials), n_workers):
+        group = trials[i0:i0 + n_workers]
+        for one_n_fft, one_freqs, x_fft in executor.map(_one_trial, group):
+            if freqs is None:
+                freqs = one_freqs
+                used_n_fft = one_n_fft
+                Sxy = zeros((len(freqs), n_chan, n_chan),
+                            dtype=x_fft.dtype)
+            elif len(one_freqs) != len(freqs) or (one_freqs != freqs).any():
+                raise ValueError('All the trials should have the same '
+                                 'frequencies (use duration or n_fft)')
+
+            if method == 'plv':
+                amplitude = abs(x_fft)
+                amplitude[amplitude == 0] = 1
+                x_fft = x_fft / amplitude
+
+            _add_cross_spectra(Sxy, moveaxis(x_fft, -1, 0))
+            n_rep += x_fft.shape[1]
+
+    Sxy /= n_rep
+
+    if method == 'csd':
+        # same scaling as _fft, with scaling='power' and sides='one'
+        Sxy *= 1 / s_freq
+        if used_n_fft % 2:
+            Sxy[1:] *= 2
+        else:
+            # Last point is unpaired Nyquist freq point, don't double
+            Sxy[1:-1] *= 2
+        conn = Sxy
+
+    elif method == 'plv':
+        conn = abs(Sxy)
+
+    else:
+        Sxx = real(Sxy[:, arange(n_chan), arange(n_chan)])
+        Sxx_Syy = Sxx[:, :, None] * Sxx[:, None, :]
+        if method == 'coherence':
+            conn = abs(Sxy) ** 2 / Sxx_Syy
+        elif method == 'imcoh':
+            conn = imag(Sxy) / sqrt(Sxx_Syy)
+
+    output = ChanFreq()
+    output.attr = deepcopy(data[0].attr)
+    output.s_freq = s_freq
+    output.start_time = data[0].start_time
+    output.axis = OrderedDict()
+    for axis, values in (('chan', chan), ('chan2', chan), ('freq', freqs)):
+        output.axis[axis] = empty(1, dtype='O')
+        output.axis[axis][0] = values
+    output.data = empty(1, dtype='O')
+    output.data[0] = ascontiguousarray(moveaxis(conn, 0, -1))
+
+    return output
+
+
+def _tapered_fft(x, s_freq, taper, halfbandwidth, NW, detrend, n_fft):
+    """FFT of each channel, for each epoch and taper (see connectivity).
+
+    Parameters
+    ----------
+    x : ndarray
+        n_chan X n_epochs X n_samples
+
+    Returns
+    -------
+    int
+        length of the FFT
+    ndarray
+        frequency of each value in the last dimension
+    ndarray
+        n_chan X (n_epochs * n_tapers) X n_freq, complex
+    """
+    n_chan, n_epochs, n_smp = x.shape
+    if n_fft is None:
+        n_fft = n_smp
+
+    if taper is None:
+        taper = 'boxcar'
+    if taper == 'dpss' and NW is None:
+        NW = halfbandwidth * n_smp / s_freq
+
+    tapers = _get_tapers(n_smp, taper, NW, 'power', s_freq)
+    if x.dtype == 'float32':
+        tapers = tapers.astype('float32')
+
+    if detrend is not None:
+        x = detrend_func(x, axis=-1, type=detrend)
+
+    x_fft = sp_fft.rfft(tapers * x[..., None, :], n=n_fft)
+    freqs = np_fft.rfftfreq(n_fft, 1 / s_freq)
+
+    return n_fft, freqs, x_fft.reshape(n_chan, -1, len(freqs))
+
+
+def _add_cross_spectra(Sxy, x_fft):
+    """Add the cross-spectra of all the pairs of channels.
+
+    Parameters
+    ----------
+    Sxy : ndarray
+        n_freq X n_chan X n_chan, where to add the cross-spectra
+    x_fft : ndarray
+        n_freq X n_chan X n_repetitions, FFT of each channel
+    """
+    n_freq, n_chan = Sxy.shape[:2]
+    block = CONNECTIVITY_BLOCK // (n_freq * n_chan) or 1
+    # matmul uses BLAS only if each matrix is contiguous (or transposed)
+    x_fft = ascontiguousarray(x_fft)
+    x_t = swapaxes(x_fft, 1, 2)
+    for i0 in range(0, n_chan, block):
+        Sxy[:, i0:i0 + block, :] += x_fft[:, i0:i0 + block, :].conj() @ x_t
+
+
 def timefrequency(data, method='morlet', **options):
     """Compute the power spectrum over time.
 
@@ -231,6 +478,12 @@ def timefrequency(data, method='morlet', **options):
         zero_mean : bool
             make sure that the wavelet has zero mean (only relevant if ratio
             < 5)
+        n_jobs : int
+            number of threads used to compute the channels in parallel
+            (default: number of CPUs)
+        dtype : str
+            'complex128' (default) or 'complex64' (half the memory, useful
+            for many frequencies of interest)
 
     For method 'spectrogram' or 'stft', the following options should be specified:
         duraton : int
@@ -255,6 +508,8 @@ def timefrequency(data, method='morlet', **options):
                            'dur_in_s': None,
                            'normalization': 'area',
                            'zero_mean': False,
+                           'n_jobs': None,
+                           'dtype': 'complex128',
                            }
     elif method in ('spectrogram', 'stft'):
         default_options = {'duration': 1,
@@ -288,29 +543,17 @@ def timefrequency(data, method='morlet', **options):
         assert data.index_of('chan') == 0
         assert data.index_of('time') == 1
 
-        wavelets = _create_morlet(deepcopy(options), data.s_freq)
+        morlet_options = deepcopy(options)
+        n_jobs = morlet_options.pop('n_jobs')
+        dtype = morlet_options.pop('dtype')
+        wavelets = _create_morlet(morlet_options, data.s_freq)
 
         for i in range(data.number_of('trial')):
             lg.info('Processing trial # {0: 6}'.format(i))
             timefreq.axis['freq'][i] = array(options['foi'])
             timefreq.axis['time'][i] = data.axis['time'][i]
-
-            timefreq.data[i] = empty((data.number_of('chan')[i],
-                                      data.number_of('time')[i],
-                                      len(options['foi'])),
-                                     dtype='complex')
-
-            data_i = data(trial=i)
-            args = []
-            for i_chan in range(data.number_of('chan')[i]):
-                for wavelet in wavelets:
-                    args.append((i_chan, wavelet))
-
-            with Pool() as p:
-                result = p.starmap(partial(_convolve, dat=data_i), args)
-
-            tf = reshape(array(result), (data.number_of('chan')[i], len(wavelets), -1))
-            timefreq.data[i] = moveaxis(tf, 2, 1)
+            timefreq.data[i] = _morlet_transform(data.data[i], wavelets,
+                                                 n_jobs=n_jobs, dtype=dtype)
 
     elif method in ('spectrogram', 'stft'):  # TODO: add timeskip
         nperseg = int(options['duration'] * data.s_freq)
@@ -399,33 +642,55 @@ def band_power(data, freq, scaling='power', n_fft=None, detrend=None,
             detrend = None
 
     sf = Sxx.axis['freq'][0]
+    pw, pf = _band_power(Sxx.data[0], sf, freq)
+
+    for i, chan in enumerate(Sxx.axis['chan'][0]):
+        if array_out:
+            power[i, 0] = pw[i]
+            peakf[i, 0] = pf[i]
+        else:
+            power[chan] = pw[i]
+            peakf[chan] = pf[i]
+
+    return power, peakf
+
+
+def _band_power(Sxx, sf, freq):
+    """Power and peak frequency in a band, for spectra in the last dimension.
+
+    Parameters
+    ----------
+    Sxx : ndarray
+        spectral density, frequency as last dimension
+    sf : ndarray
+        frequency of each value in the last dimension of Sxx
+    freq : tuple of float
+        band of interest (see band_power)
+
+    Returns
+    -------
+    ndarray
+        power in the band, one value for each spectrum
+    ndarray
+        frequency of the peak in the band, one value for each spectrum
+    """
     f_res = sf[1] - sf[0]  # frequency resolution
 
     if freq[0] is not None:
-        idx_f1 = asarray([abs(x - freq[0]) for x in sf]).argmin()
+        idx_f1 = abs(sf - freq[0]).argmin()
     else:
         idx_f1 = 0
     if freq[1] is not None:
-        idx_f2 = min(asarray([abs(x - freq[1]) for x in sf]).argmin() + 1,
+        idx_f2 = min(abs(sf - freq[1]).argmin() + 1,
                      len(sf) - 1)  # inclusive, to follow convention
     else:
         idx_f2 = len(sf) - 1
 
-    for i, chan in enumerate(Sxx.axis['chan'][0]):
-        s = Sxx(chan=chan)[0]
-        pw = sum(s[idx_f1:idx_f2]) * f_res
+    s = Sxx[..., idx_f1:idx_f2]
+    pw = s.sum(axis=-1) * f_res
+    pf = sf[idx_f1:idx_f2][s.argmax(axis=-1)]
 
-        idx_peak = s[idx_f1:idx_f2].argmax()
-        pf = sf[idx_f1:idx_f2][idx_peak]
-
-        if array_out:
-            power[i, 0] = pw
-            peakf[i, 0] = pf
-        else:
-            power[chan] = pw
-            peakf[chan] = pf
-
-    return power, peakf
+    return pw, pf
 
 
 def _create_morlet(options, s_freq):
@@ -542,7 +807,8 @@ def morlet(freq, s_freq, ratio=5, sigma_f=None, dur_in_sd=4, dur_in_s=None,
 
 
 def _fft(x, s_freq, detrend='linear', taper=None, output='spectraldensity',
-         sides='one', scaling='power', halfbandwidth=4, NW=None, n_fft=None):
+         sides='one', scaling='power', halfbandwidth=4, NW=None, n_fft=None,
+         workers=None):
     """
     Core function taking care of computing the power spectrum / power spectral
     density or the complex representation.
@@ -578,6 +844,8 @@ def _fft(x, s_freq, detrend='linear', taper=None, output='spectraldensity',
         Length of FFT, in samples. If less than input axis, input is cropped.
         If longer than input axis, input is padded with zeros. If None, FFT
         length set to axis length.
+    workers : int
+        number of threads used to compute the FFT (see scipy.fft)
 
     Returns
     -------
@@ -646,36 +914,21 @@ def _fft(x, s_freq, detrend='linear', taper=None, output='spectraldensity',
 
     if taper is None:
         taper = 'boxcar'
+    if taper == 'dpss' and NW is None:
+        NW = halfbandwidth * n_smp / s_freq
 
-    if taper == 'dpss':
-        if NW is None:
-            NW = halfbandwidth * n_smp / s_freq
-        tapers, eig = dpss_windows(n_smp, NW, 2 * NW - 1)
-        if scaling == 'chronux':
-            tapers *= sqrt(s_freq)
-
-    else:
-        if taper == 'hann':
-            tapers = windows.hann(n_smp, sym=False)[None, :]
-        else:
-            # TODO: it'd be nice to use sym=False if possible, but the difference is very small
-            tapers = get_window(taper, n_smp)[None, :]
-
-        if scaling == 'energy':
-            rms = sqrt(mean(tapers ** 2))
-            tapers /= rms * sqrt(n_smp)
-        elif scaling != 'chronux':
-            # idk how chronux treats other windows apart from dpss
-            tapers /= norm(tapers)
+    tapers = _get_tapers(n_smp, taper, NW, scaling, s_freq)
+    if x.dtype == 'float32':
+        tapers = tapers.astype('float32')
 
     if detrend is not None:
         x = detrend_func(x, axis=axis, type=detrend)
     tapered = tapers * x[..., None, :]
 
     if sides == 'one':
-        result = np_fft.rfft(tapered, n=n_fft)
+        result = sp_fft.rfft(tapered, n=n_fft, workers=workers)
     elif sides == 'two':
-        result = fftpack.fft(tapered, n=n_fft)
+        result = sp_fft.fft(tapered, n=n_fft, workers=workers)
 
     if scaling == 'chronux':
         result /= s_freq
@@ -720,6 +973,133 @@ def _fft(x, s_freq, detrend='linear', taper=None, output='spectraldensity',
     return freqs, result
 
 
-def _convolve(i_chan, wavelet, dat):
-    tf = fftconvolve(dat[i_chan, :], wavelet, 'same')
-    return tf
+@lru_cache(maxsize=32)
+def _get_tapers(n_smp, taper, NW, scaling, s_freq):
+    """Compute the tapers, only once for each combination of parameters.
+
+    Parameters
+    ----------
+    n_smp : int
+        number of samples
+    taper : str
+        'dpss', 'hann' or any window in scipy.signal.get_window
+    NW : float
+        (only if taper='dpss') normalized half bandwidth
+    scaling : str
+        scaling of the tapers, see _fft
+    s_freq : float
+        sampling frequency (only used for 'chronux' scaling)
+
+    Returns
+    -------
+    ndarray
+        n_tapers X n_smp, read-only because it's shared between calls
+    """
+    if taper == 'dpss':
+        tapers, eig = dpss_windows(n_smp, NW, 2 * NW - 1)
+        if scaling == 'chronux':
+            tapers *= sqrt(s_freq)
+
+    else:
+        if taper == 'hann':
+            tapers = windows.hann(n_smp, sym=False)[None, :]
+        else:
+            # TODO: it'd be nice to use sym=False if possible, but the difference is very small
+            tapers = get_window(taper, n_smp)[None, :]
+
+        if scaling == 'energy':
+            rms = sqrt(mean(tapers ** 2))
+            tapers /= rms * sqrt(n_smp)
+        elif scaling != 'chronux':
+            # idk how chronux treats other windows apart from dpss
+            tapers /= norm(tapers)
+
+    tapers.setflags(write=False)
+    return tapers
+
+
+def _morlet_transform(dat, wavelets, n_jobs=None, dtype='complex128'):
+    """Convolve each channel with each wavelet, in the frequency domain.
+
+    Parameters
+    ----------
+    dat : ndarray
+        n_chan X n_samples
+    wavelets : list of ndarray
+        complex wavelets (see _create_morlet)
+    n_jobs : int
+        number of threads (channels are computed in parallel)
+    dtype : str
+        'complex128' or 'complex64'
+
+    Returns
+    -------
+    ndarray
+        n_chan X n_samples X n_wavelets, the same as
+        fftconvolve(dat[i_chan], wavelet, 'same') for each channel and wavelet
+
+    Notes
+    -----
+    The wavelets are grouped by the length of the FFT they need. For each
+    group, the FFT of each channel is computed only once and it is then
+    multiplied by the FFT of all the wavelets in the group at the same time.
+    The FFT of the wavelets is computed only once for all the channels. The
+    threads write directly into the output.
+    """
+    n_chan, n_smp = dat.shape
+    real_dtype = 'float32' if dtype == 'complex64' else 'float64'
+
+    # wavelets of similar length (same power of two) share the FFT length
+    groups = {}
+    for i_w, w in enumerate(wavelets):
+        n_fft = sp_fft.next_fast_len(n_smp + 2 ** int(ceil(log2(len(w)))) - 1)
+        groups.setdefault(n_fft, []).append(i_w)
+
+    plan = []
+    for n_fft, idx_w in groups.items():
+        w_fft = sp_fft.fft(_pad_wavelets([wavelets[i] for i in idx_w], dtype),
+                           n_fft, axis=-1)
+        # where the center of the convolution ('same') starts
+        start = [(len(wavelets[i]) - 1) // 2 for i in idx_w]
+        plan.append((n_fft, idx_w, w_fft, start))
+
+    output = empty((n_chan, len(wavelets), n_smp), dtype=dtype)
+
+    def _one_chan(i_chan):
+        x = dat[i_chan].astype(real_dtype, copy=False)
+        for n_fft, idx_w, w_fft, start in plan:
+            x_fft = sp_fft.fft(x, n_fft)
+            block = max((MORLET_BLOCK // n_fft, 1))
+            for i0 in range(0, len(idx_w), block):
+                tf = sp_fft.ifft(x_fft * w_fft[i0:i0 + block], axis=-1)
+                for i, one_tf in enumerate(tf, start=i0):
+                    output[i_chan, idx_w[i], :] = one_tf[start[i]:
+                                                         start[i] + n_smp]
+
+    executor, _ = _get_executor(n_jobs)
+    list(executor.map(_one_chan, range(n_chan)))
+
+    return moveaxis(output, 2, 1)
+
+
+def _pad_wavelets(wavelets, dtype):
+    """Put all the wavelets in one matrix, padded with zeros at the end."""
+    padded = zeros((len(wavelets), max([len(w) for w in wavelets])),
+                   dtype=dtype)
+    for i, w in enumerate(wavelets):
+        padded[i, :len(w)] = w
+    return padded
+
+
+def _get_executor(n_jobs=None):
+    """Return a pool of threads and its number of threads.
+
+    The pools are kept alive between calls, one for each number of threads,
+    and never shut down, because other threads may be using them.
+    """
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    with _executors_lock:
+        if n_jobs not in _executors:
+            _executors[n_jobs] = ThreadPoolExecutor(max_workers=n_jobs)
+        return _executors[n_jobs], n_jobs
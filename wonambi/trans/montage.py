@@ -1,14 +1,19 @@
+from functools import lru_cache
 from logging import getLogger
 
 from numpy import (asarray,
                    c_,
-                   dot,
+                   full,
+                   hstack,
                    mean,
                    moveaxis,
+                   NaN,
+                   ones,
                    where,
                    zeros,
                    )
 from numpy.linalg import norm, lstsq
+from scipy.sparse import csr_matrix, identity, vstack as sparse_vstack
 
 from ..attr import Channels
 
@@ -16,7 +21,7 @@ lg = getLogger(__name__)
 
 
 def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None,
-            method='average'):
+            method='average', virtual=None):
     """Apply linear transformation to the channels.
 
     Parameters
@@ -35,6 +40,9 @@ def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None,
         average across the channels selected as reference (it can be all) and
         subtract it from each channel. 'regression' keeps the residuals after
         regressing out the mean across channels.
+    virtual : dict, optional
+        name of the virtual channel as key and list of channels to average as
+        value. Virtual channels are added after the other channels.
 
     Returns
     -------
@@ -44,6 +52,10 @@ def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None,
     Notes
     -----
     If you don't change anything, it returns the same instance of data.
+
+    With method 'average', all the transformations are compiled into one
+    linear operator (see compile_montage), which is cached and applied to each
+    trial.
     """
     if ref_to_avg and ref_chan is not None:
         raise TypeError('You cannot specify reference to the average and '
@@ -57,46 +69,210 @@ def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None,
     if ref_chan is None:
         ref_chan = []  # TODO: check bool for ref_chan
 
+    chan = None
     if bipolar:
         if not data.attr['chan']:
             raise ValueError('Data should have Chan information in attr')
 
         _assert_equal_channels(data.axis['chan'])
+        if not data.index_of('chan') == 0:
+            raise ValueError('For matrix multiplication to work, '
+                             'the first dimension should be chan')
         chan_in_data = data.axis['chan'][0]
         chan = data.attr['chan']
         chan = chan(lambda x: x.label in chan_in_data)
-        chan, trans = create_bipolar_chan(chan, bipolar)
-        data.attr['chan'] = chan
 
-    if ref_to_avg or ref_chan or bipolar:
-        mdata = data._copy()
+    if not (ref_to_avg or ref_chan or bipolar or virtual):
+        return data
 
-        idx_chan = mdata.index_of('chan')
+    mdata = data._copy()
+    idx_chan = mdata.index_of('chan')
 
-        for i in range(mdata.number_of('trial')):
-            if ref_to_avg or ref_chan:
-                if ref_to_avg:
-                    ref_chan = data.axis['chan'][i]
+    operator = None
+    for i in range(mdata.number_of('trial')):
+        if method == 'regression' and (ref_to_avg or ref_chan):
+            mdata.data[i] = compute_average_regress(data(trial=i), idx_chan)
+            continue
 
-                ref_data = data(trial=i, chan=ref_chan)
-                if method == 'average':
-                    mdata.data[i] = (data(trial=i) - mean(ref_data, axis=idx_chan))
-                elif method == 'regression':
-                    mdata.data[i] = compute_average_regress(data(trial=i), idx_chan)
+        operator = compile_montage(data.axis['chan'][i], ref_chan=ref_chan,
+                                   ref_to_avg=ref_to_avg, bipolar=bipolar,
+                                   chan=chan, virtual=virtual)
+        mdata.data[i] = operator(data.data[i], axis=idx_chan)
+        mdata.axis['chan'][i] = asarray(operator.labels, dtype='U')
 
-            elif bipolar:
+    if bipolar and operator is not None:
+        mdata.attr['chan'] = operator.chan
+
+    return mdata
 
-                if not data.index_of('chan') == 0:
-                    raise ValueError('For matrix multiplication to work, '
-                                     'the first dimension should be chan')
-                mdata.data[i] = dot(trans, data(trial=i))
-                mdata.axis['chan'][i] = asarray(chan.return_label(),
-                                                dtype='U')
 
+class MontageOperator:
+    """Linear transformation of the channels, created by compile_montage.
+
+    Parameters
+    ----------
+    matrix : instance of scipy.sparse.csr_matrix
+        n_output_chan X n_input_chan matrix, without the reference
+    offset : ndarray
+        for each output channel, how many times the reference is subtracted
+    idx_ref : ndarray
+        index of the input channels whose mean is the reference
+    labels : list of str
+        labels of the output channels
+    chan : instance of Channels, optional
+        position of the output channels (only for bipolar)
+
+    Notes
+    -----
+    The output is computed as matrix @ x - outer(offset, reference), so that
+    the reference (which is shared by all the channels) is computed once
+    and the matrix remains sparse, even for the average reference.
+    """
+    def __init__(self, matrix, offset, idx_ref, labels, chan=None,
+                 ref_missing=False):
+        self.matrix = matrix
+        self.offset = offset
+        self.idx_ref = idx_ref
+        self.labels = labels
+        self.chan = chan
+        self.ref_missing = ref_missing
+        self.is_identity = (matrix.shape[0] == matrix.shape[1] and
+                            (matrix != identity(matrix.shape[0])).nnz == 0)
+
+    def __call__(self, x, axis=0):
+        """Apply the transformation to the data.
+
+        Parameters
+        ----------
+        x : ndarray
+            data, with any number of dimensions (f.e. chan X time or
+            trial X chan X time)
+        axis : int
+            index of the dimension with the channels
+
+        Returns
+        -------
+        ndarray
+            transformed data, with the output channels in dimension "axis"
+        """
+        x = moveaxis(x, axis, 0)
+        shape = x.shape
+        x = x.reshape(shape[0], -1)
+
+        if self.is_identity:
+            y = x.copy()
+        else:
+            y = self.matrix @ x
+
+        if self.offset.any():
+            if self.ref_missing:
+                ref = full(x.shape[1], NaN)
+            else:
+                ref = mean(x[self.idx_ref, :], axis=0)
+            y -= self.offset[:, None] * ref[None, :]
+
+        y = y.reshape((y.shape[0], ) + shape[1:])
+        return moveaxis(y, 0, axis)
+
+
+def compile_montage(labels, ref_chan=None, ref_to_avg=False, bipolar=None,
+                    chan=None, virtual=None):
+    """Convert the montage into one linear operator.
+
+    Parameters
+    ----------
+    labels : list of str
+        labels of the channels in the data
+    ref_chan : list of str
+        list of channels used as reference
+    ref_to_avg : bool
+        if re-reference to average or not
+    bipolar : float
+        distance in mm to consider two channels as neighbors and then compute
+        the bipolar montage between them.
+    chan : instance of Channels
+        position of the channels (only for bipolar)
+    virtual : dict, optional
+        name of the virtual channel as key and list of channels to average as
+        value.
+
+    Returns
+    -------
+    instance of MontageOperator
+        it can be applied to data with operator(x, axis=idx_chan)
+
+    Notes
+    -----
+    The operators are cached, so that the same montage (f.e. on each page of
+    the GUI or for each segment) is only compiled once.
+    """
+    if ref_chan is None:
+        ref_chan = []
+    if chan is not None:
+        chan_key = tuple((one_chan.label, tuple(one_chan.xyz))
+                         for one_chan in chan.chan)
+    else:
+        chan_key = None
+    if virtual is not None:
+        virtual = tuple((k, tuple(v)) for k, v in virtual.items())
+
+    return _compile_montage(tuple(labels), tuple(ref_chan), ref_to_avg,
+                            bipolar, chan_key, virtual)
+
+
+@lru_cache(maxsize=128)
+def _compile_montage(labels, ref_chan, ref_to_avg, bipolar, chan_key,
+                     virtual):
+    """Hashable version of compile_montage."""
+    n_chan = len(labels)
+    idx_label = {label: i for i, label in enumerate(labels)}
+
+    if ref_to_avg:
+        ref_chan = labels
+    ref_missing = any(label not in idx_label for label in ref_chan)
+    if ref_missing:
+        lg.warning('Reference channels missing from the data: ' +
+                   ', '.join(x for x in ref_chan if x not in idx_label))
+    idx_ref = asarray([idx_label[label] for label in ref_chan
+                       if label in idx_label], dtype=int)
+
+    # each channel minus the reference
+    matrix = identity(n_chan, format='csr')
+    if ref_chan:
+        offset = ones(n_chan)
     else:
-        mdata = data
+        offset = zeros(n_chan)
+    out_labels = list(labels)
+    out_chan = None
 
-    return mdata
+    if bipolar:
+        chan = Channels([x[0] for x in chan_key],
+                        asarray([x[1] for x in chan_key]).reshape(-1, 3))
+        out_chan, trans = create_bipolar_chan(chan, bipolar)
+        # columns of trans follow the order of the channels in chan
+        idx_col = [idx_label[one_chan.label] for one_chan in chan.chan]
+        bipolar_matrix = zeros((trans.shape[0], n_chan))
+        bipolar_matrix[:, idx_col] = trans
+        bipolar_matrix = csr_matrix(bipolar_matrix)
+
+        offset = bipolar_matrix @ offset
+        matrix = bipolar_matrix
+        out_labels = out_chan.return_label()
+
+    if virtual:
+        virtual_matrix = zeros((len(virtual), n_chan))
+        for i, (_, virtual_chan) in enumerate(virtual):
+            idx = [idx_label[label] for label in virtual_chan]
+            virtual_matrix[i, idx] = 1 / len(idx)
+
+        # virtual channels are the average of the re-referenced channels
+        offset = hstack((offset, virtual_matrix.sum(axis=1) * bool(ref_chan)))
+        matrix = sparse_vstack((matrix, csr_matrix(virtual_matrix)),
+                               format='csr')
+        out_labels = list(out_labels) + [x[0] for x in virtual]
+
+    return MontageOperator(matrix, offset, idx_ref, out_labels, out_chan,
+                           ref_missing)
 
 
 def _assert_equal_channels(axis):
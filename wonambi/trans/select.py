@@ -9,15 +9,20 @@ content of the data.
 Select should be as flexible as possible. There are quite a few cases, which
 will be added as we need them.
 """
+from collections import deque
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
 from logging import getLogger
 
-from numpy import (arange, array, asarray, diff, empty, hstack, inf, 
-                   issubsctype, linspace, nan_to_num, ndarray, ones, ravel, 
-                   setdiff1d, floor)
+from numpy import (arange, array, asarray, count_nonzero, cumsum, diff, empty,
+                   inf, issubsctype, linspace, memmap, moveaxis, nan_to_num,
+                   ndarray, ones, ravel, setdiff1d, floor, zeros)
 from numpy.lib.stride_tricks import as_strided
-from math import isclose
-from scipy.signal import resample as sci_resample
+from math import ceil, isclose
+from pathlib import Path
+from scipy.signal import firwin, resample_poly, resample as sci_resample
 
 try:
     from PyQt5.QtCore import Qt
@@ -32,6 +37,11 @@ from .reject import remove_artf_evts
 
 lg = getLogger(__name__)
 
+# subsegments separated by fewer samples than this are read together
+MAX_GAP = 256
+# maximum number of values (channels X samples) in one read
+MAX_READ = 2 ** 24
+
 
 class Segments():
     """Class containing a set of data segments for analysis, with metadata.
@@ -46,23 +56,80 @@ class Segments():
         about start and end times, stage, cycle, channel and event name, if
         applicable. Once read_data is called, the signal data are added to each
         segment dictionary under 'data'.
+    transform : function, optional
+        only if read_data was called with lazy=True. It's called with each
+        segment (dict) after reading its data and it should return the
+        segment (f.e. with the filtered data as 'trans_data').
     """
     def __init__(self, dataset):
         self.dataset = dataset
         self.segments = []
+        self.transform = None
+        self._read_options = None
 
     def __iter__(self):
-        for one_event in self.segments:
-            yield one_event
+        if self._read_options is None:
+            for one_event in self.segments:
+                yield one_event
+        else:
+            yield from self.iter_data(**self._read_options)
 
     def __len__(self):
         return len(self.segments)
 
     def __getitem__(self, index):
-        return self.segments[index]
+        if self._read_options is None:
+            return self.segments[index]
+
+        options = dict(self._read_options)
+        options.pop('prefetch')
+        seg = self._read_segments([self.segments[index]], **options)[0]
+        if self.transform is not None:
+            seg = self.transform(seg)
+        return seg
+
+    @property
+    def lazy(self):
+        """True if the data is read only while iterating over the segments."""
+        return self._read_options is not None
+
+    def signal_size(self, chan=[], max_s_freq=30000):
+        """Number of values (channels X samples) that read_data would read.
+
+        Parameters
+        ----------
+        chan, max_s_freq
+            see read_data
+
+        Returns
+        -------
+        int
+            number of values, for all the segments
+        """
+        s_freq = _decimated_s_freq(self.dataset.header['s_freq'], max_s_freq)
+        return sum(_segment_size(seg, chan, s_freq) for seg in self.segments)
+
+    def n_samples(self, max_s_freq=30000):
+        """Number of samples in each segment that read_data would read (only
+        from the times of the segments, the signal is not read).
+
+        Parameters
+        ----------
+        max_s_freq
+            see read_data
+
+        Returns
+        -------
+        list of int
+            number of samples, for each segment
+        """
+        q = _decimation_factor(self.dataset.header['s_freq'], max_s_freq)
+        return [sum(_n_samples(self.dataset, seg['times'], q))
+                for seg in self.segments]
 
     def read_data(self, chan=[], ref_chan=[], grp_name=None, concat_chan=False,
-                  average_channels=False, max_s_freq=30000, parent=None):
+                  average_channels=False, max_s_freq=30000, parent=None,
+                  workers=None, lazy=False, prefetch=2):
         """Read data for analysis. Adds data as 'data' in each dict.
 
         Parameters
@@ -85,71 +152,242 @@ class Segments():
         parent : QWidget
             for GUI only. Identifies parent widget for display of progress
             dialog.
+        workers : int, optional
+            number of threads reading from the dataset at the same time (it
+            helps if the file is on network storage). The reader of the
+            dataset should support concurrent reads.
+        lazy : bool
+            if True, the data is not read now, but only while iterating over
+            the segments (see iter_data), so that only a few segments are in
+            memory at the same time. Each iteration reads the data again.
+        prefetch : int
+            (only if lazy) number of batches of segments read in advance
+
+        Notes
+        -----
+        The subsegments are sorted and the ones that are close to each other
+        are read with one call to the dataset (see _plan_reads), then the
+        signal of each subsegment is copied directly in the preallocated data
+        of its segment.
         """
-        output = []
+        options = {'chan': chan,
+                   'ref_chan': ref_chan,
+                   'grp_name': grp_name,
+                   'concat_chan': concat_chan,
+                   'average_channels': average_channels,
+                   'max_s_freq': max_s_freq,
+                   'workers': workers,
+                   }
+
+        if lazy:
+            options['prefetch'] = prefetch
+            self._read_options = options
+            return 1 # for GUI
+
+        output = self._read_segments(self.segments, parent=parent, **options)
+        if output is None:
+            return
+
+        self._read_options = None
+        self.segments = output
+
+        return 1 # for GUI
+
+    def iter_data(self, chan=[], ref_chan=[], grp_name=None, concat_chan=False,
+                  average_channels=False, max_s_freq=30000, workers=None,
+                  prefetch=2):
+        """Read the data one batch of segments at a time and yield each segment
+        with its data, without storing them.
+
+        Parameters
+        ----------
+        chan, ref_chan, grp_name, concat_chan, average_channels, max_s_freq,
+        workers
+            see read_data
+        prefetch : int
+            number of batches of segments read in advance by a background
+            thread, while the previous segments are analyzed. If 0, each batch
+            is read when it's needed.
+
+        Yields
+        ------
+        dict
+            segment with 'data', 'chan', 'stage', 'cycle', 'name', 'n_stitch'
+            (as in read_data). If the attribute "transform" is not None, the
+            segment is passed through it.
+
+        Notes
+        -----
+        Each batch contains consecutive segments, up to MAX_READ values, so the
+        memory depends on prefetch but not on the number of segments.
+        """
+        options = {'chan': chan,
+                   'ref_chan': ref_chan,
+                   'grp_name': grp_name,
+                   'concat_chan': concat_chan,
+                   'average_channels': average_channels,
+                   'max_s_freq': max_s_freq,
+                   'workers': workers,
+                   }
+        s_freq = _decimated_s_freq(self.dataset.header['s_freq'], max_s_freq)
+
+        batches = []
+        batch_size = 0
+        for seg in self.segments:
+            size = _segment_size(seg, chan, s_freq)
+            if not batches or batch_size + size > MAX_READ:
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(seg)
+            batch_size += size
+
+        if prefetch < 1:
+            for batch in batches:
+                yield from self._transformed(
+                    self._read_segments(batch, **options))
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(executor.submit(self._read_segments, batch,
+                                               **options))
+                if len(pending) > prefetch:
+                    yield from self._transformed(pending.popleft().result())
+            while pending:
+                yield from self._transformed(pending.popleft().result())
+
+        finally:
+            for f in pending:
+                f.cancel()
+            executor.shutdown()
+
+    def _transformed(self, segments):
+        for seg in segments:
+            if self.transform is not None:
+                seg = self.transform(seg)
+            yield seg
+
+    def _read_segments(self, segments, chan, ref_chan, grp_name, concat_chan,
+                       average_channels, max_s_freq, workers, parent=None):
+        """Read the data of some segments (see read_data).
+
+        Returns
+        -------
+        list of dict
+            segments with 'data', or None if canceled by the user
+        """
+        s_freq = self.dataset.header['s_freq']
+        # Downsample if necessary
+        q = _decimation_factor(s_freq, max_s_freq)
+        if q > 1:
+            lg.debug('Decimate (no low-pass filter) at ' + str(q))
+            s_freq = int(s_freq / q)
+
+        # subsegments with the same channels are read together
+        to_read = {}
+        all_active_chan = []
+        for i, seg in enumerate(segments):
+            # if channel not specified, use segment channel
+            if chan:
+                active_chan = chan
+            elif seg['chan']:
+                active_chan = [seg['chan'].split(' (')[0]]
+            else:
+                t0, t1 = seg['times'][0]
+                raise ValueError('No channel was specified and the '
+                                 'segment at {}-{} has no channel.'.format(
+                                         t0, t1))
+            all_active_chan.append(active_chan)
+
+            subseg = to_read.setdefault(tuple(active_chan), [])
+            subseg.extend((i, j) for j in range(len(seg['times'])))
+
+        # preallocate the data of each segment
+        seg_data = []
+        offsets = []
+        for seg, active_chan in zip(segments, all_active_chan):
+            begsam = self.dataset._convert_to_list_with_samples(
+                [t0 for t0, t1 in seg['times']])
+            endsam = self.dataset._convert_to_list_with_samples(
+                [t1 for t0, t1 in seg['times']])
+            n_smp = [len(range(b, e, q)) for b, e in zip(begsam, endsam)]
+            offsets.append(list(zip(begsam, endsam,
+                                    cumsum([0] + n_smp[:-1]))))
+
+            one_segment = ChanTime()
+            one_segment.s_freq = s_freq
+            one_segment.axis['chan'] = empty(1, dtype='O')
+            one_segment.axis['time'] = empty(1, dtype='O')
+            one_segment.axis['time'][0] = empty(sum(n_smp))
+            one_segment.data = empty(1, dtype='O')
+            one_segment.data[0] = empty((len(active_chan), sum(n_smp)),
+                                        dtype='f')
+            seg_data.append(one_segment)
+
+        reads = []
+        for active_chan, subseg in to_read.items():
+            ranges = [offsets[i][j][:2] for i, j in subseg]
+            for begsam, endsam, idx in _plan_reads(ranges, len(active_chan) +
+                                                   len(ref_chan)):
+                reads.append((list(active_chan), begsam, endsam,
+                              [subseg[k] for k in idx]))
+
+        def _read(one_read):
+            active_chan, begsam, endsam, subseg = one_read
+            data = self.dataset.read_data(chan=active_chan + ref_chan,
+                                          begsam=begsam, endsam=endsam)
+            data = _create_data(data, active_chan, ref_chan=ref_chan,
+                                grp_name=grp_name)
+            for i, j in subseg:
+                b, e, offset = offsets[i][j]
+                sel = slice(b - begsam, e - begsam, q)
+                n_smp = len(range(b, e, q))
+                x = seg_data[i]
+                x.data[0][:, offset:offset + n_smp] = data.data[0][:, sel]
+                x.axis['time'][0][offset:offset + n_smp] = \
+                    data.axis['time'][0][sel]
+                x.axis['chan'][0] = data.axis['chan'][0]
+            return len(subseg)
 
         # Set up Progress Bar
         if parent:
-            n_subseg = sum([len(x['times']) for x in self.segments])
+            n_subseg = sum([len(x['times']) for x in segments])
             progress = QProgressDialog('Fetching signal', 'Abort', 0, n_subseg,
                                        parent)
             progress.setWindowModality(Qt.ApplicationModal)
             counter = 0
 
-        # Begin bundle loop; will yield one segment per loop
-        for i, seg in enumerate(self.segments):
-            one_segment = ChanTime()
-            one_segment.axis['chan'] = empty(1, dtype='O')
-            one_segment.axis['time'] = empty(1, dtype='O')
-            one_segment.data = empty(1, dtype='O')
-            subseg = []
+        executor = None
+        if workers is None or workers <= 1:
+            results = map(_read, reads)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = [executor.submit(_read, x) for x in reads]
+            results = (f.result() for f in futures)
 
-            # Subsegment loop; subsegments will be concatenated
-            for t0, t1 in seg['times']:
+        try:
+            for n_subseg in results:
                 if parent:
+                    counter += n_subseg
                     progress.setValue(counter)
-                    counter += 1
-
-                # if channel not specified, use segment channel
-                if chan:
-                    active_chan = chan
-                elif seg['chan']:
-                    active_chan = [seg['chan'].split(' (')[0]]
-                else:
-                    raise ValueError('No channel was specified and the '
-                                     'segment at {}-{} has no channel.'.format(
-                                             t0, t1))
-                active_chan = chan if chan else [seg['chan'].split(' (')[0]]
-                chan_to_read = active_chan + ref_chan
-
-                data = self.dataset.read_data(chan=chan_to_read, begtime=t0,
-                                         endtime=t1)
-
-                # Downsample if necessary
-                if data.s_freq > max_s_freq:
-                    q = int(data.s_freq / max_s_freq)
-                    lg.debug('Decimate (no low-pass filter) at ' + str(q))
-
-                    data.data[0] = data.data[0][:, slice(None, None, q)]
-                    data.axis['time'][0] = data.axis['time'][0][slice(
-                            None, None, q)]
-                    data.s_freq = int(data.s_freq / q)
-
-                # read data from disk
-                subseg.append(_create_data(
-                    data, active_chan, ref_chan=ref_chan, grp_name=grp_name))
-
-            one_segment.s_freq = s_freq = data.s_freq
-            one_segment.axis['chan'][0] = chs = subseg[0].axis['chan'][0]
-            one_segment.axis['time'][0] = timeline = hstack(
-                    [x.axis['time'][0] for x in subseg])
-            one_segment.data[0] = empty((len(active_chan), len(timeline)),
-                                        dtype='f')
-            n_stitch = sum(asarray(diff(timeline) > 2/s_freq, dtype=bool))
+                    if progress.wasCanceled():
+                        parent.parent.statusBar().showMessage(
+                            'Process canceled by user.')
+                        return
+        finally:
+            if executor is not None:
+                for f in futures:
+                    f.cancel()
+                executor.shutdown()
 
-            for i, ch in enumerate(subseg[0].axis['chan'][0]):
-                    one_segment.data[0][i, :] = hstack(
-                            [x(chan=ch)[0] for x in subseg])
+        output = []
+        for one_segment, seg, active_chan in zip(seg_data, segments,
+                                                 all_active_chan):
+            chs = one_segment.axis['chan'][0]
+            timeline = one_segment.axis['time'][0]
+            n_stitch = count_nonzero(diff(timeline) > 2/s_freq)
 
             if average_channels:
                 one_segment.data[0] = one_segment.data[0].mean(0, 
@@ -165,6 +403,7 @@ class Segments():
                 # axis['time'] should not be used in this case
 
             output.append({'data': one_segment,
+                           'times': seg['times'],
                            'chan': active_chan,
                            'stage': seg['stage'],
                            'cycle': seg['cycle'],
@@ -172,18 +411,76 @@ class Segments():
                            'n_stitch': n_stitch
                            })
 
-            if parent:
-                if progress.wasCanceled():
-                    parent.parent.statusBar().showMessage('Process canceled by'
-                                           ' user.')
-                    return
-
         if parent:
             progress.setValue(counter)
 
-        self.segments = output
+        return output
 
-        return 1 # for GUI
+
+def _decimated_s_freq(s_freq, max_s_freq):
+    """Sampling frequency after decimation in Segments.read_data."""
+    if s_freq > max_s_freq:
+        s_freq = int(s_freq / int(s_freq / max_s_freq))
+    return s_freq
+
+
+def _decimation_factor(s_freq, max_s_freq):
+    """Decimation factor in Segments.read_data."""
+    if s_freq > max_s_freq:
+        return int(s_freq / max_s_freq)
+    return 1
+
+
+def _n_samples(dataset, times, q):
+    """Number of samples in each subsegment, after decimation by q."""
+    begsam = dataset._convert_to_list_with_samples([t0 for t0, t1 in times])
+    endsam = dataset._convert_to_list_with_samples([t1 for t0, t1 in times])
+    return [len(range(b, e, q)) for b, e in zip(begsam, endsam)]
+
+
+def _segment_size(seg, chan, s_freq):
+    """Approximate number of values (channels X samples) in one segment."""
+    n_chan = len(chan) if chan else 1
+    duration = sum(t1 - t0 for t0, t1 in seg['times'])
+    return int(duration * s_freq) * n_chan
+
+
+def _plan_reads(ranges, n_chan):
+    """Merge the time ranges that are close to each other into longer reads.
+
+    Parameters
+    ----------
+    ranges : list of tuple of int
+        first and last sample (not included) of each subsegment
+    n_chan : int
+        number of channels to read
+
+    Returns
+    -------
+    list of tuple
+        for each read, the first sample, the last sample (not included) and
+        the indices of the ranges which are inside it, sorted by time.
+
+    Notes
+    -----
+    Ranges which overlap or are separated by less than MAX_GAP samples are
+    read together, as long as the read is not larger than MAX_READ values.
+    """
+    max_smp = max(MAX_READ // max(n_chan, 1), 1)
+
+    reads = []
+    for i in sorted(range(len(ranges)), key=lambda i: ranges[i]):
+        begsam, endsam = ranges[i]
+        if reads:
+            last = reads[-1]
+            if (begsam - last[1] <= MAX_GAP and
+                    max(endsam, last[1]) - last[0] <= max_smp):
+                last[1] = max(endsam, last[1])
+                last[2].append(i)
+                continue
+        reads.append([begsam, endsam, [i, ]])
+
+    return [tuple(x) for x in reads]
 
 
 def select(data, trial=None, invert=False, **axes_to_select):
@@ -279,7 +576,7 @@ def select(data, trial=None, invert=False, **axes_to_select):
     return output
 
 
-def resample(data, s_freq, axis='time'):
+def resample(data, s_freq, axis='time', method='fft', chunk_duration=None):
     """Downsample the data after applying a filter.
 
     Parameters
@@ -290,39 +587,261 @@ def resample(data, s_freq, axis='time'):
         desired sampling frequency
     axis : str
         axis you want to apply downsample on (most likely 'time')
+    method : str
+        'fft' (scipy.signal.resample, which assumes that the signal is
+        periodic) or 'polyphase' (scipy.signal.resample_poly, with FIR
+        anti-aliasing filter)
+    chunk_duration : float, optional
+        only for 'polyphase', resample the data in chunks of this duration
+        (in s of the original data), to limit memory use on long recordings
 
     Returns
     -------
     instance of Data
         downsampled data
+
+    Notes
+    -----
+    The 'polyphase' method approximates the ratio between the new and the
+    old sampling frequency with a fraction (up / down). It is much faster than
+    'fft' on long recordings and does not wrap around at the edges.
     """
     output = data._copy()
+    idx_axis = data.index_of(axis)
+
+    if method == 'polyphase':
+        up, down = rational_factors(data.s_freq, s_freq)
+        lg.debug('Resampling with up={0}, down={1}'.format(up, down))
+        if chunk_duration is None:
+            block = None
+        else:
+            block = int(chunk_duration * data.s_freq)
+
+    elif method != 'fft':
+        raise ValueError('Unknown method: ' + method)
 
     for i in range(data.number_of('trial')):
-        # check if the ratio between old and new data is not an integer
-        out_samples = int(floor(data.number_of('time')[i] / data.s_freq * s_freq))
-        orig_samples = int(out_samples / s_freq * data.s_freq)
 
-        # if so, then skip the last data points
-        interval = (data.axis[axis][i][0], data.axis[axis][i][orig_samples - 1])
-        x = data(trial=i, axis=interval)
+        if method == 'fft':
+            out_samples = int(floor(data.number_of('time')[i] / data.s_freq
+                                    * s_freq))
+            output.data[i] = sci_resample(
+                data.data[i],
+                out_samples,
+                axis=idx_axis)
 
-        output.data[i] = sci_resample(
-            data.data[i],
-            out_samples,
-            axis=data.index_of(axis))
+            n_samples = output.data[i].shape[idx_axis]
+            output.axis[axis][i] = linspace(data.axis[axis][i][0],
+                                            data.axis[axis][i][-1]
+                                            + 1 / data.s_freq,
+                                            n_samples)
 
-        n_samples = output.data[i].shape[data.index_of(axis)]
-        output.axis[axis][i] = linspace(data.axis[axis][i][0],
-                                        data.axis[axis][i][-1]
-                                        + 1 / data.s_freq,
-                                        n_samples)
+        else:
+            x = moveaxis(data.data[i], idx_axis, -1)
+            if block is None:
+                y = resample_poly(x, up, down, axis=-1,
+                                  window=design_antialias(up, down))
+            else:
+                y = resample_blocks(lambda beg, end: x[..., beg:end],
+                                    x.shape[-1], up, down, block)
+            output.data[i] = moveaxis(y, -1, idx_axis)
+
+            n_samples = output.data[i].shape[idx_axis]
+            output.axis[axis][i] = (data.axis[axis][i][0] +
+                                    arange(n_samples) / s_freq)
 
     output.s_freq = s_freq
 
     return output
 
 
+def resample_dataset(dataset, s_freq, chan=None, begsam=None, endsam=None,
+                     block_duration=60, out=None):
+    """Resample a whole recording with polyphase filtering, block by block,
+    without reading it all in memory.
+
+    Parameters
+    ----------
+    dataset : instance of Dataset
+        recording to resample
+    s_freq : int or float
+        desired sampling frequency
+    chan : list of str, optional
+        channels to resample (default: all the channels)
+    begsam : int, optional
+        first sample (this sample will be included)
+    endsam : int, optional
+        last sample (this sample will NOT be included)
+    block_duration : float
+        duration of each block (in s of the original data), not including
+        the padding
+    out : ndarray or str or Path, optional
+        array (n_chan X n_resampled_samples) where to write the resampled
+        data, or path of the file to create as memmap. If None, it allocates
+        a new array.
+
+    Returns
+    -------
+    instance of ChanTime
+        resampled data, with one trial, whose data is "out"
+
+    Notes
+    -----
+    The results are the same as resample(method='polyphase') on the whole
+    recording.
+    """
+    orig_freq = dataset.header['s_freq']
+    if chan is None:
+        chan = dataset.header['chan_name']
+    chan = list(chan)
+    if begsam is None:
+        begsam = 0
+    if endsam is None:
+        endsam = dataset.header['n_samples']
+
+    up, down = rational_factors(orig_freq, s_freq)
+    n_smp = ceil((endsam - begsam) * up / down)
+
+    if out is None:
+        out = empty((len(chan), n_smp))
+    elif isinstance(out, (str, Path)):
+        out = memmap(str(out), dtype='float64', mode='w+',
+                     shape=(len(chan), n_smp))
+    if out.shape != (len(chan), n_smp):
+        raise ValueError('"out" should have shape ' + str((len(chan), n_smp)))
+
+    def read(beg, end):
+        return dataset.read_data(chan=chan, begsam=begsam + beg,
+                                 endsam=begsam + end).data[0]
+
+    resample_blocks(read, endsam - begsam, up, down,
+                    int(block_duration * orig_freq), out=out)
+    if isinstance(out, memmap):
+        out.flush()
+
+    data = ChanTime()
+    data.start_time = dataset.header['start_time']
+    data.s_freq = s_freq
+    data.axis['chan'] = empty(1, dtype='O')
+    data.axis['chan'][0] = asarray(chan, dtype='U')
+    data.axis['time'] = empty(1, dtype='O')
+    data.axis['time'][0] = begsam / orig_freq + arange(n_smp) / s_freq
+    data.data = empty(1, dtype='O')
+    data.data[0] = out
+
+    return data
+
+
+def rational_factors(orig_freq, s_freq, max_denominator=1000):
+    """Approximate the ratio between sampling frequencies with a fraction.
+
+    Parameters
+    ----------
+    orig_freq : float
+        original sampling frequency
+    s_freq : float
+        desired sampling frequency
+    max_denominator : int
+        largest factor of decimation
+
+    Returns
+    -------
+    int
+        factor of upsampling
+    int
+        factor of downsampling
+    """
+    ratio = Fraction(s_freq / orig_freq).limit_denominator(max_denominator)
+    if not isclose(ratio, s_freq / orig_freq, rel_tol=1e-9):
+        lg.warning('Resampling ratio approximated as {0}, so the effective '
+                   'sampling frequency is {1:.4f} Hz'.format(
+                       ratio, float(ratio * orig_freq)))
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=32)
+def design_antialias(up, down):
+    """Anti-aliasing FIR filter for resample_poly (memoized).
+
+    Parameters
+    ----------
+    up : int
+        factor of upsampling
+    down : int
+        factor of downsampling
+
+    Returns
+    -------
+    ndarray
+        FIR filter, the same as the default of scipy.signal.resample_poly
+        (resample_poly makes a copy of it, so it can be shared)
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0))
+
+
+def resample_blocks(read, n_in, up, down, block, out=None):
+    """Polyphase resampling of a long signal in blocks.
+
+    Parameters
+    ----------
+    read : function
+        it takes the first and last sample (first included, last excluded) and
+        returns the data (time as last dimension)
+    n_in : int
+        number of samples in the signal
+    up : int
+        factor of upsampling
+    down : int
+        factor of downsampling
+    block : int
+        number of input samples in each block (rounded to a multiple of down)
+    out : ndarray, optional
+        where to write the resampled signal (time as last dimension)
+
+    Returns
+    -------
+    ndarray
+        resampled signal, the same as resample_poly on the whole signal
+
+    Notes
+    -----
+    Each block starts at an input sample which falls exactly on an output
+    sample and it's padded on both sides by the length of the anti-aliasing
+    filter, so the output does not depend on the size of the blocks.
+    """
+    h = design_antialias(up, down)
+    half_len = (len(h) - 1) // 2
+    n_out = ceil(n_in * up / down)
+
+    # padding and block must be multiple of down, so that they're an integer
+    # number of output samples
+    pad = ceil((half_len / up + 1) / down) * down
+    block = max(block // down, 1) * down
+
+    for beg in range(0, n_in, block):
+        end = min(beg + block, n_in)
+        beg_pad = max(beg - pad, 0)
+        end_pad = min(end + pad, n_in)
+
+        x = read(beg_pad, end_pad)
+        # zeros outside the signal, as resample_poly does
+        x_pad = zeros(x.shape[:-1] + (end + pad - (beg - pad), ))
+        x_pad[..., beg_pad - (beg - pad):end_pad - (beg - pad)] = x
+
+        y = resample_poly(x_pad, up, down, axis=-1, window=h)
+
+        if out is None:
+            out = empty(x.shape[:-1] + (n_out, ))
+        beg_out = beg * up // down
+        end_out = min(ceil(end * up / down), n_out)
+        skip = pad * up // down
+        out[..., beg_out:end_out] = y[..., skip:skip + end_out - beg_out]
+
+    return out
+
+
 def fetch(dataset, annot, cat=(0, 0, 0, 0), evt_type=None, stage=None,
           cycle=None, chan_full=None, epoch=None, epoch_dur=30,
           epoch_overlap=0, epoch_step=None, reject_epoch=False,
@@ -696,6 +1215,7 @@ def _create_data(data, active_chan, ref_chan=[], grp_name=None):
     data1.data[0] = nan_to_num(data1.data[0])
 
     all_chan_grp_name = []
+    labels = list(data1.axis['chan'][0])
 
     for i, chan in enumerate(active_chan):
         chan_grp_name = chan
@@ -703,8 +1223,7 @@ def _create_data(data, active_chan, ref_chan=[], grp_name=None):
             chan_grp_name = chan + ' (' + grp_name + ')'
         all_chan_grp_name.append(chan_grp_name)
 
-        dat = data1(chan=chan, trial=0)
-        output.data[0][i, :] = dat
+        output.data[0][i, :] = data1.data[0][labels.index(chan)]
 
     output.axis['chan'][0] = asarray(all_chan_grp_name, dtype='U')
 
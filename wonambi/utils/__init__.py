@@ -1,7 +1,17 @@
 """Package containing additional functions and classes, such as:
     - exceptions
     - simulate (functions to create fake data, channels for testing purposes)
+    - table (write columns of values to CSV/TSV, npz, parquet or feather)
 
 """
 from .exceptions import UnrecognizedFormat, MissingDependency
-from .simulate import create_data, create_channels
+from .lazy import lazy_attributes
+
+# imported only when used (PEP 562), because simulate imports wonambi.attr
+# and table tries to import pandas
+_LAZY = {'create_data': '.simulate',
+         'create_channels': '.simulate',
+         'write_table': '.table',
+         }
+
+__getattr__, __dir__ = lazy_attributes(__name__, _LAZY, globals())
@@ -0,0 +1,41 @@
+"""Import the attributes of a package only when they are used (PEP 562)."""
+from importlib import import_module
+
+
+def lazy_attributes(package, lazy, namespace):
+    """Module-level __getattr__ and __dir__ for a package.
+
+    Parameters
+    ----------
+    package : str
+        name of the package (its __name__)
+    lazy : dict
+        name of each attribute and the module (relative to the package) where
+        it is defined, or a function without arguments which returns the
+        attribute
+    namespace : dict
+        globals() of the package, where each attribute is stored the first
+        time it's used
+
+    Returns
+    -------
+    function
+        __getattr__ of the package
+    function
+        __dir__ of the package
+    """
+    def __getattr__(name):
+        if name not in lazy:
+            raise AttributeError(
+                f'module {package!r} has no attribute {name!r}')
+        if callable(lazy[name]):
+            value = lazy[name]()
+        else:
+            value = getattr(import_module(lazy[name], package), name)
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(lazy))
+
+    return __getattr__, __dir__
@@ -0,0 +1,149 @@
+"""Write tables (one value per row and column) column by column, instead of
+row by row, as CSV/TSV (with the layout used by the exports in wonambi), npz,
+parquet or feather.
+"""
+from csv import writer
+from logging import getLogger
+from pathlib import Path
+
+from numpy import asarray, empty, savez
+
+from .exceptions import MissingDependency
+
+lg = getLogger(__name__)
+
+TABLE_FORMATS = ('.csv', '.tsv', '.npz', '.parquet', '.feather')
+# same as the default of csv.writer
+LINETERMINATOR = '\r\n'
+# number of rows converted to text at once
+CHUNK_ROWS = 10000
+
+
+def write_table(filename, columns, preamble=(), summary=()):
+    """Write table to file. The format depends on the extension of filename.
+
+    Parameters
+    ----------
+    filename : str or Path
+        output file. If the extension is '.npz', '.parquet' or '.feather', the
+        columns are stored with their name (parquet and feather need pandas).
+        Otherwise, it's a text file with comma-separated values (or tab, if
+        the extension is '.tsv').
+    columns : list of tuple
+        each tuple has (name, heading, values), where name is a short
+        identifier (used in npz, parquet, feather), heading is the text in
+        the heading row of CSV/TSV and values is a vector with one value per
+        row
+    preamble : list of list
+        rows written before the heading row
+    summary : list of list
+        rows written between the heading row and the data
+
+    Notes
+    -----
+    In CSV/TSV, each column is converted to text at once and the values are
+    quoted only in the columns which are not numeric. The output is the same
+    as passing each row to csv.writer.
+
+    In npz, preamble and summary (if not empty) are stored as text arrays
+    (one row per row, padded with '') called 'preamble' and 'summary'. In
+    parquet and feather, they are stored as lists of text in DataFrame.attrs
+    (which pandas reads back since version 2.1).
+    """
+    filename = Path(filename)
+    suffix = filename.suffix.lower()
+    lg.info('Writing to ' + str(filename))
+
+    extra = {k: v for k, v in (('preamble', preamble), ('summary', summary))
+             if len(v)}
+
+    if suffix == '.npz':
+        arrays = {name: _to_array(values)
+                  for name, heading, values in columns}
+        arrays.update({k: _rows_to_array(v) for k, v in extra.items()})
+        savez(filename, **arrays)
+
+    elif suffix in ('.parquet', '.feather'):
+        # imported only here, because pandas is slow to import
+        try:
+            from pandas import DataFrame
+        except ImportError as err:
+            DataFrame = MissingDependency(err)
+
+        df = DataFrame({name: _to_array(values)
+                        for name, heading, values in columns})
+        df.attrs.update({k: _rows_to_text(v) for k, v in extra.items()})
+        if suffix == '.parquet':
+            df.to_parquet(filename)
+        else:
+            df.to_feather(filename)
+
+    else:
+        delimiter = '\t' if suffix == '.tsv' else ','
+        with filename.open('w', newline='') as f:
+            table_file = writer(f, delimiter=delimiter)
+            table_file.writerows(preamble)
+            if columns:
+                table_file.writerow([heading for name, heading, values
+                                     in columns])
+            table_file.writerows(summary)
+            if not columns:
+                return
+
+            n_rows = len(columns[0][2])
+            for i in range(0, n_rows, CHUNK_ROWS):
+                cells = [_to_text(values[i:i + CHUNK_ROWS], delimiter)
+                         for name, heading, values in columns]
+                f.write(''.join(delimiter.join(row) + LINETERMINATOR
+                                for row in zip(*cells)))
+
+
+def _to_array(values):
+    """Make sure that text columns (such as None for missing values) can be
+    stored without pickle."""
+    try:
+        values = asarray(values)
+    except ValueError:  # f.e. tuples mixed with None
+        values = _to_object_array(values)
+    if values.ndim != 1:
+        values = _to_object_array(values)
+    if values.dtype == 'O':
+        values = asarray(['' if x is None else str(x) for x in values])
+    return values
+
+
+def _rows_to_text(rows):
+    """Rows of the preamble or summary, as lists of text."""
+    return [['' if x is None else str(x) for x in row] for row in rows]
+
+
+def _rows_to_array(rows):
+    """Rows of the preamble or summary, as 2d text array (padded with '')."""
+    rows = _rows_to_text(rows)
+    n_col = max(len(row) for row in rows)
+    return asarray([row + [''] * (n_col - len(row)) for row in rows])
+
+
+def _to_object_array(values):
+    output = empty(len(values), dtype='O')
+    for i, x in enumerate(values):
+        output[i] = x
+    return output
+
+
+def _to_text(values, delimiter):
+    """Format one column as text, as the csv writer would (one column at a
+    time is much faster than one row at a time)."""
+    if hasattr(values, 'dtype') and values.dtype.kind in 'biuf':
+        # same text as str() of each value (but float32 is not converted to
+        # python float, which would show the rounding error)
+        return values.astype(str).tolist()
+
+    special = (delimiter, '"', '\n', '\r')
+    text = []
+    for x in values:
+        x = '' if x is None else str(x)
+        if any(c in x for c in special):
+            x = '"' + x.replace('"', '""') + '"'
+        text.append(x)
+    return text
@@ -64,6 +64,10 @@ from .utils import (FormStr, FormInt, FormFloat, FormBool, FormMenu, FormRadio,
 
 lg = getLogger(__name__)
 
+# if the selected signal is larger than this (in bytes), it's read while
+# computing the analyses, instead of being kept in memory
+MAX_SIGNAL_IN_MEMORY = 2 ** 30
+
 
 class AnalysisDialog(ChannelDialog):
     """Dialog for specifying various types of analyses: per event, per epoch or
@@ -1256,12 +1260,20 @@ class AnalysisDialog(ChannelDialog):
                 error_dialog.showMessage(msg)
                 return
 
+            max_s_freq = self.parent.value('max_s_freq')
+            # 4 bytes per value (float32)
+            lazy = (self.data.signal_size(chan, max_s_freq) * 4 >
+                    MAX_SIGNAL_IN_MEMORY)
+            if lazy:
+                lg.info('Signal is too large to keep in memory, it will be '
+                        'read while computing each analysis')
+
             ding = self.data.read_data(chan,
                                ref_chan=self.one_grp['ref_chan'],
                                grp_name=self.one_grp['name'],
                                concat_chan=concat_chan,
-                               max_s_freq=self.parent.value('max_s_freq'),
-                               parent=self)
+                               max_s_freq=max_s_freq,
+                               parent=self, lazy=lazy)
 
             if not ding:
                 self.parent.statusBar().showMessage('Process interrupted.')
@@ -1488,6 +1500,32 @@ class AnalysisDialog(ChannelDialog):
         -------
         instance of Segments
             same object with transformed data as 'trans_data' (ChanTime)
+
+        Notes
+        -----
+        If the data is read only while iterating (lazy), each segment is
+        transformed after it's read.
+        """
+        if data.lazy:
+            data.transform = self.transform_segment
+        else:
+            for seg in data:
+                self.transform_segment(seg)
+
+        return data
+
+    def transform_segment(self, seg):
+        """Apply pre-processing transformation to one segment.
+
+        Parameters
+        ---------
+        seg : dict
+            segment including 'data' (ChanTime)
+
+        Returns
+        -------
+        dict
+            same segment with transformed data as 'trans_data' (ChanTime)
         """
         trans = self.trans
         differ = trans['diff'].get_value()
@@ -1495,46 +1533,45 @@ class AnalysisDialog(ChannelDialog):
         notch1 = trans['notch1'].get_value()
         notch2 = trans['notch2'].get_value()
 
-        for seg in data:
-            dat = seg['data']
-
-            if differ:
-                dat = math(dat, operator=diff, axis='time')
-
-            if bandpass != 'none':
-                order = trans['bp']['order'][1].get_value()
-                f1 = trans['bp']['f1'][1].get_value()
-                f2 = trans['bp']['f2'][1].get_value()
-
-                if f1 == '':
-                    f1 = None
-                if f2 == '':
-                    f2 = None
-
-                dat = filter_(dat, low_cut=f1, high_cut=f2, order=order,
-                              ftype=bandpass)
-
-            if notch1 != 'none':
-                order = trans['n1']['order'][1].get_value()
-                cf = trans['n1']['cf'][1].get_value()
-                hbw = trans['n1']['bw'][1].get_value() / 2.0
-                lo_pass = cf - hbw
-                hi_pass = cf + hbw
-                dat = filter_(dat, low_cut=hi_pass, order=order, ftype=notch1)
-                dat = filter_(dat, high_cut=lo_pass, order=order, ftype=notch1)
-
-            if notch2 != 'none':
-                order = trans['n2']['order'][1].get_value()
-                cf = trans['n2']['cf'][1].get_value()
-                hbw = trans['n2']['bw'][1].get_value() / 2.0
-                lo_pass = cf - hbw
-                hi_pass = cf + hbw
-                dat = filter_(dat, low_cut=hi_pass, order=order, ftype=notch1)
-                dat = filter_(dat, high_cut=lo_pass, order=order, ftype=notch1)
-
-            seg['trans_data'] = dat
+        dat = seg['data']
 
-        return data
+        if differ:
+            dat = math(dat, operator=diff, axis='time')
+
+        if bandpass != 'none':
+            order = trans['bp']['order'][1].get_value()
+            f1 = trans['bp']['f1'][1].get_value()
+            f2 = trans['bp']['f2'][1].get_value()
+
+            if f1 == '':
+                f1 = None
+            if f2 == '':
+                f2 = None
+
+            dat = filter_(dat, low_cut=f1, high_cut=f2, order=order,
+                          ftype=bandpass)
+
+        if notch1 != 'none':
+            order = trans['n1']['order'][1].get_value()
+            cf = trans['n1']['cf'][1].get_value()
+            hbw = trans['n1']['bw'][1].get_value() / 2.0
+            lo_pass = cf - hbw
+            hi_pass = cf + hbw
+            dat = filter_(dat, low_cut=hi_pass, order=order, ftype=notch1)
+            dat = filter_(dat, high_cut=lo_pass, order=order, ftype=notch1)
+
+        if notch2 != 'none':
+            order = trans['n2']['order'][1].get_value()
+            cf = trans['n2']['cf'][1].get_value()
+            hbw = trans['n2']['bw'][1].get_value() / 2.0
+            lo_pass = cf - hbw
+            hi_pass = cf + hbw
+            dat = filter_(dat, low_cut=hi_pass, order=order, ftype=notch1)
+            dat = filter_(dat, high_cut=lo_pass, order=order, ftype=notch1)
+
+        seg['trans_data'] = dat
+
+        return seg
 
     def save_as(self):
         """Dialog for getting name, location of data export file."""
@@ -1613,7 +1650,8 @@ class AnalysisDialog(ChannelDialog):
         if freq['nfft_fixed'].isChecked():
             n_fft = int(freq['nfft_fixed_val'].get_value())
         elif freq['nfft_zeropad'].isChecked():
-            n_fft = max([x['data'].number_of('time')[0] for x in self.data])
+            # from the times of the segments, without reading the signal
+            n_fft = max(self.data.n_samples(self.parent.value('max_s_freq')))
             lg.info('n_fft is zero-padded to: ' + str(n_fft))
         elif freq['nfft_seg'].isChecked():
             n_fft = None
@@ -1752,6 +1790,8 @@ class AnalysisDialog(ChannelDialog):
                     Sxx.data[0][j,:] = dat / norm_dat
 
             new_seg['data'] = Sxx
+            # only the spectrum is kept, not the signal
+            new_seg.pop('trans_data', None)
             xfreq.append(new_seg)
 
             progress.setValue(i)
@@ -1984,9 +2024,8 @@ class AnalysisDialog(ChannelDialog):
 
     def compute_pac(self):
         """Compute phase-amplitude coupling values from data."""
-        n_segments = sum([len(x['data'].axis['chan'][0]) for x in self.data])
         progress = QProgressDialog('Computing PAC', 'Abort',
-                                   0, n_segments - 1, self)
+                                   0, len(self.data), self)
         progress.setWindowModality(Qt.ApplicationModal)
 
         pac = self.pac
@@ -2032,103 +2071,87 @@ class AnalysisDialog(ChannelDialog):
         elif optimize == 'False':
             optimize = False
 
-        xpac = {}
-
-        all_chan = sorted(set(
-                [x for y in self.data for x in y['data'].axis['chan'][0]]))
-
-        counter = 0
-        for chan in all_chan:
-            batch = []
-            batch_dat = []
-
-            for i, j in enumerate(self.data):
-
-                if self.pac['prep'].get_value():
-                    data = j['trans_data']
-                else:
-                    data = j['data']
-
-                if chan in data.axis['chan'][0]:
-                    batch.append(j)
-
-                    if idpac[1] == 1:
-                        batch_dat.append(data(chan=chan)[0])
-
-            xpac[chan] = {}
-            xpac[chan]['data'] = zeros((len(batch), len(famp), len(fpha)))
-            xpac[chan]['times'] = []
-            xpac[chan]['duration'] = []
-            xpac[chan]['stage'] = []
-            xpac[chan]['cycle'] = []
-            xpac[chan]['name'] = []
-            xpac[chan]['n_stitch'] = []
-
+        def _filterfit(sf, dat):
+            """PAC (and p-values and surrogates) of one segment."""
+            out = p.filterfit(sf=sf, xpha=dat, xamp=None, axis=1, traxis=0,
+                              nperm=nperm, optimize=optimize,
+                              get_pval=get_pval, get_surro=get_surro,
+                              njobs=njobs)
+            keys = ['data']
             if get_pval:
-                xpac[chan]['pval'] = zeros((len(batch), len(famp), len(fpha)))
-
-            if idpac[2] > 0:
-                xpac[chan]['surro'] = zeros((len(batch), nperm,
-                                            len(famp), len(fpha)))
-
-            for i, j in enumerate(batch):
-                progress.setValue(counter)
-                counter += 1
+                keys.append('pval')
+            if get_surro:
+                keys.append('surro')
+            if len(keys) == 1:
+                out = (out, )
+            return {k: x[..., 0] for k, x in zip(keys, out)}
+
+        # one pass over the segments (which may be read only while iterating):
+        # only the values of each channel are kept, if the trials are swapped
+        xpac = {}
+        results = {}
+        batch_dat = {}
+        for counter, j in enumerate(self.data):
+            progress.setValue(counter)
 
-                if self.pac['prep'].get_value():
-                    data = j['trans_data']
-                else:
-                    data = j['data']
+            if self.pac['prep'].get_value():
+                data = j['trans_data']
+            else:
+                data = j['data']
 
-                sf = data.s_freq
+            sf = data.s_freq
+            timeline = data.axis['time'][0]
 
-                if idpac[1] == 1:
-                    new_batch_dat = list(batch_dat)
-                    new_batch_dat.insert(0, new_batch_dat.pop(i))
-                    dat = asarray(new_batch_dat)
-                else:
-                    dat = data(chan=chan)[0]
+            for chan in data.axis['chan'][0]:
+                if chan not in xpac:
+                    xpac[chan] = {'times': [], 'duration': [], 'stage': [],
+                                  'cycle': [], 'name': [], 'n_stitch': []}
+                    results[chan] = []
+                    batch_dat[chan] = []
 
-                timeline = data.axis['time'][0]
                 xpac[chan]['times'].append((timeline[0], timeline[-1]))
-                duration = len(timeline) / sf
-                xpac[chan]['duration'].append(duration)
+                xpac[chan]['duration'].append(len(timeline) / sf)
                 xpac[chan]['stage'].append(j['stage'])
                 xpac[chan]['cycle'].append(j['cycle'])
                 xpac[chan]['name'].append(j['name'])
                 xpac[chan]['n_stitch'].append(j['n_stitch'])
 
-                out = p.filterfit(sf=sf, xpha=dat, xamp=None, axis=1, traxis=0,
-                                  nperm=nperm, optimize=optimize,
-                                  get_pval=get_pval, get_surro=get_surro,
-                                  njobs=njobs)
-
-                if get_pval:
-
-                    if get_surro:
-                        (xpac[chan]['data'][i, :, :],
-                         xpac[chan]['pval'][i, :, :],
-                         xpac[chan]['surro'][i, :, :, :]) = (out[0][:, :, 0],
-                             out[1][:, :, 0], out[2][:, :, :, 0])
-                    else:
-                        (xpac[chan]['data'][i, :, :],
-                         xpac[chan]['pval'][i, :, :]) = (out[0][:, :, 0],
-                             out[1][:, :, 0])
-
-                elif get_surro:
-                    (xpac[chan]['data'][i, :, :],
-                     xpac[chan]['surro'][i, :, :, :]) = (out[0][:, :, 0],
-                         out[1][:, :, :, 0])
-
+                if idpac[1] == 1:
+                    batch_dat[chan].append((sf, data(chan=chan)[0]))
                 else:
-                    xpac[chan]['data'][i, :, :] = out[:, :, 0]
+                    results[chan].append(_filterfit(sf, data(chan=chan)[0]))
 
-                if progress.wasCanceled():
-                    msg = 'Analysis canceled by user.'
-                    self.parent.statusBar().showMessage(msg)
-                    return
+            if progress.wasCanceled():
+                msg = 'Analysis canceled by user.'
+                self.parent.statusBar().showMessage(msg)
+                return
+
+        if idpac[1] == 1:
+            # each trial is compared with all the others of the same channel
+            n_trials = sum(len(x) for x in batch_dat.values())
+            progress.setMaximum(len(self.data) + n_trials)
+            counter = len(self.data)
+            for chan, trials in batch_dat.items():
+                for i, (sf, one_trial) in enumerate(trials):
+                    progress.setValue(counter)
+                    counter += 1
+
+                    dat = [x[1] for x in trials]
+                    dat.insert(0, dat.pop(i))
+                    results[chan].append(_filterfit(sf, asarray(dat)))
+
+                    if progress.wasCanceled():
+                        msg = 'Analysis canceled by user.'
+                        self.parent.statusBar().showMessage(msg)
+                        return
 
-        #progress.setValue(counter)
+        xpac = {chan: xpac[chan] for chan in sorted(xpac)}
+        for chan, one_xpac in xpac.items():
+            for k in results[chan][0]:
+                one_xpac[k] = asarray([x[k] for x in results[chan]])
+            if idpac[2] > 0 and 'surro' not in one_xpac:
+                one_xpac['surro'] = zeros((len(results[chan]), nperm,
+                                           len(famp), len(fpha)))
 
         return xpac, fpha, famp
 
@@ -2214,7 +2237,9 @@ class AnalysisDialog(ChannelDialog):
             slopes = None
 
         evt_dat = event_params(self.data, params, band=band, slopes=slopes,
-                               prep=prep, parent=self)
+                               prep=prep, parent=self, table=True)
+        if evt_dat is None:
+            return None, None, None
 
         count = None
         density = None
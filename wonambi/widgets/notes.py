@@ -13,14 +13,15 @@ TODO:
     too complicated. If you do that, you can remove all "if self.annot is None"
     that are marked with "# remove if buttons are disabled"
 """
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from functools import partial
 from logging import getLogger
-from numpy import asarray, floor
+from numpy import asarray, floor, isclose
 from os.path import basename, splitext
 from pathlib import Path
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
 from PyQt5.QtGui import QIcon, QColor
 from PyQt5.QtWidgets import (QAbstractItemView,
                              QAction,
@@ -42,6 +43,7 @@ from PyQt5.QtWidgets import (QAbstractItemView,
                              QProgressDialog,
                              QPushButton,
                              QSpinBox,
+                             QTableView,
                              QTableWidget,
                              QTableWidgetItem,
                              QTabWidget,
@@ -117,6 +119,15 @@ class ConfigNotes(Config):
         flayout = QFormLayout()
         box1.setLayout(flayout)
 
+        box3 = QGroupBox('Annotation File')
+
+        self.index['annot_save_delay'] = FormFloat()
+
+        flayout = QFormLayout()
+        flayout.addRow('Save annotations after this many seconds without '
+                       'edits', self.index['annot_save_delay'])
+        box3.setLayout(flayout)
+
         box2 = QGroupBox('Stages')
 
         self.index['scoring_window'] = FormInt()
@@ -130,11 +141,208 @@ class ConfigNotes(Config):
         main_layout.addWidget(box0)
         main_layout.addWidget(box1)
         main_layout.addWidget(box2)
+        main_layout.addWidget(box3)
         main_layout.addStretch(1)
 
         self.setLayout(main_layout)
 
 
+class AnnotationsModel(QAbstractTableModel):
+    """Table model with the bookmarks and events, sorted by start time.
+
+    The text and the color of each cell are only computed when the cell is
+    displayed, so that it's fast to show tables with many events.
+
+    Parameters
+    ----------
+    parent : instance of Notes
+        the notes widget, to read the settings
+
+    Attributes
+    ----------
+    annots : list of dict
+        bookmarks and events as in Annotations.get_events, with additionally
+        'type' ('bookmark' or 'event')
+    """
+    headers = ['Start', 'Duration', 'Text', 'Type', 'Channel']
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+        self.annots = []
+        self.starts = []
+        self.start_time = None
+        self.colors = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.annots)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        mrk = self.annots[index.row()]
+
+        if role == Qt.DisplayRole:
+            col = index.column()
+            if col == 0:
+                return (self.start_time +
+                        timedelta(seconds=mrk['start'])).strftime('%H:%M:%S')
+            elif col == 1:
+                dur = timedelta(seconds=mrk['end'] - mrk['start'])
+                return '{0:02d}.{1:03d}'.format(dur.seconds,
+                                                round(dur.microseconds / 1000))
+            elif col == 2:
+                return str(mrk['name'])
+            elif col == 3:
+                return mrk['type']
+            elif col == 4:
+                chan = mrk['chan']
+                if isinstance(chan, (tuple, list)):
+                    chan = ', '.join(chan)
+                return chan
+
+        elif role == Qt.ForegroundRole:
+            return self.color(mrk)
+
+        return None
+
+    def color(self, mrk):
+        """Color of the row, cached for each event type."""
+        if mrk['type'] == 'bookmark':
+            key = None
+        else:
+            key = str(mrk['name'])
+
+        if key not in self.colors:
+            if key is None:
+                color = self.parent.parent.value('annot_bookmark_color')
+            else:
+                color = convert_name_to_color(key)
+            self.colors[key] = QColor(color)
+
+        return self.colors[key]
+
+    def set_annotations(self, bookmarks, events, start_time):
+        """Replace all the rows.
+
+        Parameters
+        ----------
+        bookmarks : list of dict
+            bookmarks, as in Annotations.get_bookmarks
+        events : list of dict
+            events, as in Annotations.get_events
+        start_time : datetime
+            start time of the recording, to show the clock time
+        """
+        for mrk in bookmarks:
+            mrk['type'] = 'bookmark'
+        for mrk in events:
+            mrk['type'] = 'event'
+
+        self.beginResetModel()
+        self.annots = sorted(bookmarks + events, key=lambda x: x['start'])
+        self.starts = [mrk['start'] for mrk in self.annots]
+        self.start_time = start_time
+        self.colors = {}
+        self.endResetModel()
+
+    def insert_annotation(self, mrk, annot_type):
+        """Insert one bookmark or event, keeping the rows sorted.
+
+        Parameters
+        ----------
+        mrk : dict
+            bookmark or event, with 'name', 'start', 'end', 'chan'
+        annot_type : str
+            'bookmark' or 'event'
+
+        Returns
+        -------
+        int
+            index of the new row
+        """
+        mrk = dict(mrk, type=annot_type)
+        row = bisect_right(self.starts, mrk['start'])
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.annots.insert(row, mrk)
+        self.starts.insert(row, mrk['start'])
+        self.endInsertRows()
+        return row
+
+    def remove_annotations(self, annot_type, name=None, time=None,
+                           chan=None):
+        """Remove the rows which match how Annotations.remove_bookmark (for
+        bookmarks) and Annotations.remove_event (for events) select them.
+
+        Parameters
+        ----------
+        annot_type : str
+            'bookmark' or 'event'
+        name : str, optional
+            name of the bookmarks or events (if None, all of them)
+        time : tuple of float, optional
+            start and end time (events) or period of interest (bookmarks)
+        chan : str or list of str, optional
+            channels of the bookmarks or events
+        """
+        if isinstance(chan, (tuple, list)):
+            chan = ', '.join(chan)
+
+        for row in reversed(range(len(self.annots))):
+            mrk = self.annots[row]
+            if mrk['type'] != annot_type:
+                continue
+            if name is not None and mrk['name'] != name:
+                continue
+            if chan is not None and ', '.join(mrk['chan']) != chan:
+                continue
+
+            if time is None:
+                match = True
+            elif annot_type == 'bookmark':
+                match = time[0] <= mrk['end'] and time[1] >= mrk['start']
+            else:
+                match = (isclose(time[0], mrk['start']) and
+                         isclose(time[1], mrk['end']))
+
+            if match:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.annots[row]
+                del self.starts[row]
+                self.endRemoveRows()
+
+    def find_row(self, ev_start, ev_end):
+        """Return the row of the event with this start and end time (or with
+        the same start time or end time)."""
+        row = bisect_right(self.starts, ev_start) - 1
+        while row >= 0 and self.starts[row] == ev_start:
+            if self.annots[row]['end'] == ev_end:
+                return row
+            row -= 1
+
+        for i, mrk in enumerate(self.annots):
+            if mrk['start'] == ev_start:
+                return i
+
+        for i, mrk in enumerate(self.annots):
+            if mrk['end'] == ev_end:
+                return i
+
+        raise ValueError
+
+
 class Notes(QTabWidget):
     """Widget that contains information about sleep scoring.
 
@@ -164,8 +372,10 @@ class Notes(QTabWidget):
         area to which you add the QGroupBox with the list of events as checkbox
     idx_eventtype_list : list of QCheckBox
         list of checkboxes with the event types
-    idx_annot_list : QTableWidget
+    idx_annot_list : QTableView
         table with the bookmarks and events in the annotations
+    annot_model : AnnotationsModel
+        model with the bookmarks and events shown in idx_annot_list
 
     idx_eventtype : QComboBox
         Combo box of the event types for the toolbar
@@ -191,6 +401,7 @@ class Notes(QTabWidget):
         self.idx_eventtype_scroll = None
         self.idx_eventtype_list = []
         self.idx_annot_list = None
+        self.annot_model = None
 
         self.idx_eventtype = None
         self.idx_stage = None
@@ -246,8 +457,10 @@ class Notes(QTabWidget):
 
         """ ------ ANNOTATIONS ------ """
         tab2 = QWidget()
-        tab_annot = QTableWidget()
+        tab_annot = QTableView()
         self.idx_annot_list = tab_annot
+        self.annot_model = AnnotationsModel(self)
+        tab_annot.setModel(self.annot_model)
         delete_row = QPushButton('Delete')
         delete_row.clicked.connect(self.delete_row)
 
@@ -258,15 +471,13 @@ class Notes(QTabWidget):
         scroll.setWidget(evttype_group)
         self.idx_eventtype_scroll = scroll
 
-        tab_annot.setColumnCount(5)
-        tab_annot.setHorizontalHeaderLabels(['Start', 'Duration', 'Text',
-                                             'Type', 'Channel'])
         tab_annot.horizontalHeader().setStretchLastSection(True)
         tab_annot.setSelectionBehavior(QAbstractItemView.SelectRows)
         tab_annot.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        go_to_annot = lambda r, c: self.go_to_marker(r, c, 'annot')
-        tab_annot.cellDoubleClicked.connect(go_to_annot)
-        tab_annot.cellDoubleClicked.connect(self.reset_current_row)
+        go_to_annot = lambda idx: self.go_to_marker(idx.row(), idx.column(),
+                                                    'annot')
+        tab_annot.doubleClicked.connect(go_to_annot)
+        tab_annot.doubleClicked.connect(self.reset_current_row)
 
         layout = QVBoxLayout()
         layout.addWidget(self.idx_eventtype_scroll, stretch=1)
@@ -518,11 +729,16 @@ class Notes(QTabWidget):
         new : bool
             if the xml_file should be a new file or an existing one
         """
+        if self.annot is not None:
+            self.annot.flush()
+
+        # 0 means that the file is written after each edit
+        save_delay = self.parent.value('annot_save_delay') or None
         if new:
             create_empty_annotations(xml_file, self.parent.info.dataset)
-            self.annot = Annotations(xml_file)
+            self.annot = Annotations(xml_file, save_delay=save_delay)
         else:
-            self.annot = Annotations(xml_file)
+            self.annot = Annotations(xml_file, save_delay=save_delay)
 
         self.enable_events()
 
@@ -636,8 +852,12 @@ class Notes(QTabWidget):
             name = answer[0]
             self.annot.add_bookmark(name, time)
             lg.info('Added Bookmark ' + name + 'at ' + str(time))
-
-        self.update_annotations()
+            self.annot_model.insert_annotation({'name': name,
+                                                'start': time[0],
+                                                'end': time[1],
+                                                'chan': [''],
+                                                }, 'bookmark')
+            self.display_annotations()
 
     def remove_bookmark(self, time):
         """User removes bookmark.
@@ -648,7 +868,8 @@ class Notes(QTabWidget):
             start and end of the new bookmark, in s
         """
         self.annot.remove_bookmark(time=time)
-        self.update_annotations()
+        self.annot_model.remove_annotations('bookmark', time=time)
+        self.display_annotations()
 
     def update_dataset_marker(self):
         """Update markers which are in the dataset. It always updates the list
@@ -768,71 +989,38 @@ class Notes(QTabWidget):
         start_time = self.parent.overview.start_time
 
         if self.parent.notes.annot is None:
-            all_annot = []
+            bookmarks = []
+            events = []
         else:
             bookmarks = self.parent.notes.annot.get_bookmarks()
             events = self.get_selected_events()
 
-            all_annot = bookmarks + events
-            all_annot = sorted(all_annot, key=lambda x: x['start'])
-
-        self.idx_annot_list.clearContents()
-        self.idx_annot_list.setRowCount(len(all_annot))
-
-        for i, mrk in enumerate(all_annot):
-            abs_time = (start_time +
-                        timedelta(seconds=mrk['start'])).strftime('%H:%M:%S')
-            dur = timedelta(seconds=mrk['end'] - mrk['start'])
-            duration = '{0:02d}.{1:03d}'.format(dur.seconds,
-                                                round(dur.microseconds / 1000))
-
-            item_time = QTableWidgetItem(abs_time)
-            item_duration = QTableWidgetItem(duration)
-            item_name = QTableWidgetItem(str(mrk['name']))
-            if mrk in bookmarks:
-                item_type = QTableWidgetItem('bookmark')
-                color = self.parent.value('annot_bookmark_color')
-            else:
-                item_type = QTableWidgetItem('event')
-                color = convert_name_to_color(str(mrk['name']))
-            chan = mrk['chan']
-            if isinstance(chan, (tuple, list)):
-                chan = ', '.join(chan)
-            item_chan = QTableWidgetItem(chan)
-
-            item_time.setForeground(QColor(color))
-            item_duration.setForeground(QColor(color))
-            item_name.setForeground(QColor(color))
-            item_type.setForeground(QColor(color))
-            item_chan.setForeground(QColor(color))
-
-            self.idx_annot_list.setItem(i, 0, item_time)
-            self.idx_annot_list.setItem(i, 1, item_duration)
-            self.idx_annot_list.setItem(i, 2, item_name)
-            self.idx_annot_list.setItem(i, 3, item_type)
-            self.idx_annot_list.setItem(i, 4, item_chan)
-
-        # store information about the time as list (easy to access)
-        annot_start = [ann['start'] for ann in all_annot]
-        annot_end = [ann['end'] for ann in all_annot]
-        annot_name = [ann['name'] for ann in all_annot]
-        self.idx_annot_list.setProperty('start', annot_start)
-        self.idx_annot_list.setProperty('end', annot_end)
-        self.idx_annot_list.setProperty('name', annot_name)
+        self.annot_model.set_annotations(bookmarks, events, start_time)
+        self.display_annotations()
 
+    def display_annotations(self):
+        """Show the bookmarks and events in traces and overview."""
         if self.parent.traces.data is not None:
             self.parent.traces.display_annotations()
         self.parent.overview.display_annotations()
 
+    def is_eventtype_shown(self, name):
+        """Whether the events of this type are listed in the table."""
+        for checkbox in self.idx_eventtype_list:
+            if checkbox.text() == name:
+                return checkbox.checkState() == Qt.Checked
+        return False
+
     def delete_row(self):
         """Delete bookmarks or event from annotations, based on row."""
         sel_model = self.idx_annot_list.selectionModel()
-        for row in sel_model.selectedRows():
-            i = row.row()
-            start = self.idx_annot_list.property('start')[i]
-            end = self.idx_annot_list.property('end')[i]
-            name = self.idx_annot_list.item(i, 2).text()
-            marker_event = self.idx_annot_list.item(i, 3).text()
+        selected = [self.annot_model.annots[row.row()]
+                    for row in sel_model.selectedRows()]
+        for mrk in selected:
+            start = mrk['start']
+            end = mrk['end']
+            name = mrk['name']
+            marker_event = mrk['type']
             if marker_event == 'bookmark':
                 self.annot.remove_bookmark(name=name, time=(start, end))
             else:
@@ -842,8 +1030,10 @@ class Notes(QTabWidget):
                     self.parent.traces.scene.removeItem(highlight)
                     highlight = None
                     self.parent.traces.event_sel = None
+            self.annot_model.remove_annotations(marker_event, name=name,
+                                                time=(start, end))
 
-        self.update_annotations()
+        self.display_annotations()
 
     def go_to_marker(self, row, col, table_type):
         """Move to point in time marked by the marker.
@@ -861,8 +1051,8 @@ class Notes(QTabWidget):
             marker_time = self.idx_marker.property('start')[row]
             marker_end_time = self.idx_marker.property('end')[row]
         else:
-            marker_time = self.idx_annot_list.property('start')[row]
-            marker_end_time = self.idx_annot_list.property('end')[row]
+            marker_time = self.annot_model.annots[row]['start']
+            marker_end_time = self.annot_model.annots[row]['end']
 
         window_length = self.parent.value('window_length')
 
@@ -892,24 +1082,9 @@ class Notes(QTabWidget):
         Returns
         -------
         int
-            index of event row in idx_annot_list QTableWidget
+            index of event row in idx_annot_list QTableView
         """
-        all_starts = self.idx_annot_list.property('start')
-        all_ends = self.idx_annot_list.property('end')
-
-        for i, (start, end) in enumerate(zip(all_starts, all_ends)):
-            if start == ev_start and end == ev_end:
-                return i
-
-        for i, start in enumerate(all_starts):
-            if start == ev_start:
-                return i
-
-        for i, end in enumerate(all_ends):
-            if end == ev_end:
-                return i
-
-        raise ValueError
+        return self.annot_model.find_row(ev_start, ev_end)
 
     def get_sleepstage(self, stage_idx=None):
         """Score the sleep stage, using shortcuts or combobox."""
@@ -1405,12 +1580,24 @@ class Notes(QTabWidget):
     def add_event(self, name, time, chan):
         """Action: add a single event."""
         self.annot.add_event(name, time, chan=chan)
-        self.update_annotations()
+        if self.is_eventtype_shown(name):
+            if isinstance(chan, (tuple, list)):
+                chan = ', '.join(chan)
+            elif chan is None:
+                chan = ''
+            self.annot_model.insert_annotation({'name': name,
+                                                'start': time[0],
+                                                'end': time[1],
+                                                'chan': chan.split(', '),
+                                                }, 'event')
+        self.display_annotations()
 
     def remove_event(self, name=None, time=None, chan=None):
         """Action: remove single event."""
         self.annot.remove_event(name=name, time=time, chan=chan)
-        self.update_annotations()
+        self.annot_model.remove_annotations('event', name=name, time=time,
+                                            chan=chan)
+        self.display_annotations()
 
     def change_event_type(self, new_name=None, name=None, time=None,
                           chan=None):
@@ -1428,9 +1615,10 @@ class Notes(QTabWidget):
             else:
                 new_name = event_types[idx_name + 1]
 
-        self.annot.add_event(new_name, time, chan=chan)
         self.annot.remove_event(name=name, time=time, chan=chan)
-        self.update_annotations()
+        self.annot_model.remove_annotations('event', name=name, time=time,
+                                            chan=chan)
+        self.add_event(new_name, time, chan)
 
         return new_name
 
@@ -1658,6 +1846,8 @@ class Notes(QTabWidget):
         self.idx_annotations.setText('Load Annotation File...')
         self.idx_rater.setText('')
 
+        if self.annot is not None:
+            self.annot.flush()
         self.annot = None
         self.dataset_markers = None
 
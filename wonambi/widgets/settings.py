@@ -50,6 +50,7 @@ DEFAULTS['notes'] = {'marker_show': True,
                      'min_marker_dur': .1,
                      'min_marker_display_dur': .1,
                      'scoring_window': 30,
+                     'annot_save_delay': 2.,
                      }
 DEFAULTS['traces'] = {'n_time_labels': 3,
                       'y_distance': 50,
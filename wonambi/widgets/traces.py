@@ -822,7 +822,7 @@ class Traces(QGraphicsView):
                     if chk_event:
                         row = self.parent.notes.find_row(annot.marker.x(),
                                     annot.marker.x() + annot.marker.width())
-                        self.parent.notes.idx_annot_list.setCurrentCell(row, 0)
+                        self.parent.notes.idx_annot_list.selectRow(row)
                     break
 
         self.ready = True
@@ -1075,7 +1075,7 @@ class Traces(QGraphicsView):
 
         same_type = self.action['next_of_same_type'].isChecked()
         if same_type:
-            target = notes.idx_annot_list.item(row, 2).text()
+            target = notes.annot_model.annots[row]['name']
 
         if delete:
             notes.delete_row()
@@ -1084,14 +1084,15 @@ class Traces(QGraphicsView):
             self.parent.statusBar().showMessage(msg)
             row -= 1
 
-        if row + 1 == notes.idx_annot_list.rowCount():
+        if row + 1 == notes.annot_model.rowCount():
             return
 
         if not same_type:
             next_row = row + 1
         else:
             next_row = None
-            types = notes.idx_annot_list.property('name')[row + 1:]
+            types = [mrk['name']
+                     for mrk in notes.annot_model.annots[row + 1:]]
 
             for i, ty in enumerate(types):
                 if ty == target:
@@ -1103,7 +1104,7 @@ class Traces(QGraphicsView):
 
         self.current_event_row = next_row
         notes.go_to_marker(next_row, 0, 'annot')
-        notes.idx_annot_list.setCurrentCell(next_row, 0)
+        notes.idx_annot_list.selectRow(next_row)
 
     def change_event_type(self):
         """Action: change highlighted event's type by cycling through event